@@ -0,0 +1,169 @@
+"""
+Persistent embedding cache shared across jobs
+
+Embeddings are stored in SQLite under the app data root, keyed by a hash of
+(model_id, text). Least recently used entries are evicted once the cache grows
+beyond its size cap. Lookups don't write, the entries they hit are marked as
+used in memory and persisted with the next insert (or on close).
+
+The cache can be used from several threads, calls are serialized.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from emb3d import config
+
+# Stay well under SQLite's host parameter limit
+QUERY_CHUNK_SIZE = 500
+# Approximate per entry storage besides the vector (key, timestamp, btree cells)
+ENTRY_OVERHEAD_BYTES = 48
+
+
+def cache_path() -> Path:
+    return config.app_data_root() / "embeddings.sqlite"
+
+
+def cache_key(model_id: str, text: str) -> bytes:
+    """Content address for an input embedded with a given model"""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(model_id.encode())
+    hasher.update(b"\0")
+    hasher.update(text.encode())
+    return hasher.digest()
+
+
+def _chunks(items: Sequence, size: int) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class EmbeddingCache:
+    """SQLite backed embedding cache with LRU eviction"""
+
+    def __init__(self, path: Path, max_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Last use of the entries hit since the last write
+        self._touched: Dict[bytes, float] = {}
+        self._db.executescript(
+            f"""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS embeddings_last_used
+                ON embeddings (last_used);
+            CREATE TABLE IF NOT EXISTS stats (size_bytes INTEGER NOT NULL);
+            INSERT INTO stats SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM stats);
+            CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings
+            BEGIN
+                UPDATE stats SET size_bytes = size_bytes
+                    + length(NEW.vector) + {ENTRY_OVERHEAD_BYTES};
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings
+            BEGIN
+                UPDATE stats SET size_bytes = size_bytes
+                    - length(OLD.vector) - {ENTRY_OVERHEAD_BYTES};
+            END;
+            """
+        )
+
+    def get_many(self, model_id: str, inputs: List[str]) -> List[Optional[List[float]]]:
+        """Cached embeddings for the inputs, `None` for inputs that are not cached"""
+        keys = [cache_key(model_id, text) for text in inputs]
+        found = {}
+        with self._lock:
+            for chunk in _chunks(keys, QUERY_CHUNK_SIZE):
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                )
+                found.update(rows)
+            now = time.time()
+            self._touched.update((key, now) for key in found)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist()
+            if key in found
+            else None
+            for key in keys
+        ]
+
+    def put_many(self, model_id: str, inputs: List[str], embeddings) -> None:
+        """Cache embeddings, evicting least recently used entries if needed"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                # Keys are content addressed, an existing entry holds the same embedding
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (
+                    (
+                        cache_key(model_id, text),
+                        np.asarray(embedding, dtype=np.float32).tobytes(),
+                        now,
+                    )
+                    for text, embedding in zip(inputs, embeddings)
+                ),
+            )
+            self._flush_touched()
+            self._db.commit()
+            self._evict()
+
+    def size_bytes(self) -> int:
+        """Approximate size of the cached entries"""
+        with self._lock:
+            return self._size_bytes()
+
+    def _size_bytes(self) -> int:
+        return self._db.execute("SELECT size_bytes FROM stats").fetchone()[0]
+
+    def _flush_touched(self) -> None:
+        self._db.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+            ((last_used, key) for key, last_used in self._touched.items()),
+        )
+        self._touched.clear()
+
+    def _evict(self) -> None:
+        overflow = self._size_bytes() - self.max_bytes
+        if overflow <= 0:
+            return
+        evicted = []
+        rows = self._db.execute(
+            "SELECT key, length(vector) FROM embeddings ORDER BY last_used"
+        )
+        for key, vector_bytes in rows:
+            evicted.append(key)
+            overflow -= vector_bytes + ENTRY_OVERHEAD_BYTES
+            if overflow <= 0:
+                break
+        for chunk in _chunks(evicted, QUERY_CHUNK_SIZE):
+            placeholders = ",".join("?" * len(chunk))
+            self._db.execute(
+                f"DELETE FROM embeddings WHERE key IN ({placeholders})", chunk
+            )
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._touched:
+                self._flush_touched()
+                self._db.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -4,15 +4,23 @@ Processors for different models
 import functools
 import json
 import logging
-from typing import List
+import re
+import time
+from typing import List, Mapping, Optional
 
 import cohere as co
 import httpx
-import openai
-import tiktoken
 
-from emb3d import config
-from emb3d.types import Backend, EmbedJob, EmbedResponse, Failure, Result, WaitFor
+from emb3d import config, tokenizer
+from emb3d.types import (
+    Backend,
+    EmbedJob,
+    EmbedResponse,
+    Failure,
+    RateLimitInfo,
+    Result,
+    WaitFor,
+)
 
 HF_HEADERS = {}
 OPENAI_INIT_PARAMS = {}
@@ -31,10 +39,21 @@ def httpx_client() -> httpx.AsyncClient:
     return cli
 
 
+class _CohereClient(co.AsyncClient):
+    """Async client that keeps the response headers in the response `meta`"""
+
+    def _check_response(self, json_response, headers, status_code):
+        super()._check_response(json_response, headers, status_code)
+        if isinstance(json_response, dict):
+            meta = json_response.get("meta") or {}
+            meta["response_headers"] = dict(headers)
+            json_response["meta"] = meta
+
+
 @functools.cache
 def cohere_client(api_key: str) -> co.AsyncClient:
     """Cached cohere client"""
-    cli = co.AsyncClient(api_key=api_key)
+    cli = _CohereClient(api_key=api_key)
     _cleanup_callables.append(cli.close)
     return cli
 
@@ -46,6 +65,13 @@ def hf_headers(job: EmbedJob) -> dict:
     }
 
 
+def openai_headers(job: EmbedJob) -> dict:
+    """Returns the headers for the OpenAI API"""
+    return {
+        "Authorization": f"Bearer {job.api_key}",
+    }
+
+
 async def cleanup():
     """Cleanup any resources used by the clients"""
     for cleanup_fn in _cleanup_callables:
@@ -59,6 +85,76 @@ def hf_inference_url(model_id: str):
     )
 
 
+_DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse `1.5`, `20ms` or `6m0s` style durations into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_rate_limit_headers(
+    headers: Optional[Mapping[str, str]]
+) -> Optional[RateLimitInfo]:
+    """
+    Extract rate limit state from response headers.
+
+    Handles the OpenAI style `x-ratelimit-*-requests` headers, the generic
+    `x-ratelimit-*` headers and `retry-after`.
+    """
+    if not headers:
+        return None
+    headers = {key.lower(): value for key, value in headers.items()}
+
+    def header(*names: str) -> Optional[str]:
+        return next((headers[name] for name in names if name in headers), None)
+
+    info = RateLimitInfo(
+        limit_requests=_parse_int(
+            header("x-ratelimit-limit-requests", "x-ratelimit-limit")
+        ),
+        remaining_requests=_parse_int(
+            header("x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+        ),
+        reset_requests_secs=_parse_seconds(
+            header("x-ratelimit-reset-requests", "x-ratelimit-reset")
+        ),
+        retry_after_secs=_parse_seconds(header("retry-after")),
+    )
+    if info.reset_requests_secs is not None and info.reset_requests_secs > 1e9:
+        # Some backends send the reset time as an epoch timestamp
+        info.reset_requests_secs = max(0.0, info.reset_requests_secs - time.time())
+    return info if info != RateLimitInfo() else None
+
+
+def _throttled(error, headers: Optional[Mapping[str, str]]) -> WaitFor:
+    """Wait response for a rate limited request, honoring any advertised wait"""
+    rate_limit = parse_rate_limit_headers(headers)
+    seconds = config.RATE_LIMIT_WAIT_TIME_SECS
+    if rate_limit is not None:
+        seconds = (
+            rate_limit.retry_after_secs or rate_limit.reset_requests_secs or seconds
+        )
+    return WaitFor(seconds, error=error, rate_limit=rate_limit)
+
+
 async def _huggingface(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
     data = {"inputs": inputs, "wait_for_model": True}
     response = await httpx_client().post(
@@ -72,11 +168,15 @@ async def _huggingface(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
     except json.JSONDecodeError:
         return Failure("HF response is not in JSON format, {response.content}")
     if response.status_code == 200:
-        return Result(json_response)
+        return Result(json_response, parse_rate_limit_headers(response.headers))
+    elif response.status_code == 429:
+        return _throttled(
+            f"[HuggingFace] Rate limited: {json_response}", response.headers
+        )
     elif response.status_code == 503:
         estimated_time = json_response.get("estimated_time")
         if estimated_time:
-            return WaitFor(estimated_time, None)
+            return WaitFor(estimated_time, None, throttled=False)
         else:
             return Failure(
                 "[HuggingFace] Service unavailable and estimated time not provided"
@@ -85,22 +185,43 @@ async def _huggingface(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
 
 
 async def _openai(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
+    # The endpoint is called directly as the SDK doesn't expose the response
+    # headers (and with them the rate limit state) of successful requests.
+    response = await httpx_client().post(
+        OPENAI_ENDPOINT,
+        headers=openai_headers(job),
+        json={"model": job.model_id, "input": inputs},
+        timeout=config.OPENAI_TIMEOUT_SECS,
+    )
+
+    logging.debug("Model: %s, Response: %s", job.model_id, response.status_code)
+
     try:
-        resp = await openai.Embedding.acreate(model=job.model_id, input=inputs)
-        return Result([row.embedding for row in resp.data])
-    except openai.error.RateLimitError as err:
-        logging.debug("[OpenAI] Rate limit error: %s", err)
-        return WaitFor(config.RATE_LIMIT_WAIT_TIME_SECS, error=err)
-    except openai.error.APIError as err:
-        logging.debug("[OpenAI] Error:", err)
-        return Failure(f"[OpenAI] Error: {err}")
+        json_response = response.json()
+    except json.JSONDecodeError:
+        return Failure(f"[OpenAI] Response is not in JSON format, {response.content}")
+    if response.status_code == 200:
+        rows = sorted(json_response["data"], key=lambda row: row["index"])
+        return Result(
+            [row["embedding"] for row in rows],
+            parse_rate_limit_headers(response.headers),
+        )
+    elif response.status_code == 429:
+        logging.debug("[OpenAI] Rate limit error: %s", json_response)
+        return _throttled(f"[OpenAI] Rate limited: {json_response}", response.headers)
+    return Failure(f"[OpenAI] Error: {json_response}")
 
 
 async def _cohere(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
     cli = cohere_client(job.api_key)
     try:
         co_resp = await cli.embed(inputs, job.model_id)
-        return Result(co_resp.embeddings)
+        headers = (co_resp.meta or {}).get("response_headers")
+        return Result(co_resp.embeddings, parse_rate_limit_headers(headers))
+    except co.error.CohereAPIError as err:
+        if err.http_status == 429:
+            return _throttled(f"[Cohere] Rate limited: {err}", err.headers)
+        return Failure(f"[Cohere] Error: {err}")
     except co.error.CohereError as err:
         return Failure(f"[Cohere] Error: {err}")
 
@@ -114,7 +235,6 @@ async def gen(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
     if job.backend == Backend.HUGGINGFACE:
         return await _huggingface(job, inputs)
     elif job.backend == Backend.OPENAI:
-        openai.api_key = job.api_key
         return await _openai(job, inputs)
     elif job.backend == Backend.COHERE:
         return await _cohere(job, inputs)
@@ -122,20 +242,17 @@ async def gen(job: EmbedJob, inputs: List[str]) -> EmbedResponse:
         raise ValueError(f"Unknown backend: {job.backend}")
 
 
-@functools.cache
-def get_encoder(model_id: str) -> tiktoken.Encoding:
-    """Returns encoder used for the given model_id"""
-    return tiktoken.encoding_for_model(model_id)
+def token_counts(job: EmbedJob, inputs: List[str]) -> List[int]:
+    """
+    Token counts for a batch of inputs, using the model's tokenizer when it is
+    available (see `emb3d.tokenizer`).
+    """
+    return tokenizer.get_counter(job.model_id, job.backend).count(inputs)
 
 
 def approx_token_count(job: EmbedJob, input: str) -> int:
     """
-    Helper to compute the approximate token count for an input
-
-    For backends other than OpenAI, we use an approximate method as a fast
-    tokenizer isn't always available.
+    Helper to compute the token count for a single input, prefer `token_counts`
+    for many inputs.
     """
-    if job.backend == Backend.OPENAI:
-        encoder = get_encoder(job.model_id)
-        return len(encoder.encode(input))
-    return len(input) // 2
+    return token_counts(job, [input])[0]
@@ -0,0 +1,258 @@
+"""
+Approximate nearest neighbour index
+
+IVF-Flat: normalized embeddings are partitioned into `nlist` inverted lists by
+spherical k-means, a query only scans the rows of its `nprobe` closest lists.
+The index is built in streaming passes over the embedding file and stored as a
+directory of `.npy` arrays that are memory-mapped on load:
+
+    meta.json       format, version and build parameters
+    centroids.npy   (nlist, dim) float32
+    offsets.npy     (nlist + 1,) int64, list `i` is rows `offsets[i]:offsets[i + 1]`
+    ids.npy         (rows,) int64, position of the row in the embedding file
+    vectors.npy     (rows, dim) float32, normalized and grouped by list
+"""
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+from emb3d import config
+from emb3d.compute.search import normalize, top_k
+
+INDEX_FORMAT = "ivf-flat"
+INDEX_VERSION = 1
+
+META_FILE = "meta.json"
+
+# Returns a fresh iterator over the embedding chunks, for every pass of the build
+ChunksFn = Callable[[], Iterable[np.ndarray]]
+
+
+def index_dir(embedding_file: Path) -> Path:
+    return embedding_file.with_suffix(".index")
+
+
+def _sample(
+    chunks: Iterable[np.ndarray], size: int, seed: int
+) -> Tuple[np.ndarray, int]:
+    """Uniform sample of atmost `size` rows (by smallest random keys), and the row count"""
+    rng = np.random.default_rng(seed)
+    sample: Optional[np.ndarray] = None
+    keys = np.empty(0)
+    count = 0
+    for chunk in chunks:
+        count += len(chunk)
+        keys = np.concatenate([keys, rng.random(len(chunk))])
+        sample = chunk if sample is None else np.concatenate([sample, chunk])
+        if len(keys) > size:
+            keep = np.argpartition(keys, size - 1)[:size]
+            keys, sample = keys[keep], sample[keep]
+    if sample is None:
+        return np.empty((0, 0), dtype=np.float32), 0
+    return sample, count
+
+
+def _assign(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Closest centroid of every (normalized) row"""
+    labels = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), config.SEARCH_CHUNK_ROWS):
+        end = start + config.SEARCH_CHUNK_ROWS
+        labels[start:end] = np.argmax(X[start:end] @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(X: np.ndarray, k: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of normalized rows, empty clusters are re-seeded"""
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), k, replace=False)]
+    for _ in range(iterations):
+        labels = _assign(X, centroids)
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        present, starts = np.unique(sorted_labels, return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(X[order], starts)
+        empty = np.setdiff1d(np.arange(k), present)
+        sums[empty] = X[rng.choice(len(X), len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        meta: dict,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+    ):
+        self.meta = meta
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        meta = json.loads((path / META_FILE).read_text())
+        if meta.get("format") != INDEX_FORMAT or meta.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"Unsupported index {path} ({meta.get('format')} v{meta.get('version')}), rebuild it with `emb3d index`."
+            )
+        arrays = [
+            np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in ("centroids", "offsets", "ids", "vectors")
+        ]
+        return cls(meta, *arrays)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(
+        self, queries: np.ndarray, k: int, nprobe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embedding file positions and cosine similarities of the approximate `k`
+        nearest rows of every query, sorted by decreasing similarity. Queries with
+        fewer candidates than `k` are padded with -1 positions.
+        """
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        nprobe = min(nprobe or self.meta["nprobe"], len(self.centroids))
+        k = min(k, len(self))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for qi, (query, lists) in enumerate(zip(queries, probes)):
+            slices = [
+                slice(self.offsets[idx], self.offsets[idx + 1])
+                for idx in lists
+                if self.offsets[idx + 1] > self.offsets[idx]
+            ]
+            if not slices:
+                continue
+            candidate_ids = np.concatenate([self.ids[rows] for rows in slices])
+            candidate_scores = np.concatenate(
+                [self.vectors[rows] @ query for rows in slices]
+            )
+            best = np.argsort(-candidate_scores, kind="stable")[:k]
+            indices[qi, : len(best)] = candidate_ids[best]
+            scores[qi, : len(best)] = candidate_scores[best]
+        return indices, scores
+
+
+def build(
+    chunks: ChunksFn,
+    path: Path,
+    nlist: Optional[int] = None,
+    nprobe: int = config.INDEX_DEFAULT_NPROBE,
+    source: str = "",
+    seed: int = 0,
+) -> IVFIndex:
+    """
+    Build an IVF-Flat index at `path` in three passes over `chunks`: sample and
+    train the centroids, assign rows to lists, then write the rows grouped by
+    list. Memory is bounded by the training sample and a chunk.
+    """
+    sample, count = _sample(
+        (normalize(chunk) for chunk in chunks()), config.INDEX_TRAIN_SAMPLE, seed
+    )
+    if count == 0:
+        raise ValueError("No embeddings to index")
+    max_lists = max(1, len(sample) // config.INDEX_MIN_POINTS_PER_LIST)
+    nlist = min(nlist or max(1, int(np.sqrt(count))), max_lists)
+    centroids = kmeans(sample, nlist, config.INDEX_KMEANS_ITERATIONS, seed)
+    dim = sample.shape[1]
+    del sample
+
+    assignments = np.empty(count, dtype=np.int32)
+    position = 0
+    for chunk in chunks():
+        assignments[position : position + len(chunk)] = _assign(
+            normalize(chunk), centroids
+        )
+        position += len(chunk)
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(assignments, minlength=nlist))]
+    )
+
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    vectors = np.lib.format.open_memmap(
+        tmp_path / "vectors.npy", mode="w+", dtype=np.float32, shape=(count, dim)
+    )
+    ids = np.lib.format.open_memmap(
+        tmp_path / "ids.npy", mode="w+", dtype=np.int64, shape=(count,)
+    )
+    cursor = offsets[:-1].copy()
+    position = 0
+    for chunk in chunks():
+        chunk_lists = assignments[position : position + len(chunk)]
+        order = np.argsort(chunk_lists, kind="stable")
+        sorted_lists = chunk_lists[order]
+        # Rank of every row among the rows of its list in this chunk
+        rank = np.arange(len(chunk)) - np.searchsorted(sorted_lists, sorted_lists)
+        targets = cursor[sorted_lists] + rank
+        vectors[targets] = normalize(chunk)[order]
+        ids[targets] = position + order
+        cursor += np.bincount(chunk_lists, minlength=nlist)
+        position += len(chunk)
+    vectors.flush()
+    ids.flush()
+    del vectors, ids
+
+    np.save(tmp_path / "centroids.npy", centroids.astype(np.float32))
+    np.save(tmp_path / "offsets.npy", offsets.astype(np.int64))
+    meta = {
+        "format": INDEX_FORMAT,
+        "version": INDEX_VERSION,
+        "source": source,
+        "rows": count,
+        "dim": dim,
+        "nlist": nlist,
+        "nprobe": nprobe,
+    }
+    (tmp_path / META_FILE).write_text(json.dumps(meta))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return IVFIndex.load(path)
+
+
+def evaluate(
+    index: IVFIndex,
+    k: int = 10,
+    num_queries: int = config.INDEX_EVAL_QUERIES,
+    nprobe: Optional[int] = None,
+    seed: int = 0,
+) -> dict:
+    """Recall@k and queries per second of the index against exact search, using indexed rows as queries"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(index), min(num_queries, len(index)), replace=False))
+    queries = np.asarray(index.vectors[rows])
+
+    started = time.perf_counter()
+    exact, _ = top_k(index.vectors, queries, k)
+    exact_secs = time.perf_counter() - started
+    exact_ids = index.ids[exact]
+
+    started = time.perf_counter()
+    approx, _ = index.search(queries, k, nprobe)
+    approx_secs = time.perf_counter() - started
+
+    hits = sum(
+        len(set(expected.tolist()) & set(found.tolist()))
+        for expected, found in zip(exact_ids, approx)
+    )
+    return {
+        "recall": hits / exact_ids.size,
+        "qps": len(queries) / max(approx_secs, 1e-9),
+        "exact_qps": len(queries) / max(exact_secs, 1e-9),
+    }
@@ -0,0 +1,132 @@
+"""
+Visualization artifacts
+
+The 2D projection (coordinates and the fitted model) and the HDBSCAN single
+linkage trees (one per `min_samples`) of an embedding file are cached in a `.2d.cache` directory next to
+its `.2d.html`. Entries are keyed by a fingerprint of the embedding file and the
+projection parameters, only the latest entry of a file is kept.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from emb3d.compute.visualize import Projection
+from emb3d.io import sidecar
+
+ARTIFACTS_VERSION = 1
+# Blocks hashed from the start, middle and end of the embedding files
+FINGERPRINT_BLOCK_SIZE = 1 << 20
+
+COORDS_FILE = "coords.npy"
+PROJECTION_FILE = "projection.pkl"
+SINGLE_LINKAGE_FILE = "single_linkage.{min_samples}.npy"
+META_FILE = "meta.json"
+
+
+def artifacts_dir(embedding_file: Path) -> Path:
+    return embedding_file.with_suffix(".2d.cache")
+
+
+def fingerprint(embedding_file: Path) -> str:
+    """
+    Cheap content fingerprint of an embedding file (and its sidecar): sizes,
+    modification times and a few sampled blocks rather than the full contents.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    sidecar_file = sidecar.sidecar_path(embedding_file)
+    for path in (embedding_file, sidecar_file):
+        if not path.exists():
+            continue
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        with path.open("rb") as f:
+            for offset in (0, stat.st_size // 2, stat.st_size - FINGERPRINT_BLOCK_SIZE):
+                f.seek(max(0, offset))
+                digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+class MapArtifacts:
+    """Cached artifacts of a single (embedding file, parameters) pair"""
+
+    def __init__(self, root: Path, source: str, params: dict):
+        self.source = source
+        self.params = params
+        key = hashlib.blake2b(
+            json.dumps([ARTIFACTS_VERSION, source, params], sort_keys=True).encode(),
+            digest_size=8,
+        ).hexdigest()
+        self.root = root
+        self.path = root / key
+
+    @classmethod
+    def open(cls, embedding_file: Path, params: dict) -> "MapArtifacts":
+        return cls(artifacts_dir(embedding_file), fingerprint(embedding_file), params)
+
+    @classmethod
+    def latest(cls, embedding_file: Path) -> Optional["MapArtifacts"]:
+        """Artifacts with a projection of the file as it is now, if any"""
+        root = artifacts_dir(embedding_file)
+        if not root.is_dir():
+            return None
+        source = fingerprint(embedding_file)
+        for entry in root.iterdir():
+            meta_file = entry / META_FILE
+            if not meta_file.exists():
+                continue
+            meta = json.loads(meta_file.read_text())
+            artifacts = cls(root, meta["source"], meta["params"])
+            if artifacts.source == source and artifacts.path == entry:
+                if (entry / PROJECTION_FILE).exists():
+                    return artifacts
+        return None
+
+    def load_projection(self) -> Optional[Tuple[np.ndarray, Projection]]:
+        coords_file = self.path / COORDS_FILE
+        projection_file = self.path / PROJECTION_FILE
+        if not (coords_file.exists() and projection_file.exists()):
+            return None
+        with projection_file.open("rb") as f:
+            projection = pickle.load(f)
+        return np.load(coords_file), projection
+
+    def save_projection(self, coords: np.ndarray, projection: Projection):
+        self._prepare()
+        self._save_array(COORDS_FILE, coords)
+        tmp_file = self.path / f"{PROJECTION_FILE}.tmp"
+        with tmp_file.open("wb") as f:
+            pickle.dump(projection, f)
+        os.replace(tmp_file, self.path / PROJECTION_FILE)
+
+    def load_single_linkage(self, min_samples: int) -> Optional[np.ndarray]:
+        tree_file = self.path / SINGLE_LINKAGE_FILE.format(min_samples=min_samples)
+        return np.load(tree_file) if tree_file.exists() else None
+
+    def save_single_linkage(self, single_linkage: np.ndarray, min_samples: int):
+        self._prepare()
+        self._save_array(
+            SINGLE_LINKAGE_FILE.format(min_samples=min_samples), single_linkage
+        )
+
+    def _save_array(self, name: str, array: np.ndarray):
+        tmp_file = self.path / f"{name}.tmp"
+        with tmp_file.open("wb") as f:
+            np.save(f, array)
+        os.replace(tmp_file, self.path / name)
+
+    def _prepare(self):
+        """Create the entry and drop the entries for older file versions"""
+        if self.path.exists():
+            return
+        if self.root.is_dir():
+            for entry in self.root.iterdir():
+                shutil.rmtree(entry, ignore_errors=True)
+        self.path.mkdir(parents=True)
+        meta = {"source": self.source, "params": self.params}
+        (self.path / META_FILE).write_text(json.dumps(meta))
@@ -1,63 +1,226 @@
-import json
+import itertools
 import logging
-from typing import Iterator
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
 
-from emb3d import client
-from emb3d.io import reader
+from emb3d import client, config, tokenizer
+from emb3d.io import codec, ranges, reader
+from emb3d.io.shards import ShardedWriter
 from emb3d.types import Batch, EmbedJob
 
+# Rows between updates of the estimated total for streaming jobs
+INPUT_PROGRESS_INTERVAL = 1000
 
-def write_batch_results_post_lock(job: EmbedJob, batch: Batch):
+
+def fan_out_duplicates(job: EmbedJob, batch: Batch) -> Batch:
     """
-    Write the results of a batch to the output file, assumes calling context has
-    ensured that there is atmost one writer writing to the output file.
+    Expand a batch of deduplicated rows with the rows that share their text.
+    """
+    if job.dedupe is None:
+        return batch
+    row_ids = list(batch.row_ids)
+    inputs = list(batch.inputs)
+    embeddings = list(batch.embeddings) if batch.embeddings is not None else None
+    for idx, row_id in enumerate(batch.row_ids):
+        for follower in job.dedupe.followers(row_id):
+            if job.is_completed(follower):
+                continue
+            row_ids.append(follower)
+            inputs.append(batch.inputs[idx])
+            if embeddings is not None:
+                embeddings.append(embeddings[idx])
+
+    # Fanned out rows never pass through a worker, account for them here
+    num_fanned_out = len(row_ids) - len(batch.row_ids)
+    if batch.error is None:
+        job.batch_success(num_fanned_out)
+    else:
+        job.batch_failure(num_fanned_out)
+    return Batch(row_ids, inputs, embeddings, batch.error, batch.token_count)
+
+
+def write_rows_post_lock(job: EmbedJob, batch: Batch):
+    """
+    Serialize a (fanned out) batch and write it to the outputs in one chunk,
+    assumes there is atmost one writer writing to the output file.
+
+    When the job has an embedding sidecar, vectors are written there and the
+    output file only holds the per-row metadata.
     """
     logging.debug("Writing computed batch results, size = [%d]", len(batch.row_ids))
+    sidecar = job.embedding_sidecar
+    if sidecar is not None:
+        if batch.embeddings is not None:
+            sidecar.write(batch.row_ids, batch.embeddings)
+        else:
+            sidecar.reserve(max(batch.row_ids) + 1)
+
+    rows = []
     for idx, _ in enumerate(batch.row_ids):
-        job.out_file.write(
-            json.dumps(
-                {
-                    "row_id": batch.row_ids[idx],
-                    "input": batch.inputs[idx],
-                    "embedding": batch.embeddings[idx]
-                    if batch.embeddings is not None
-                    else None,
-                    "error": str(batch.error) if batch.error else None,
-                }
+        row = {"row_id": batch.row_ids[idx], "input": batch.inputs[idx]}
+        if sidecar is None:
+            row["embedding"] = (
+                batch.embeddings[idx] if batch.embeddings is not None else None
             )
-            + "\n"
-        )
+        row["error"] = str(batch.error) if batch.error else None
+        rows.append(row)
+    if isinstance(job.out_file, ShardedWriter):
+        job.out_file.write_rows(batch.row_ids, codec.dumps_lines(rows))
+    else:
+        job.out_file.write(codec.dumps_lines(rows))
     job.batch_saved(len(batch.row_ids))
+    if job.checkpoint is not None:
+        job.checkpoint.record(batch)
 
 
-def gen_batch(job: EmbedJob, batch_size: int, max_tokens: int) -> Iterator[Batch]:
+def write_batch_results_post_lock(job: EmbedJob, batch: Batch):
+    """
+    Write the results of a batch to the output file, assumes calling context has
+    ensured that there is atmost one writer writing to the output file.
+    """
+    write_rows_post_lock(job, fan_out_duplicates(job, batch))
+
+
+def use_cached(job: EmbedJob, batch: Batch, cached: list) -> List[int]:
+    """
+    Fill the batch with the `cached` embeddings of its inputs (`None` when not
+    cached). Returns the indices of the inputs that still need to be computed.
+    """
+    missing = [idx for idx, embedding in enumerate(cached) if embedding is None]
+    job.batch_cache_lookup(len(cached) - len(missing), len(missing))
+    batch.embeddings = cached if len(missing) < len(cached) else None
+    return missing
+
+
+def cache_lookup(job: EmbedJob, batch: Batch) -> List[int]:
+    """
+    Fill the batch with cached embeddings, if the job has a cache.
+
+    Returns the indices of the inputs that still need to be computed.
     """
-    Generates batches of rows from the input file.
+    if job.embedding_cache is None:
+        return list(range(len(batch.inputs)))
+    return use_cached(
+        job, batch, job.embedding_cache.get_many(job.model_id, batch.inputs)
+    )
 
-    Batches are constructed so that:
+
+def merge_computed(batch: Batch, missing: List[int], embeddings: list):
+    """Merge computed embeddings for the `missing` inputs"""
+    if batch.embeddings is None:
+        batch.embeddings = list(embeddings)
+    else:
+        for idx, embedding in zip(missing, embeddings):
+            batch.embeddings[idx] = embedding
+
+
+def cache_fill(job: EmbedJob, batch: Batch, missing: List[int], embeddings: list):
+    """Merge computed embeddings for the `missing` inputs and cache them"""
+    merge_computed(batch, missing, embeddings)
+    if job.embedding_cache is not None:
+        job.embedding_cache.put_many(
+            job.model_id, [batch.inputs[idx] for idx in missing], embeddings
+        )
+
+
+def _serial_records(job: EmbedJob) -> Iterator[Tuple[int, str, int]]:
+    rows_read = bytes_read = 0
+    row_ids: List[int] = []
+    texts: List[str] = []
+    for line_num, line in enumerate(reader.line(job.in_file)):
+        rows_read += 1
+        # Approximate, lines are stripped and counted in characters
+        bytes_read += len(line) + 1
+        if rows_read % INPUT_PROGRESS_INTERVAL == 0:
+            job.input_progress(rows_read, bytes_read, exhausted=False)
+        # Skip before parsing, resumed jobs can have millions of completed rows
+        if job.is_completed(line_num) or job.is_duplicate(line_num):
+            continue
+        row_ids.append(line_num)
+        texts.append(codec.loads(line)[job.column_name])
+        if len(row_ids) >= config.TOKEN_COUNT_WINDOW:
+            yield from zip(row_ids, texts, client.token_counts(job, texts))
+            row_ids, texts = [], []
+    job.input_progress(rows_read, bytes_read, exhausted=True)
+    if row_ids:
+        yield from zip(row_ids, texts, client.token_counts(job, texts))
+
+
+def gen_records(job: EmbedJob) -> Iterator[Tuple[int, str, int]]:
+    """
+    Generates `(row_id, text, token_count)` for the rows of the input file that
+    need to be computed. Texts are tokenized `TOKEN_COUNT_WINDOW` at a time.
+
+    Rows completed by a previous run of the job and duplicate rows (when the job
+    is deduplicated) are skipped.
+
+    With `read_workers` above 1, input files (not streams) are split into byte
+    ranges that are parsed in parallel, see `emb3d.io.ranges`.
+    """
+    if job.read_workers == 1 or job.streaming:
+        return _serial_records(job)
+    return ranges.records(
+        Path(job.in_file.name),
+        job.column_name,
+        tokenizer.get_counter(job.model_id, job.backend),
+        job.read_workers,
+        config.INPUT_RANGE_BYTES,
+        resumed=job.checkpoint.resumed if job.checkpoint is not None else None,
+        leaders=job.dedupe.leaders if job.dedupe is not None else None,
+    )
+
+
+def pack_batches(
+    records: Iterable[Tuple[int, str, int]], batch_size: int, max_tokens: int
+) -> Iterator[Batch]:
+    """
+    Packs records into batches, in the order they are given, so that:
     - Each batch contains atmost `batch_size` rows.
     - Each batch have atmost max_tokens (except when a single line exceeds token limit)
     """
     batch_ids = []
     batch_inputs = []
     batch_token_count = 0
-    for line_num, record in enumerate(reader.jsonl(job.in_file)):
-        text = record[job.column_name]
-        new_tokens = client.approx_token_count(job, text)
-
+    for row_id, text, new_tokens in records:
         can_merge_token = batch_token_count + new_tokens < max_tokens
         can_merge_element = len(batch_ids) + 1 < batch_size
 
         can_merge = len(batch_ids) == 0 or (can_merge_token and can_merge_element)
         if can_merge:
-            batch_ids.append(line_num)
+            batch_ids.append(row_id)
             batch_inputs.append(text)
             batch_token_count += new_tokens
         else:
-            yield Batch(batch_ids, batch_inputs)
-            batch_ids = [line_num]
+            yield Batch(batch_ids, batch_inputs, token_count=batch_token_count)
+            batch_ids = [row_id]
             batch_inputs = [text]
             batch_token_count = new_tokens
 
     if batch_ids:
-        yield Batch(batch_ids, batch_inputs)
+        yield Batch(batch_ids, batch_inputs, token_count=batch_token_count)
+
+
+def gen_batch(job: EmbedJob, batch_size: int, max_tokens: int) -> Iterator[Batch]:
+    """
+    Generates batches of rows from the input file, in file order.
+    """
+    return pack_batches(gen_records(job), batch_size, max_tokens)
+
+
+def gen_bucketed_batch(
+    job: EmbedJob, batch_size: int, max_tokens: int, window: int
+) -> Iterator[Batch]:
+    """
+    Generates batches of similar length rows from the input file.
+
+    Records are read `window` at a time and sorted by token count before being
+    packed, so that a long row doesn't make the model pad a batch of short rows
+    to its length. Batches keep the original row ids.
+    """
+    records = gen_records(job)
+    while True:
+        chunk = list(itertools.islice(records, window))
+        if not chunk:
+            return
+        chunk.sort(key=lambda record: record[2])
+        yield from pack_batches(chunk, batch_size, max_tokens)
@@ -0,0 +1,63 @@
+"""
+In-job deduplication of identical inputs
+
+Rows are grouped by a 64-bit hash of their text, only the first row of each
+group (the leader) is embedded and its result is fanned out to the other rows
+(followers) when it is written.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Iterable, List
+
+import numpy as np
+
+
+def text_hash(text: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(text.encode(), digest_size=8).digest(), "little"
+    )
+
+
+class DedupeIndex:
+    """
+    Compact row -> leader mapping, ~24 bytes per row irrespective of text size.
+    """
+
+    def __init__(self, leaders: np.ndarray):
+        self._leaders = leaders
+        # Rows grouped by leader, rows within a group are in file order
+        self._order = np.argsort(leaders, kind="stable")
+        self._sorted_leaders = leaders[self._order]
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> DedupeIndex:
+        hashes = np.fromiter((text_hash(text) for text in texts), dtype=np.uint64)
+        _, first_rows, inverse = np.unique(
+            hashes, return_index=True, return_inverse=True
+        )
+        return cls(first_rows[inverse.reshape(-1)].astype(np.int64))
+
+    @property
+    def leaders(self) -> np.ndarray:
+        """Leader of every row"""
+        return self._leaders
+
+    def leader(self, row_id: int) -> int:
+        """First row with the same text as `row_id`"""
+        return int(self._leaders[row_id])
+
+    def is_leader(self, row_id: int) -> bool:
+        return self.leader(row_id) == row_id
+
+    def followers(self, row_id: int) -> List[int]:
+        """Rows with the same text as the leader `row_id`, excluding itself"""
+        start, end = np.searchsorted(self._sorted_leaders, [row_id, row_id + 1])
+        return [int(row) for row in self._order[start:end] if row != row_id]
+
+    @property
+    def num_unique(self) -> int:
+        return int(np.count_nonzero(self._leaders == np.arange(len(self._leaders))))
+
+    def __len__(self) -> int:
+        return len(self._leaders)
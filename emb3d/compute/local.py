@@ -1,16 +1,130 @@
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 import sentence_transformers
 
 from emb3d import config
-from emb3d.compute.common import gen_batch, write_batch_results_post_lock
-from emb3d.types import EmbedJob
+from emb3d.compute.common import (
+    cache_fill,
+    cache_lookup,
+    gen_batch,
+    gen_bucketed_batch,
+    write_batch_results_post_lock,
+)
+from emb3d.types import Batch, EmbedJob, ExecutionConfig, LocalEngine
+
+# Model loaded by each worker process (see `_init_worker`)
+_worker_model = None
+
+
+def load_model(
+    model_id: str,
+    execution_config: ExecutionConfig,
+    num_threads: Optional[int] = None,
+):
+    """
+    Load a model for the configured engine, the returned model has a
+    `SentenceTransformer` like `encode(inputs) -> np.ndarray` method.
+    """
+    if execution_config.engine == LocalEngine.ONNX:
+        from emb3d.compute.onnx_model import OnnxEmbedder
+
+        return OnnxEmbedder.load(model_id, execution_config.quantize, num_threads)
+    if num_threads is not None:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    return sentence_transformers.SentenceTransformer(model_id)
+
+
+def _init_worker(model_id: str, execution_config: ExecutionConfig, num_threads: int):
+    """Worker process initializer, loads the model once per process"""
+    global _worker_model
+    _worker_model = load_model(model_id, execution_config, num_threads)
+
+
+def _encode(inputs: List[str]) -> np.ndarray:
+    return _worker_model.encode(inputs)
+
+
+def _pending_batches(job: EmbedJob) -> Iterator[Tuple[Batch, List[int]]]:
+    """Batches with cached embeddings filled in and the indices left to compute"""
+    max_tokens = config.max_tokens(job.backend)
+    window = job.execution_config.bucket_window
+    if window > 1:
+        batches = gen_bucketed_batch(job, job.batch_size, max_tokens, window)
+    else:
+        batches = gen_batch(job, job.batch_size, max_tokens)
+    for batch in batches:
+        yield batch, cache_lookup(job, batch)
+
+
+def _save(job: EmbedJob, batch: Batch):
+    batch.error = None
+    job.batch_success(len(batch.inputs))
+    write_batch_results_post_lock(job, batch)
+
+
+def _collect(
+    job: EmbedJob,
+    done: Iterable[Future],
+    pending: Dict[Future, Tuple[Batch, List[int]]],
+):
+    """Merge the results of completed futures and write their batches"""
+    for future in done:
+        batch, missing = pending.pop(future)
+        job.tracker.encoding -= len(missing)
+        cache_fill(job, batch, missing, future.result())
+        _save(job, batch)
+
+
+def run_parallel(job: EmbedJob, workers: int):
+    """
+    Shard batches across `workers` processes. Results are written from the
+    calling process as they complete, so there is still a single writer.
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    if job.execution_config.engine == LocalEngine.ONNX:
+        from emb3d.compute import onnx_model
+
+        # Convert once, before the workers load it
+        onnx_model.prepare(job.model_id, job.execution_config.quantize)
+    max_in_flight = workers * config.LOCAL_WORKER_INFLIGHT_BATCHES
+    pending: Dict[Future, Tuple[Batch, List[int]]] = {}
+    # Forking a process that has initialized torch can deadlock
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(job.model_id, job.execution_config, num_threads),
+    ) as pool:
+        for batch, missing in _pending_batches(job):
+            if not missing:
+                _save(job, batch)
+                continue
+            job.tracker.encoding += len(missing)
+            future = pool.submit(_encode, [batch.inputs[idx] for idx in missing])
+            pending[future] = (batch, missing)
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(job, done, pending)
+        _collect(job, wait(pending).done, pending)
 
 
 def run(job: EmbedJob):
     """
     Run the job.
     """
-    model = sentence_transformers.SentenceTransformer(job.model_id)
-    for batch in gen_batch(job, job.batch_size, config.max_tokens(job.backend)):
-        batch.embeddings = model.encode(batch.inputs).tolist()
-        batch.error = None
-        write_batch_results_post_lock(job, batch)
+    workers = job.execution_config.workers
+    if workers > 1:
+        run_parallel(job, workers)
+        return
+    model = load_model(job.model_id, job.execution_config)
+    for batch, missing in _pending_batches(job):
+        if missing:
+            inputs = [batch.inputs[idx] for idx in missing]
+            cache_fill(job, batch, missing, model.encode(inputs))
+        _save(job, batch)
@@ -0,0 +1,138 @@
+"""
+Near-duplicate detection
+
+Finds all pairs of rows with a cosine similarity above a threshold with a
+blocked self-join: rows are split into tiles and every (tile, later tile) pair
+is scored with a single float32 matrix multiply, so only a tile x tile block of
+similarities is held at a time. Row tiles are scored in a thread pool, pairs are
+merged into duplicate groups with a union-find as they arrive.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from emb3d import config
+from emb3d.compute.search import normalize
+
+# Rows [start, end) of a matrix compared with each other
+Block = Tuple[int, int]
+Pairs = Tuple[np.ndarray, np.ndarray]
+
+
+class UnionFind:
+    """Vectorized union-find, roots are always the smallest row of a group"""
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, rows: np.ndarray) -> np.ndarray:
+        roots = self.parent[rows]
+        while True:
+            parents = self.parent[roots]
+            if np.array_equal(parents, roots):
+                return roots
+            roots = parents
+
+    def union(self, first: np.ndarray, second: np.ndarray):
+        while len(first):
+            first_roots, second_roots = self.find(first), self.find(second)
+            differ = first_roots != second_roots
+            first, second = first[differ], second[differ]
+            low = np.minimum(first_roots[differ], second_roots[differ])
+            high = np.maximum(first_roots[differ], second_roots[differ])
+            # Parents only ever point to smaller rows, so there are no cycles
+            np.minimum.at(self.parent, high, low)
+
+    def groups(self) -> np.ndarray:
+        """Root of every row"""
+        return self.find(np.arange(len(self.parent)))
+
+
+def _tile_pairs(
+    matrix: np.ndarray, block: Block, tile_start: int, threshold: float, tile_rows: int
+) -> Pairs:
+    """
+    Pairs of rows (first < second) above the threshold between the tile starting
+    at `tile_start` and itself or the later tiles of the block.
+    """
+    _, end = block
+    tile_end = min(tile_start + tile_rows, end)
+    tile = normalize(np.asarray(matrix[tile_start:tile_end], dtype=np.float32))
+    firsts: List[np.ndarray] = [np.empty(0, dtype=np.int64)]
+    seconds: List[np.ndarray] = [np.empty(0, dtype=np.int64)]
+    for other_start in range(tile_start, end, tile_rows):
+        if other_start == tile_start:
+            other = tile
+        else:
+            other_end = min(other_start + tile_rows, end)
+            other = normalize(np.asarray(matrix[other_start:other_end], np.float32))
+        above = tile @ other.T >= threshold
+        if other_start == tile_start:
+            above = np.triu(above, k=1)
+        rows, cols = np.nonzero(above)
+        firsts.append(rows + tile_start)
+        seconds.append(cols + other_start)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def similar_pairs(
+    matrix: np.ndarray,
+    threshold: float,
+    blocks: Optional[Sequence[Block]] = None,
+    tile_rows: int = config.DEDUPE_TILE_ROWS,
+    threads: Optional[int] = None,
+) -> Iterator[Pairs]:
+    """
+    Pairs of rows of `matrix` with a cosine similarity of atleast `threshold`,
+    yielded a row tile at a time. Only rows within the same block are compared,
+    by default the whole matrix is a single block.
+    """
+    if blocks is None:
+        blocks = [(0, len(matrix))]
+    tasks = (
+        (block, tile_start)
+        for block in blocks
+        for tile_start in range(block[0], block[1], tile_rows)
+    )
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(threads) as executor:
+        # Bounded so that pairs of finished tiles don't pile up
+        max_pending = threads * 2
+        pending: deque = deque()
+        for block, tile_start in tasks:
+            pending.append(
+                executor.submit(
+                    _tile_pairs, matrix, block, tile_start, threshold, tile_rows
+                )
+            )
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        for future in pending:
+            yield future.result()
+
+
+def duplicate_groups(
+    matrix: np.ndarray,
+    threshold: float,
+    blocks: Optional[Sequence[Block]] = None,
+    tile_rows: int = config.DEDUPE_TILE_ROWS,
+    threads: Optional[int] = None,
+) -> np.ndarray:
+    """Group of every row (the smallest row in its group), see `similar_pairs`"""
+    union_find = UnionFind(len(matrix))
+    for first, second in similar_pairs(matrix, threshold, blocks, tile_rows, threads):
+        union_find.union(first, second)
+    return union_find.groups()
+
+
+def iter_groups(groups: np.ndarray) -> Iterator[np.ndarray]:
+    """Rows of every group with more than one row, in order of their first row"""
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    _, starts, counts = np.unique(sorted_groups, return_index=True, return_counts=True)
+    for start, count in zip(starts, counts):
+        if count > 1:
+            yield order[start : start + count]
@@ -0,0 +1,224 @@
+"""
+ONNX Runtime engine for local models
+
+Sentence transformer models are exported to ONNX once, optionally quantized to
+int8 (dynamic quantization of the weights), and cached under the app data
+directory. Pooling and normalization are applied in numpy, so the exported graph
+only holds the transformer itself.
+
+Needs the optional `onnx` and `onnxruntime` packages.
+"""
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from emb3d import config
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+METADATA_FILE = "emb3d.json"
+ONNX_OPSET = 14
+
+
+def artifact_dir(model_id: str) -> Path:
+    """Cache directory of the converted model"""
+    return config.app_data_root() / "onnx" / model_id.replace("/", "--")
+
+
+# Pooling modes `pool` reproduces, keyed by their sentence-transformers 2.x flag
+POOLING_FLAGS = {
+    "pooling_mode_cls_token": "cls",
+    "pooling_mode_max_tokens": "max",
+    "pooling_mode_mean_tokens": "mean",
+    "pooling_mode_mean_sqrt_len_tokens": "mean_sqrt_len_tokens",
+}
+# Modules reproduced by the engine, besides the transformer itself
+SUPPORTED_MODULES = ("Pooling", "Normalize")
+
+
+def _pooling_mode(st_model) -> str:
+    """
+    Pooling mode of a sentence transformer's pooling module, raises a ValueError
+    for modes (or combinations of modes) that `pool` doesn't reproduce.
+    """
+    poolings = [module for module in st_model if type(module).__name__ == "Pooling"]
+    if len(poolings) != 1:
+        raise ValueError(f"Expected a single pooling module, found {len(poolings)}")
+    pooling = poolings[0].get_config_dict()
+    if "pooling_mode" in pooling:
+        modes = [pooling["pooling_mode"]]
+    else:
+        # sentence-transformers 2.x stores one flag per mode
+        modes = [
+            POOLING_FLAGS.get(flag, flag)
+            for flag, enabled in pooling.items()
+            if flag.startswith("pooling_mode_") and enabled
+        ]
+    if len(modes) != 1 or modes[0] not in POOLING_FLAGS.values():
+        raise ValueError(f"Unsupported pooling: {', '.join(modes) or 'none'}")
+    return modes[0]
+
+
+def _check_modules(st_model):
+    """Raises a ValueError for modules after the transformer that aren't reproduced"""
+    for module in list(st_model)[1:]:
+        name = type(module).__name__
+        if name not in SUPPORTED_MODULES:
+            raise ValueError(f"Unsupported module: {name}")
+
+
+def _export(model_id: str, out_dir: Path):
+    import sentence_transformers
+    import torch
+
+    st_model = sentence_transformers.SentenceTransformer(model_id, device="cpu")
+    # Checked before exporting, the engine must produce the same embeddings
+    try:
+        _check_modules(st_model)
+        pooling = _pooling_mode(st_model)
+    except ValueError as err:
+        raise ValueError(
+            f"{model_id} can't run on the ONNX engine ({err}), use --engine torch."
+        ) from err
+    transformer = st_model[0]
+    tokenizer = transformer.tokenizer
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in tokenizer.model_input_names
+    ]
+    sample = tokenizer(["emb3d"], return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    auto_model = transformer.auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            str(out_dir / MODEL_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+        )
+    tokenizer.save_pretrained(str(out_dir))
+    metadata = {
+        "model_id": model_id,
+        "input_names": input_names,
+        "pooling": pooling,
+        "normalize": any(type(m).__name__ == "Normalize" for m in st_model),
+        "max_seq_length": st_model.max_seq_length,
+    }
+    with (out_dir / METADATA_FILE).open("w") as f:
+        json.dump(metadata, f)
+
+
+def prepare(model_id: str, quantize: bool) -> Path:
+    """
+    Export (and quantize) the model if it isn't cached yet, returns the cache
+    directory. The export is moved into place atomically once complete, if
+    another process finished the same export first, its artifact is kept.
+    """
+    out_dir = artifact_dir(model_id)
+    if not (out_dir / METADATA_FILE).exists():
+        out_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=out_dir.parent))
+        try:
+            _export(model_id, tmp_dir)
+            try:
+                os.replace(tmp_dir, out_dir)
+            except OSError:
+                # `out_dir` already exists (and isn't empty)
+                if not (out_dir / METADATA_FILE).exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if quantize and not (out_dir / QUANTIZED_MODEL_FILE).exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        fd, tmp_file = tempfile.mkstemp(dir=out_dir, suffix=".onnx")
+        os.close(fd)
+        try:
+            quantize_dynamic(
+                str(out_dir / MODEL_FILE), tmp_file, weight_type=QuantType.QInt8
+            )
+            os.replace(tmp_file, out_dir / QUANTIZED_MODEL_FILE)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return out_dir
+
+
+def pool(
+    hidden_states: np.ndarray, attention_mask: np.ndarray, mode: str
+) -> np.ndarray:
+    """Pool token embeddings `(batch, sequence, dim)` into sentence embeddings"""
+    if mode == "cls":
+        return hidden_states[:, 0]
+    mask = attention_mask[..., None].astype(hidden_states.dtype)
+    if mode == "max":
+        return np.where(mask > 0, hidden_states, -np.inf).max(axis=1)
+    summed = (hidden_states * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    if mode == "mean_sqrt_len_tokens":
+        return summed / np.sqrt(counts)
+    if mode == "mean":
+        return summed / counts
+    raise ValueError(f"Unsupported pooling mode: {mode}")
+
+
+class OnnxEmbedder:
+    """
+    Drop-in replacement for `SentenceTransformer.encode` running on ONNX Runtime.
+    """
+
+    def __init__(self, model_dir: Path, quantize: bool, num_threads: Optional[int]):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        with (model_dir / METADATA_FILE).open() as f:
+            self.metadata = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = QUANTIZED_MODEL_FILE if quantize else MODEL_FILE
+        self.session = onnxruntime.InferenceSession(
+            str(model_dir / model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    @classmethod
+    def load(
+        cls, model_id: str, quantize: bool = False, num_threads: Optional[int] = None
+    ) -> "OnnxEmbedder":
+        return cls(prepare(model_id, quantize), quantize, num_threads)
+
+    def encode(self, inputs: List[str]) -> np.ndarray:
+        features = self.tokenizer(
+            inputs,
+            padding=True,
+            truncation=True,
+            max_length=self.metadata["max_seq_length"],
+            return_tensors="np",
+        )
+        feed = {
+            name: features[name].astype(np.int64)
+            for name in self.metadata["input_names"]
+        }
+        (hidden_states,) = self.session.run(["last_hidden_state"], feed)
+        embeddings = pool(
+            hidden_states, features["attention_mask"], self.metadata["pooling"]
+        )
+        if self.metadata["normalize"]:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32)
@@ -0,0 +1,97 @@
+"""
+Adaptive request rate limiting
+
+Requests are paced by a token bucket whose rate follows AIMD (additive increase,
+multiplicative decrease): the rate grows linearly while requests succeed and is
+cut when the backend throttles. Rate limit headers, when the backend sends them,
+cap the rate at the advertised quota.
+"""
+import asyncio
+import time
+from typing import Optional
+
+from emb3d import config
+from emb3d.types import RateLimitInfo
+
+# Tolerance for float rounding in the bucket level
+_LEVEL_EPSILON = 1e-9
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiter with an AIMD controlled rate (in requests per minute).
+    """
+
+    def __init__(
+        self,
+        initial_rate: float,
+        min_rate: float = config.RATE_LIMIT_MIN_RPM,
+        max_rate: Optional[float] = None,
+        increase_step: Optional[float] = None,
+        decrease_factor: float = config.RATE_LIMIT_DECREASE_FACTOR,
+    ):
+        self.rate = float(initial_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or initial_rate * config.RATE_LIMIT_MAX_MULTIPLIER
+        self.increase_step = increase_step or max(
+            1.0, initial_rate * config.RATE_LIMIT_INCREASE_FRACTION
+        )
+        self.decrease_factor = decrease_factor
+        self._level = 1.0
+        self._last_refill = time.monotonic()
+        self._last_increase = self._last_refill
+        self._last_decrease = float("-inf")
+        self._lock = asyncio.Lock()
+
+    @property
+    def _rate_per_sec(self) -> float:
+        return self.rate / 60
+
+    @property
+    def _capacity(self) -> float:
+        # Allow roughly a second worth of burst
+        return max(1.0, self._rate_per_sec)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._level = min(self._capacity, self._level + elapsed * self._rate_per_sec)
+        self._last_refill = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Wait until `amount` requests can be made, waiters are served in order"""
+        async with self._lock:
+            self._refill()
+            while self._level < amount - _LEVEL_EPSILON:
+                await asyncio.sleep((amount - self._level) / self._rate_per_sec)
+                self._refill()
+            self._level -= amount
+
+    def on_success(self, rate_limit: Optional[RateLimitInfo] = None) -> None:
+        """Additive increase, atmost once per `RATE_LIMIT_ADJUST_INTERVAL_SECS`"""
+        self.update_from_limits(rate_limit)
+        now = time.monotonic()
+        if now - self._last_increase >= config.RATE_LIMIT_ADJUST_INTERVAL_SECS:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+            self._last_increase = now
+
+    def on_throttle(self, rate_limit: Optional[RateLimitInfo] = None) -> None:
+        """
+        Multiplicative decrease. Throttled responses usually arrive in bursts for
+        requests that were sent together, they result in a single decrease.
+        """
+        self.update_from_limits(rate_limit)
+        now = time.monotonic()
+        if now - self._last_decrease >= config.RATE_LIMIT_ADJUST_INTERVAL_SECS:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._level = min(self._level, 0.0)
+            self._last_decrease = now
+            self._last_increase = now
+
+    def update_from_limits(self, rate_limit: Optional[RateLimitInfo]) -> None:
+        """Cap the rate to the quota advertised by the backend"""
+        if rate_limit is None or rate_limit.limit_requests is None:
+            return
+        self.max_rate = rate_limit.limit_requests * config.SCALE_DOWN_FACTOR
+        self.rate = min(self.rate, self.max_rate)
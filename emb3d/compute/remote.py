@@ -1,11 +1,15 @@
 import asyncio
 import logging
-from typing import Coroutine
+import time
+from typing import Coroutine, List, Optional
 
 from aiolimiter import AsyncLimiter
 
 from emb3d import client, config, textui
-from emb3d.compute.common import gen_batch, write_batch_results_post_lock
+from emb3d.compute.common import gen_batch, merge_computed, use_cached
+from emb3d.compute.ratelimit import AdaptiveRateLimiter
+from emb3d.compute.scheduler import AdaptiveConcurrency, BatchQueue
+from emb3d.compute.writer import BatchWriter
 from emb3d.types import Batch, EmbedJob, Failure, Result, WaitFor
 
 
@@ -21,113 +25,223 @@ async def terminate(*tasks):
             pass
 
 
-async def produce(job: EmbedJob, queue: asyncio.Queue):
+async def produce(job: EmbedJob, queue: BatchQueue):
     """
     Producer task that generates batches and pushes them to the queue.
+
+    Reading, parsing and tokenizing the input runs in a worker thread so that it
+    doesn't stall the requests running on the event loop.
     """
     logging.debug("Producer: Starting")
-    for batch in gen_batch(job, job.batch_size, config.max_tokens(job.backend)):
+    batches = gen_batch(job, job.batch_size, config.max_tokens(job.backend))
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = await loop.run_in_executor(None, next, batches, None)
+        if batch is None:
+            break
         logging.debug("Producer: Next Batch [%d]", len(batch.row_ids))
         await queue.put(batch)
 
 
-FILE_WRITE_LOCK = asyncio.Lock()
-
-
-async def write_batch_results(job: EmbedJob, batch: Batch):
-    """Write batch results to output file."""
-    async with FILE_WRITE_LOCK:
-        # We use synchronous file operations as the data being written is small
-        write_batch_results_post_lock(job, batch)
-
-
-async def worker(
-    job: EmbedJob, rate_limiter: AsyncLimiter, job_queue: asyncio.Queue, num_retries=2
+async def cache_lookup(job: EmbedJob, batch: Batch) -> List[int]:
+    """`common.cache_lookup` with the SQLite queries off the event loop"""
+    if job.embedding_cache is None:
+        return list(range(len(batch.inputs)))
+    cached = await asyncio.get_running_loop().run_in_executor(
+        None, job.embedding_cache.get_many, job.model_id, batch.inputs
+    )
+    return use_cached(job, batch, cached)
+
+
+async def cache_fill(job: EmbedJob, batch: Batch, missing: List[int], embeddings):
+    """`common.cache_fill` with the SQLite writes off the event loop"""
+    merge_computed(batch, missing, embeddings)
+    if job.embedding_cache is not None:
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            job.embedding_cache.put_many,
+            job.model_id,
+            [batch.inputs[idx] for idx in missing],
+            embeddings,
+        )
+
+
+async def process_batch(
+    job: EmbedJob,
+    batch: Batch,
+    rate_limiter: AdaptiveRateLimiter,
+    scheduler: AdaptiveConcurrency,
+    writer: BatchWriter,
+    num_retries=2,
+    token_limiter: Optional[AsyncLimiter] = None,
 ):
     """
-    Consumer task that consumes batches from the queue and generates embeddings.
+    Generates embeddings for a single batch and hands the results off to the
+    writer stage.
+
+    Each request is charged against the request rate limiter and, for backends
+    with a token quota, against the token limiter by its token count. Request
+    latencies feed the concurrency limit of the scheduler.
     """
-    while True:
-        batch = await job_queue.get()
-        assert len(batch.inputs) == len(batch.row_ids)
-        batch_retry = num_retries
-        while batch_retry > 0:
-            batch_retry -= 1
-            await rate_limiter.acquire()
-            job.tracker.encoding += len(batch.inputs)
-            resp = await client.gen(job, batch.inputs)
-            job.tracker.encoding -= len(batch.inputs)
-            # match resp:
-            #     case Result(data):
-            #         assert len(data) == len(batch.inputs)
-            #         # clear off transient error
-            #         batch.error = None
-            #         batch.embeddings = data
-            #         job.batch_success(len(batch.inputs))
-            #         await write_batch_results(job, batch)
-            #         break
-            #     case Failure(error):
-            #         batch.error = error
-            #     case WaitFor(seconds, error):
-            #         batch.error = error
-            #         if batch_retry != 0:
-            #             await asyncio.sleep(seconds)
-            if isinstance(resp, Result):
-                assert len(resp.data) == len(batch.inputs)
-                # clear off transient error
-                batch.error = None
-                batch.embeddings = resp.data
-                job.batch_success(len(batch.inputs))
-                await write_batch_results(job, batch)
-                break
-            elif isinstance(resp, Failure):
-                batch.error = resp.error
-            elif isinstance(resp, WaitFor):
-                batch.error = resp.error
-                if batch_retry != 0:
-                    await asyncio.sleep(resp.seconds)
-
-            if batch_retry == 0:
-                job.batch_failure(len(batch.inputs))
-                if batch.error is not None:
-                    job.batch_error(str(batch.error))
-                await write_batch_results(job, batch)
-        job_queue.task_done()
+    assert len(batch.inputs) == len(batch.row_ids)
+    missing = await cache_lookup(job, batch)
+    if not missing:
+        job.batch_success(len(batch.inputs))
+        await writer.put(batch)
+        return
+    inputs = [batch.inputs[idx] for idx in missing]
+    # Cached inputs aren't sent, charge the pro-rated token count
+    token_count = batch.token_count * len(missing) // len(batch.inputs)
+    batch_retry = num_retries
+    while batch_retry > 0:
+        batch_retry -= 1
+        await rate_limiter.acquire()
+        if token_limiter is not None and token_count > 0:
+            await token_limiter.acquire(min(token_count, token_limiter.max_rate))
+        job.tracker.encoding += len(inputs)
+        started = time.monotonic()
+        try:
+            resp = await client.gen(job, inputs)
+        finally:
+            job.tracker.encoding -= len(inputs)
+        scheduler.observe(time.monotonic() - started)
+        if isinstance(resp, Result):
+            rate_limiter.on_success(resp.rate_limit)
+            assert len(resp.data) == len(inputs)
+            # clear off transient error
+            batch.error = None
+            await cache_fill(job, batch, missing, resp.data)
+            job.batch_success(len(batch.inputs))
+            await writer.put(batch)
+            break
+        elif isinstance(resp, Failure):
+            batch.error = resp.error
+        elif isinstance(resp, WaitFor):
+            if resp.throttled:
+                rate_limiter.on_throttle(resp.rate_limit)
+            batch.error = resp.error
+            if batch_retry != 0:
+                await asyncio.sleep(resp.seconds)
+
+        if batch_retry == 0:
+            # Cached rows are retried with the batch on resume
+            batch.embeddings = None
+            job.batch_failure(len(batch.inputs))
+            if batch.error is not None:
+                job.batch_error(str(batch.error))
+            await writer.put(batch)
+
+
+async def fail_batch(job: EmbedJob, batch: Batch, writer: BatchWriter, err: Exception):
+    """
+    Record a batch whose processing raised as failed, so that it is saved with
+    its error and retried on resume like any other failed batch.
+    """
+    logging.exception("Batch of %d rows failed", len(batch.row_ids))
+    if writer.error is not None:
+        # Nothing can be saved anymore, `run` stops the job
+        return
+    batch.error = err
+    batch.embeddings = None
+    job.batch_failure(len(batch.inputs))
+    job.batch_error(str(err))
+    await writer.put(batch)
 
 
 async def consume(
-    job: EmbedJob, rate_limiter: AsyncLimiter, job_queue: asyncio.Queue, num_retries=2
+    job: EmbedJob,
+    rate_limiter: AdaptiveRateLimiter,
+    job_queue: BatchQueue,
+    writer: BatchWriter,
+    num_retries=2,
+    token_limiter: Optional[AsyncLimiter] = None,
 ):
     """
-    Consumer task that consumes batches from the queue and generates embeddings.
+    Dispatcher task that starts a request task per batch from the queue, as
+    many as the adaptive concurrency limit allows.
+
+    Only in-flight batches have a task, so the number of tasks stays flat no
+    matter how large `max_concurrent_requests` is.
     """
-    logging.debug("Starting consumer task")
-    return await asyncio.gather(
-        *[
-            worker(job, rate_limiter, job_queue, num_retries)
-            for _ in range(job.max_concurrent_requests)
-        ],
-        return_exceptions=True,
-    )
+    logging.debug("Starting dispatcher task")
+    scheduler = AdaptiveConcurrency(job.max_concurrent_requests, rate_limiter.rate)
+    in_flight = set()
+
+    async def dispatch(batch: Batch):
+        try:
+            await process_batch(
+                job, batch, rate_limiter, scheduler, writer, num_retries, token_limiter
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            await fail_batch(job, batch, writer, err)
+        finally:
+            scheduler.release()
+            scheduler.resize(rate_limiter.rate)
+            job.tracker.requests_per_minute = rate_limiter.rate
+            job.tracker.concurrency_limit = scheduler.limit
+            job_queue.task_done()
+
+    try:
+        while True:
+            batch = await job_queue.get()
+            await scheduler.acquire()
+            task = asyncio.create_task(dispatch(batch))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+    finally:
+        for task in in_flight:
+            task.cancel()
 
 
 async def run(job: EmbedJob, update_ui_coroutine: Coroutine[None, None, None]):
     """
     Main entry point for the embedding job.
     """
-    job_queue = asyncio.Queue(maxsize=job.max_concurrent_requests)
+    job_queue = BatchQueue(config.SCHEDULER_QUEUE_MAX_BYTES)
     ui_task = asyncio.create_task(update_ui_coroutine)
-    request_limiter = AsyncLimiter(config.max_requests_per_minute(job.backend), 60)
+    request_limiter = AdaptiveRateLimiter(config.max_requests_per_minute(job.backend))
+    job.tracker.requests_per_minute = request_limiter.rate
+    tokens_per_minute = config.max_tokens_per_minute(job.backend)
+    token_limiter = AsyncLimiter(tokens_per_minute, 60) if tokens_per_minute else None
+    writer = BatchWriter(job).start()
     producer_task = asyncio.create_task(produce(job, job_queue))
     consumer_task = asyncio.create_task(
-        consume(job, request_limiter, job_queue=job_queue)
+        consume(
+            job,
+            request_limiter,
+            job_queue=job_queue,
+            writer=writer,
+            token_limiter=token_limiter,
+        )
     )
+    writer_failed = asyncio.create_task(writer.failed.wait())
     try:
-        await asyncio.wait({producer_task}, return_when=asyncio.FIRST_EXCEPTION)
-        await job_queue.join()
-        await terminate(consumer_task)
+        await asyncio.wait(
+            {producer_task, writer_failed}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not writer_failed.done():
+            queue_joined = asyncio.create_task(job_queue.join())
+            await asyncio.wait(
+                {queue_joined, writer_failed}, return_when=asyncio.FIRST_COMPLETED
+            )
+            await terminate(queue_joined)
+        if writer_failed.done():
+            # Results can't be saved, stop sending requests
+            await terminate(producer_task, consumer_task)
+        else:
+            await terminate(consumer_task)
     except KeyboardInterrupt:
         await terminate(producer_task, consumer_task)
     finally:
-        await client.cleanup()
-        await ui_task
+        try:
+            # Flush everything handed off so far before the outputs are closed,
+            # raises the write error if there was one
+            await writer.close()
+        finally:
+            await terminate(writer_failed)
+            await client.cleanup()
+            if writer.failed.is_set():
+                # The job won't finish, the UI would wait for it forever
+                await terminate(ui_task)
+            else:
+                await ui_task
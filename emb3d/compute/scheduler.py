@@ -0,0 +1,90 @@
+"""
+Request scheduling for remote jobs
+
+Instead of a fixed pool of worker coroutines, a dispatcher starts one task per
+batch once the adaptive concurrency limit allows it. The limit follows Little's
+law (in-flight requests = request rate x latency) so that it tracks what the
+rate limiter can actually sustain. Batches waiting to be dispatched are bounded
+by their size in bytes rather than by count.
+"""
+import asyncio
+import math
+
+from emb3d import config
+from emb3d.types import Batch
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit sized from the observed request latency and the current
+    request rate, clamped to `[1, max_limit]`.
+    """
+
+    def __init__(self, max_limit: int, requests_per_minute: float):
+        self.max_limit = max(1, max_limit)
+        self.in_flight = 0
+        self.latency = config.SCHEDULER_INITIAL_LATENCY_SECS
+        self.limit = 1
+        self._slot_free = asyncio.Event()
+        self.resize(requests_per_minute)
+
+    def resize(self, requests_per_minute: float) -> None:
+        """Little's law: concurrency = rate x latency, with some headroom"""
+        target = (
+            requests_per_minute / 60 * self.latency * config.SCHEDULER_HEADROOM_FACTOR
+        )
+        self.limit = min(self.max_limit, max(1, math.ceil(target)))
+        self._slot_free.set()
+
+    async def acquire(self) -> None:
+        while self.in_flight >= self.limit:
+            self._slot_free.clear()
+            await self._slot_free.wait()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._slot_free.set()
+
+    def observe(self, latency: float) -> None:
+        """Update the (exponentially smoothed) request latency estimate"""
+        alpha = config.SCHEDULER_LATENCY_SMOOTHING
+        self.latency = (1 - alpha) * self.latency + alpha * latency
+
+
+def batch_bytes(batch: Batch) -> int:
+    """Approximate memory held by the batch inputs"""
+    return sum(len(text) for text in batch.inputs)
+
+
+class BatchQueue:
+    """
+    Batch queue bounded by the total size of the queued inputs. A batch larger
+    than the budget is still accepted when the queue is empty.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.pending_bytes = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._room = asyncio.Event()
+
+    async def put(self, batch: Batch) -> None:
+        size = batch_bytes(batch)
+        while self.pending_bytes and self.pending_bytes + size > self.max_bytes:
+            self._room.clear()
+            await self._room.wait()
+        self.pending_bytes += size
+        self._queue.put_nowait(batch)
+
+    async def get(self) -> Batch:
+        batch = await self._queue.get()
+        self.pending_bytes -= batch_bytes(batch)
+        self._room.set()
+        return batch
+
+    def task_done(self) -> None:
+        self._queue.task_done()
+
+    async def join(self) -> None:
+        await self._queue.join()
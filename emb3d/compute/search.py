@@ -0,0 +1,57 @@
+"""
+Nearest neighbour search
+
+Exact cosine top-k over an embedding matrix. The matrix is scanned in blocks of
+rows, each block is scored against all the queries with a single matrix
+multiply and only the running top-k of every query is kept.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from emb3d import config
+
+
+def normalize(X: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms > 0, norms, 1)
+
+
+def _top_k_columns(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the `k` largest scores of every row, unordered"""
+    if scores.shape[1] <= k:
+        return np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def top_k(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    chunk_rows: int = config.SEARCH_CHUNK_ROWS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row indices and cosine similarities of the `k` rows of `matrix` closest to
+    every query, both `(num_queries, k)` arrays sorted by decreasing similarity.
+    """
+    queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+    num_queries = len(queries)
+    best_indices = np.empty((num_queries, 0), dtype=np.int64)
+    best_scores = np.empty((num_queries, 0), dtype=np.float32)
+    for start in range(0, len(matrix), chunk_rows):
+        chunk = normalize(np.asarray(matrix[start : start + chunk_rows], np.float32))
+        scores = queries @ chunk.T
+        columns = _top_k_columns(scores, k)
+        scores = np.concatenate(
+            [best_scores, np.take_along_axis(scores, columns, axis=1)], axis=1
+        )
+        indices = np.concatenate([best_indices, columns + start], axis=1)
+        keep = _top_k_columns(scores, k)
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_indices = np.take_along_axis(indices, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(best_indices, order, axis=1),
+        np.take_along_axis(best_scores, order, axis=1),
+    )
@@ -0,0 +1,291 @@
+"""
+Embedding server
+
+Keeps a model loaded (or a remote backend client open) and serves embeddings
+over a local HTTP endpoint. Concurrent requests are grouped into micro-batches,
+a batch is dispatched once it has `max_batch_size` inputs or the oldest request
+has waited `max_wait_secs`.
+
+    POST /embed  {"inputs": ["text", ...]}  ->  {"embeddings": [[...], ...]}
+    GET  /stats                              ->  request count and latencies
+"""
+import asyncio
+import io
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from emb3d import client, config
+from emb3d.compute.local import load_model
+from emb3d.compute.ratelimit import AdaptiveRateLimiter
+from emb3d.io import codec
+from emb3d.types import EmbedJob, ExecutionConfig, Failure, Result, WaitFor
+
+# Returns a list of embeddings or a 2D array
+EmbedFn = Callable[[List[str]], Sequence]
+
+_STOP = object()
+
+
+class LatencyStats:
+    """Thread-safe latency tracker over the most recent requests"""
+
+    def __init__(self, window: int = config.SERVE_LATENCY_WINDOW):
+        self._latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.batched_inputs = 0
+
+    def record_request(self, latency_secs: float):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency_secs)
+
+    def record_batch(self, size: int):
+        with self._lock:
+            self.batches += 1
+            self.batched_inputs += size
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            requests, batches = self.requests, self.batches
+            batched_inputs = self.batched_inputs
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0, 0)
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": batched_inputs / batches if batches else 0,
+            "p50_ms": round(float(p50) * 1000, 2),
+            "p99_ms": round(float(p99) * 1000, 2),
+        }
+
+
+class MicroBatcher:
+    """
+    Groups inputs submitted from many threads into batches for `embed_fn`, which
+    is called from a single background thread.
+    """
+
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        max_batch_size: int,
+        max_wait_secs: float,
+        stats: Optional[LatencyStats] = None,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_secs = max_wait_secs
+        self.stats = stats or LatencyStats()
+        self._queue: queue.Queue = queue.Queue()
+        # Request that didn't fit in the previous batch
+        self._held = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "MicroBatcher":
+        self._thread.start()
+        return self
+
+    def submit(self, inputs: List[str]) -> Future:
+        """
+        Queue inputs, the future resolves to their embeddings. Requests with
+        more than `max_batch_size` inputs are split across batches.
+        """
+        parts = []
+        for start in range(0, len(inputs), self.max_batch_size):
+            part: Future = Future()
+            self._queue.put((inputs[start : start + self.max_batch_size], part))
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        return _gather(parts)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> list:
+        """
+        Blocks for the first request, then collects more until the batch is full
+        or the deadline passes. Returns an empty list once closed.
+        """
+        first = self._held if self._held is not None else self._queue.get()
+        self._held = None
+        if first is _STOP:
+            return []
+        items = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait_secs
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Serve what was collected, stop on the next call
+                self._queue.put(_STOP)
+                break
+            if size + len(item[0]) > self.max_batch_size:
+                # Starts the next batch instead
+                self._held = item
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            if not items:
+                return
+            inputs = [text for item_inputs, _ in items for text in item_inputs]
+            try:
+                embeddings = self.embed_fn(inputs)
+            except Exception as err:
+                logging.exception("Embedding batch failed")
+                for _, future in items:
+                    future.set_exception(err)
+                continue
+            self.stats.record_batch(len(inputs))
+            offset = 0
+            for item_inputs, future in items:
+                future.set_result(embeddings[offset : offset + len(item_inputs)])
+                offset += len(item_inputs)
+
+
+def _gather(futures: List[Future]) -> Future:
+    """Future of the concatenated results of `futures`, or of the first error"""
+    gathered: Future = Future()
+    lock = threading.Lock()
+
+    def on_done(future: Future):
+        with lock:
+            if gathered.done():
+                return
+            if future.exception() is not None:
+                gathered.set_exception(future.exception())
+            elif all(part.done() for part in futures):
+                results = [part.result() for part in futures]
+                if isinstance(results[0], np.ndarray):
+                    gathered.set_result(np.concatenate(results))
+                else:
+                    gathered.set_result([row for result in results for row in result])
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
+
+
+def local_embed_fn(model_id: str, execution_config: ExecutionConfig) -> EmbedFn:
+    model = load_model(model_id, execution_config)
+    return model.encode
+
+
+def remote_embed_fn(model_id: str, api_key: str, num_retries: int = 3) -> EmbedFn:
+    """
+    Embeds through `client.gen`. Requests run on an event loop owned by a
+    background thread, so the backend clients are reused across batches.
+    """
+    job = EmbedJob(
+        job_id="serve",
+        in_file=io.StringIO(),
+        out_file=io.StringIO(),
+        model_id=model_id,
+        total_records=0,
+        batch_size=0,
+        max_concurrent_requests=1,
+        execution_config=ExecutionConfig.remote(api_key),
+    )
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    rate_limiter = asyncio.run_coroutine_threadsafe(
+        _new_rate_limiter(job), loop
+    ).result()
+
+    async def gen(inputs: List[str]) -> List[List[float]]:
+        error = None
+        for attempt in range(num_retries):
+            await rate_limiter.acquire()
+            resp = await client.gen(job, inputs)
+            if isinstance(resp, Result):
+                rate_limiter.on_success(resp.rate_limit)
+                return resp.data
+            if isinstance(resp, Failure):
+                raise RuntimeError(resp.error)
+            if isinstance(resp, WaitFor):
+                if resp.throttled:
+                    rate_limiter.on_throttle(resp.rate_limit)
+                error = resp.error
+                if attempt + 1 < num_retries:
+                    await asyncio.sleep(resp.seconds)
+        raise RuntimeError(error or "Backend unavailable")
+
+    return lambda inputs: asyncio.run_coroutine_threadsafe(gen(inputs), loop).result()
+
+
+async def _new_rate_limiter(job: EmbedJob) -> AdaptiveRateLimiter:
+    # The limiter's lock has to be created on the loop that uses it
+    return AdaptiveRateLimiter(config.max_requests_per_minute(job.backend))
+
+
+def _make_handler(batcher: MicroBatcher):
+    class EmbedHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            payload = codec.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path != "/stats":
+                self._reply(404, {"error": "Not found"})
+                return
+            self._reply(200, batcher.stats.summary())
+
+        def do_POST(self):
+            started = time.monotonic()
+            if self.path != "/embed":
+                self._reply(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                inputs = codec.loads(self.rfile.read(length))["inputs"]
+                if not isinstance(inputs, list) or not all(
+                    isinstance(text, str) for text in inputs
+                ):
+                    raise ValueError("`inputs` must be a list of strings")
+            except (KeyError, TypeError, ValueError) as err:
+                self._reply(400, {"error": f"Invalid request: {err}"})
+                return
+            try:
+                embeddings = batcher.submit(inputs).result() if inputs else []
+            except Exception as err:
+                self._reply(500, {"error": str(err)})
+                return
+            self._reply(200, {"embeddings": embeddings})
+            batcher.stats.record_request(time.monotonic() - started)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return EmbedHandler
+
+
+def make_server(host: str, port: int, batcher: MicroBatcher) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _make_handler(batcher))
+    server.daemon_threads = True
+    return server
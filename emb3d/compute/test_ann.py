@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from emb3d.compute import ann
+
+
+def _clustered(seed=0, rows=2000, dim=16, clusters=20):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    X = centers[rng.integers(clusters, size=rows)] + rng.normal(0, 0.1, (rows, dim))
+    return X.astype(np.float32)
+
+
+def test_build_and_load(tmp_path):
+    X = _clustered()
+    chunks = lambda: (X[start : start + 300] for start in range(0, len(X), 300))
+    path = tmp_path / "out.index"
+
+    index = ann.build(chunks, path, nlist=20, nprobe=4, source="abc")
+
+    loaded = ann.IVFIndex.load(path)
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.meta["source"] == "abc"
+    assert len(loaded) == len(X)
+    # Every row is stored once, grouped by list
+    assert sorted(loaded.ids.tolist()) == list(range(len(X)))
+    assert loaded.offsets[-1] == len(X)
+    np.testing.assert_allclose(
+        loaded.vectors[np.argsort(loaded.ids)],
+        X / np.linalg.norm(X, axis=1, keepdims=True),
+        rtol=1e-5,
+    )
+
+    indices, scores = index.search(X[:3], k=5)
+    assert indices[:, 0].tolist() == [0, 1, 2]
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+    report = ann.evaluate(index, k=10, num_queries=50)
+    assert report["recall"] > 0.9
+
+
+def test_load_rejects_other_versions(tmp_path):
+    X = _clustered(rows=100)
+    path = tmp_path / "out.index"
+    ann.build(lambda: [X], path)
+    meta = (path / ann.META_FILE).read_text()
+    (path / ann.META_FILE).write_text(meta.replace('"version": 1', '"version": 0'))
+
+    with pytest.raises(ValueError):
+        ann.IVFIndex.load(path)
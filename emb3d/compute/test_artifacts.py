@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+
+from emb3d.compute import artifacts
+from emb3d.compute.visualize import Projection
+
+
+class IdentityReducer:
+    def transform(self, X):
+        return X[:, :2]
+
+
+def test_projection_roundtrip(tmp_path):
+    embedding_file = tmp_path / "out.jsonl"
+    embedding_file.write_text('{"row_id": 0, "embedding": [1, 2]}\n')
+    coords = np.arange(6, dtype=np.float32).reshape(3, 2)
+
+    map_artifacts = artifacts.MapArtifacts.open(embedding_file, {"projection": "exact"})
+    assert map_artifacts.load_projection() is None
+    map_artifacts.save_projection(coords, Projection(IdentityReducer()))
+    map_artifacts.save_single_linkage(np.ones((2, 4)), 10)
+
+    reopened = artifacts.MapArtifacts.open(embedding_file, {"projection": "exact"})
+    cached_coords, projection = reopened.load_projection()
+    np.testing.assert_array_equal(cached_coords, coords)
+    assert projection.transform(np.ones((2, 3))).shape == (2, 2)
+    assert reopened.load_single_linkage(10).shape == (2, 4)
+    assert reopened.load_single_linkage(5) is None
+    assert artifacts.MapArtifacts.latest(embedding_file).path == reopened.path
+
+    # Other parameters don't share the cache
+    other = artifacts.MapArtifacts.open(embedding_file, {"projection": "scalable"})
+    assert other.load_projection() is None
+
+
+def test_changed_file_invalidates_cache(tmp_path):
+    embedding_file = tmp_path / "out.jsonl"
+    embedding_file.write_text('{"row_id": 0, "embedding": [1, 2]}\n')
+    map_artifacts = artifacts.MapArtifacts.open(embedding_file, {})
+    map_artifacts.save_projection(np.zeros((1, 2)), Projection(IdentityReducer()))
+
+    embedding_file.write_text('{"row_id": 0, "embedding": [3, 4]}\n')
+    os.utime(embedding_file, ns=(0, 0))
+
+    assert artifacts.MapArtifacts.latest(embedding_file) is None
+    changed = artifacts.MapArtifacts.open(embedding_file, {})
+    assert changed.load_projection() is None
+    changed.save_projection(np.zeros((1, 2)), Projection(IdentityReducer()))
+    # Entries of the previous version are dropped
+    assert list(artifacts.artifacts_dir(embedding_file).iterdir()) == [changed.path]
@@ -1,7 +1,15 @@
 import io
 import json
 
-from emb3d.compute.common import gen_batch, write_batch_results_post_lock
+from emb3d import client, config
+from emb3d.compute.common import (
+    gen_batch,
+    gen_bucketed_batch,
+    gen_records,
+    write_batch_results_post_lock,
+)
+from emb3d.compute.dedupe import DedupeIndex
+from emb3d.io import checkpoint, sidecar
 from emb3d.test_utils import mock_embed_job
 from emb3d.types import Batch
 
@@ -76,3 +84,142 @@ def test_gen_batch_high_tokens():
     assert len(batches) == 1
     assert batches[0].row_ids == [0, 1]
     assert batches[0].inputs == ["hello", "world"]
+
+
+def test_write_batch_results_post_lock_sidecar(tmp_path):
+    embedding_sidecar = sidecar.SidecarWriter(tmp_path / "out.npy")
+    job = mock_embed_job(embedding_sidecar=embedding_sidecar)
+
+    write_batch_results_post_lock(
+        job, Batch(row_ids=[0, 1], inputs=["a", "b"], embeddings=[[1, 2], [3, 4]])
+    )
+    write_batch_results_post_lock(
+        job, Batch(row_ids=[2], inputs=["c"], embeddings=None, error="failed")
+    )
+    embedding_sidecar.close()
+
+    job.out_file.seek(0)
+    rows = [json.loads(line) for line in job.out_file]
+    assert [row["row_id"] for row in rows] == [0, 1, 2]
+    assert all("embedding" not in row for row in rows)
+    assert rows[2]["error"] == "failed"
+    assert sidecar.load(tmp_path / "out.npy").tolist() == [[1, 2], [3, 4], [0, 0]]
+
+
+def test_gen_batch_skips_completed_rows(tmp_path):
+    in_file = io.StringIO("\n".join(f'{{"text": "row {i}"}}' for i in range(5)))
+    out_file = (tmp_path / "out.jsonl").open("w")
+    job = mock_embed_job(
+        in_file=in_file,
+        out_file=out_file,
+        total_records=5,
+        checkpoint=checkpoint.Checkpoint(
+            tmp_path / "out.jsonl.ckpt",
+            out_file,
+            None,
+            checkpoint.RowRanges([(0, 2), (3, 4)]),
+            interval=3600,
+        ),
+    )
+
+    batches = list(gen_batch(job, batch_size=10, max_tokens=100))
+
+    assert [batch.row_ids for batch in batches] == [[2, 4]]
+    assert job.tracker.saved == 3
+
+
+def test_dedupe_fan_out():
+    texts = ["a", "b", "a", "a", "b"]
+    in_file = io.StringIO("\n".join(json.dumps({"text": text}) for text in texts))
+    job = mock_embed_job(
+        in_file=in_file, total_records=5, dedupe=DedupeIndex.build(texts)
+    )
+
+    batches = list(gen_batch(job, batch_size=10, max_tokens=100))
+    assert [batch.row_ids for batch in batches] == [[0, 1]]
+
+    batches[0].embeddings = [[1, 1], [2, 2]]
+    job.batch_success(2)
+    write_batch_results_post_lock(job, batches[0])
+
+    job.out_file.seek(0)
+    rows = {row["row_id"]: row for row in map(json.loads, job.out_file)}
+    assert sorted(rows) == [0, 1, 2, 3, 4]
+    assert rows[3]["embedding"] == [1, 1]
+    assert rows[4]["embedding"] == [2, 2]
+    assert job.tracker.saved == job.tracker.success == job.tracker.total
+
+
+def test_gen_batch_token_count():
+    in_file = io.StringIO('{"text": "hello"}\n{"text": "world"}')
+    job = mock_embed_job(in_file=in_file)
+
+    batches = list(gen_batch(job, batch_size=10, max_tokens=100))
+
+    assert len(batches) == 1
+    assert batches[0].token_count == 2 * client.approx_token_count(job, "hello")
+
+
+def test_gen_batch_streaming_total():
+    in_file = io.StringIO("\n".join(f'{{"text": "row {i}"}}' for i in range(2500)))
+    job = mock_embed_job(
+        in_file=in_file,
+        total_records=0,
+        streaming=True,
+        input_size_bytes=len(in_file.getvalue()),
+    )
+
+    batches = gen_batch(job, batch_size=100, max_tokens=1000)
+    for _ in range(16):
+        next(batches)
+    # Estimated from the bytes read so far
+    assert job.tracker.total_estimated
+    assert 2400 <= job.tracker.total <= 2600
+
+    list(batches)
+    assert not job.tracker.total_estimated
+    assert job.tracker.total == job.total_records == 2500
+
+
+def test_gen_bucketed_batch():
+    texts = ["x" * 400, "a", "b" * 200, "c", "d" * 300, "e"]
+    in_file = io.StringIO("\n".join(json.dumps({"text": text}) for text in texts))
+    job = mock_embed_job(in_file=in_file)
+
+    batches = list(gen_bucketed_batch(job, batch_size=3, max_tokens=1000, window=6))
+
+    # Short rows are batched together, row ids still point at the source rows
+    assert [batch.row_ids for batch in batches] == [[1, 3], [5, 2], [4, 0]]
+    for batch in batches:
+        assert batch.inputs == [texts[row_id] for row_id in batch.row_ids]
+
+
+def test_gen_records_parallel(tmp_path, monkeypatch):
+    texts = [f"row {i % 150} " + "é" * (i % 150 % 7) for i in range(200)]
+    in_path = tmp_path / "in.jsonl"
+    # No trailing newline, the last range ends at the end of the file
+    in_path.write_text("\n".join(json.dumps({"text": text}) for text in texts))
+    monkeypatch.setattr(config, "INPUT_RANGE_BYTES", 100)
+
+    def records(read_workers):
+        out_file = (tmp_path / f"out-{read_workers}.jsonl").open("w")
+        with in_path.open() as in_file:
+            job = mock_embed_job(
+                in_file=in_file,
+                out_file=out_file,
+                total_records=len(texts),
+                dedupe=DedupeIndex.build(texts),
+                checkpoint=checkpoint.Checkpoint(
+                    tmp_path / f"out-{read_workers}.jsonl.ckpt",
+                    out_file,
+                    None,
+                    checkpoint.RowRanges([(3, 40), (120, 130)]),
+                    interval=3600,
+                ),
+                read_workers=read_workers,
+            )
+            return list(gen_records(job))
+
+    expected = records(read_workers=1)
+    assert 0 < len(expected) < len(texts)
+    assert records(read_workers=2) == expected
@@ -0,0 +1,13 @@
+from emb3d.compute.dedupe import DedupeIndex
+
+
+def test_dedupe_index():
+    index = DedupeIndex.build(["a", "b", "a", "c", "b", "a"])
+
+    assert len(index) == 6
+    assert index.num_unique == 3
+    assert [index.leader(row) for row in range(6)] == [0, 1, 0, 3, 1, 0]
+    assert index.is_leader(3)
+    assert not index.is_leader(4)
+    assert index.followers(0) == [2, 5]
+    assert index.followers(3) == []
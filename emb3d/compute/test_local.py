@@ -1,13 +1,16 @@
 import io
 import json
-from io import reader
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 
 import numpy as np
 import pytest
 
+from emb3d.cache import EmbeddingCache
 from emb3d.compute.local import run
+from emb3d.io import reader
 from emb3d.test_utils import mock_embed_job
+from emb3d.types import ExecutionConfig
 
 
 @pytest.mark.parametrize(
@@ -38,3 +41,54 @@ def test_run(inputs, expected_embeddings):
         assert len(saved_records) == len(inputs)
         for idx, _ in enumerate(inputs):
             assert saved_records[idx]["embedding"] == expected_embeddings[idx].tolist()
+
+
+def test_run_with_cache(tmp_path):
+    mock_model = Mock()
+    mock_model.encode.side_effect = lambda inputs: np.array(
+        [[len(x), 0] for x in inputs]
+    )
+
+    with patch("sentence_transformers.SentenceTransformer", return_value=mock_model):
+        embedding_cache = EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=10**6)
+        embedding_cache.put_many("model", ["cached"], [[-1, -1]])
+        in_file = io.StringIO('{"text": "cached"}\n{"text": "new"}')
+        job = mock_embed_job(in_file=in_file, embedding_cache=embedding_cache)
+        run(job)
+
+        mock_model.encode.assert_called_once_with(["new"])
+        job.out_file.seek(0)
+        saved_records = list(reader.jsonl(job.out_file))
+        assert [record["embedding"] for record in saved_records] == [[-1, -1], [3, 0]]
+        assert (job.tracker.cache_hits, job.tracker.cache_misses) == (1, 1)
+
+
+def test_run_parallel():
+    def thread_pool(workers, mp_context, initializer, initargs):
+        # Worker processes can't see the patched model, threads share it
+        return ThreadPoolExecutor(workers, initializer=initializer, initargs=initargs)
+
+    mock_model = Mock()
+    mock_model.encode.side_effect = lambda inputs: np.array(
+        [[len(x), 0] for x in inputs]
+    )
+
+    with patch(
+        "sentence_transformers.SentenceTransformer", return_value=mock_model
+    ), patch("emb3d.compute.local.ProcessPoolExecutor", thread_pool):
+        inputs = ["x" * idx for idx in range(25)]
+        in_file = io.StringIO("\n".join(json.dumps({"text": x}) for x in inputs))
+        job = mock_embed_job(
+            in_file=in_file,
+            batch_size=3,
+            total_records=len(inputs),
+            execution_config=ExecutionConfig.local(workers=4),
+        )
+        run(job)
+
+        job.out_file.seek(0)
+        saved = {row["row_id"]: row for row in reader.jsonl(job.out_file)}
+        assert sorted(saved) == list(range(len(inputs)))
+        assert all(row["embedding"] == [idx, 0] for idx, row in saved.items())
+        assert job.tracker.saved == len(inputs)
+        assert job.tracker.encoding == 0
@@ -0,0 +1,31 @@
+import numpy as np
+
+from emb3d.compute import neardup
+
+
+def test_duplicate_groups_across_tiles():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(50, 16)).astype(np.float32)
+    # Scaled and slightly perturbed copies, in different tiles
+    matrix[30] = matrix[2] * 3 + 0.01
+    matrix[45] = matrix[30]
+    matrix[11] = matrix[7]
+
+    groups = neardup.duplicate_groups(matrix, 0.99, tile_rows=8, threads=2)
+
+    assert [rows.tolist() for rows in neardup.iter_groups(groups)] == [
+        [2, 30, 45],
+        [7, 11],
+    ]
+
+
+def test_duplicate_groups_within_blocks():
+    matrix = np.ones((4, 2), dtype=np.float32)
+    groups = neardup.duplicate_groups(matrix, 0.99, blocks=[(0, 2), (2, 4)])
+    assert groups.tolist() == [0, 0, 2, 2]
+
+
+def test_union_find_chains():
+    union_find = neardup.UnionFind(6)
+    union_find.union(np.array([4, 3, 1]), np.array([5, 4, 3]))
+    assert union_find.groups().tolist() == [0, 1, 2, 1, 1, 1]
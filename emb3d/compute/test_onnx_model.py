@@ -0,0 +1,134 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from emb3d.compute import onnx_model
+from emb3d.compute.onnx_model import (
+    METADATA_FILE,
+    OnnxEmbedder,
+    _check_modules,
+    _pooling_mode,
+    artifact_dir,
+    pool,
+    prepare,
+)
+
+
+def test_pool():
+    hidden_states = np.array(
+        [[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]], [[5.0, 6.0], [7.0, 0.0], [0, 0]]]
+    )
+    attention_mask = np.array([[1, 1, 0], [1, 1, 1]])
+
+    mean = pool(hidden_states, attention_mask, "mean")
+    assert mean.tolist() == [[2.0, 3.0], [4.0, 2.0]]
+    assert pool(hidden_states, attention_mask, "cls").tolist() == [[1, 2], [5, 6]]
+    assert pool(hidden_states, attention_mask, "max").tolist() == [[3, 4], [7, 6]]
+    with pytest.raises(ValueError):
+        pool(hidden_states, attention_mask, "weightedmean")
+
+
+def test_artifact_dir():
+    path = artifact_dir("sentence-transformers/all-MiniLM-L6-v2")
+    assert path.name == "sentence-transformers--all-MiniLM-L6-v2"
+    assert path.parent.name == "onnx"
+
+
+class Pooling:
+    def __init__(self, **config):
+        self.config = config
+
+    def get_config_dict(self):
+        return self.config
+
+
+class Transformer:
+    pass
+
+
+class Dense:
+    pass
+
+
+def test_pooling_mode():
+    assert _pooling_mode([Transformer(), Pooling(pooling_mode="cls")]) == "cls"
+    flags = {"pooling_mode_mean_tokens": True, "pooling_mode_cls_token": False}
+    assert _pooling_mode([Transformer(), Pooling(**flags)]) == "mean"
+
+    # Modes the engine doesn't reproduce aren't replaced by mean pooling
+    for config in (
+        {"pooling_mode": "weightedmean"},
+        {"pooling_mode_lasttoken": True},
+        {"pooling_mode_mean_tokens": True, "pooling_mode_max_tokens": True},
+    ):
+        with pytest.raises(ValueError):
+            _pooling_mode([Transformer(), Pooling(**config)])
+
+
+def test_check_modules():
+    _check_modules([Transformer(), Pooling(pooling_mode="mean")])
+    with pytest.raises(ValueError):
+        _check_modules([Transformer(), Pooling(pooling_mode="mean"), Dense()])
+
+
+def test_prepare_keeps_concurrent_export(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    def export(model_id, out_dir):
+        (out_dir / METADATA_FILE).write_text("{}")
+        # Another process finishes the same export first
+        other_dir = artifact_dir(model_id)
+        other_dir.mkdir()
+        (other_dir / METADATA_FILE).write_text('{"other": true}')
+
+    monkeypatch.setattr(onnx_model, "_export", export)
+    out_dir = prepare("tiny-model", quantize=False)
+
+    assert out_dir == artifact_dir("tiny-model")
+    assert (out_dir / METADATA_FILE).read_text() == '{"other": true}'
+    assert [path.name for path in out_dir.parent.iterdir()] == [out_dir.name]
+
+
+def tiny_model(path: Path) -> Path:
+    """Randomly initialized sentence transformer, small enough to export quickly"""
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *"abcdefghijklmnop"]
+    (path / "bert").mkdir()
+    (path / "bert" / "vocab.txt").write_text("\n".join(vocab))
+    BertTokenizerFast(str(path / "bert" / "vocab.txt")).save_pretrained(
+        str(path / "bert")
+    )
+    bert_config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=16,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=32,
+        max_position_embeddings=64,
+    )
+    BertModel(bert_config).save_pretrained(str(path / "bert"))
+
+    transformer = models.Transformer(str(path / "bert"), max_seq_length=32)
+    pooling = models.Pooling(16, pooling_mode="mean")
+    model_path = path / "model"
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()]).save(
+        str(model_path)
+    )
+    return model_path
+
+
+def test_onnx_matches_torch(tmp_path, monkeypatch):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from sentence_transformers import SentenceTransformer
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    model_path = tiny_model(tmp_path)
+    inputs = ["abc", "a b c d e f", "ponm lkji hgfe dcba"]
+
+    expected = SentenceTransformer(str(model_path), device="cpu").encode(inputs)
+    embeddings = OnnxEmbedder.load(str(model_path)).encode(inputs)
+    np.testing.assert_allclose(embeddings, expected, atol=1e-5)
@@ -0,0 +1,52 @@
+import asyncio
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from emb3d.compute import ratelimit
+from emb3d.compute.ratelimit import AdaptiveRateLimiter
+from emb3d.types import RateLimitInfo
+
+
+def test_additive_increase_multiplicative_decrease():
+    limiter = AdaptiveRateLimiter(100, increase_step=10, decrease_factor=0.5)
+    now = time.monotonic()
+    with patch("time.monotonic", return_value=now + 5):
+        limiter.on_success()
+        # Atmost one increase per adjustment interval
+        limiter.on_success()
+    assert limiter.rate == 110
+
+    with patch("time.monotonic", return_value=now + 10):
+        limiter.on_throttle()
+        limiter.on_throttle()
+    assert limiter.rate == 55
+
+
+def test_rate_capped_by_advertised_limit():
+    limiter = AdaptiveRateLimiter(1000, max_rate=10**6)
+    limiter.on_success(RateLimitInfo(limit_requests=500))
+
+    assert limiter.max_rate < 500
+    assert limiter.rate == limiter.max_rate
+
+
+def test_acquire_paces_requests():
+    clock = [0.0]
+
+    async def fake_sleep(seconds):
+        clock[0] += seconds
+
+    async def acquire_all(limiter: AdaptiveRateLimiter, count: int):
+        for _ in range(count):
+            await limiter.acquire()
+
+    fake_time = Mock(monotonic=lambda: clock[0])
+    with patch.object(ratelimit, "time", fake_time), patch("asyncio.sleep", fake_sleep):
+        # 1200 requests per minute = 20 per second, with a burst of 20
+        limiter = AdaptiveRateLimiter(1200)
+        start = clock[0]
+        asyncio.run(acquire_all(limiter, 25))
+    # The bucket starts with a single request, the other 24 are paced
+    assert clock[0] - start == pytest.approx(1.2)
@@ -0,0 +1,160 @@
+import asyncio
+import io
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from emb3d.cache import EmbeddingCache
+from emb3d.compute import remote
+from emb3d.compute.ratelimit import AdaptiveRateLimiter
+from emb3d.compute.scheduler import AdaptiveConcurrency
+from emb3d.compute.writer import BatchWriter
+from emb3d.test_utils import mock_embed_job
+from emb3d.types import ExecutionConfig, Result
+
+
+async def fake_gen(job, inputs):
+    await asyncio.sleep(0)
+    return Result([[float(len(text)), 0.0] for text in inputs])
+
+
+def remote_job(num_records: int, **kwargs):
+    records = [json.dumps({"text": f"text {idx}"}) for idx in range(num_records)]
+    return mock_embed_job(
+        in_file=io.StringIO("\n".join(records)),
+        model_id="hf/model",
+        total_records=num_records,
+        execution_config=ExecutionConfig.remote("key"),
+        **kwargs,
+    )
+
+
+def saved_rows(job):
+    job.out_file.seek(0)
+    return [json.loads(line) for line in job.out_file]
+
+
+def test_run():
+    job = remote_job(25, batch_size=10, max_concurrent_requests=4)
+
+    with patch("emb3d.client.gen", fake_gen):
+        asyncio.run(remote.run(job, asyncio.sleep(0)))
+
+    rows = saved_rows(job)
+    assert sorted(row["row_id"] for row in rows) == list(range(25))
+    assert all(row["error"] is None for row in rows)
+    assert job.tracker.saved == job.tracker.success == 25
+
+
+def test_process_batch_charges_tokens():
+    async def run_batch(job, batch):
+        token_limiter = Mock(max_rate=10**6, acquire=AsyncMock())
+        writer = BatchWriter(job).start()
+        await remote.process_batch(
+            job,
+            batch,
+            AdaptiveRateLimiter(6000),
+            AdaptiveConcurrency(4, 6000),
+            writer,
+            token_limiter=token_limiter,
+        )
+        await writer.close()
+        return token_limiter
+
+    job = remote_job(3)
+    batch = next(remote.gen_batch(job, job.batch_size, 100))
+    with patch("emb3d.client.gen", fake_gen):
+        token_limiter = asyncio.run(run_batch(job, batch))
+
+    assert batch.token_count > 0
+    token_limiter.acquire.assert_awaited_once_with(batch.token_count)
+
+
+def test_run_bounds_in_flight_requests():
+    in_flight = peak = 0
+
+    async def slow_gen(job, inputs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return Result([[1.0] for _ in inputs])
+
+    job = remote_job(40, batch_size=2, max_concurrent_requests=3)
+    with patch("emb3d.client.gen", slow_gen):
+        asyncio.run(remote.run(job, asyncio.sleep(0)))
+
+    assert 1 <= peak <= 3
+    assert job.tracker.saved == 40
+
+
+def test_writer_backpressure():
+    async def write_all(job, batches):
+        writer = BatchWriter(job, max_pending=1).start()
+        for batch in batches:
+            await writer.put(batch)
+        await writer.close()
+
+    job = remote_job(50, batch_size=5)
+    batches = list(remote.gen_batch(job, job.batch_size, 100))
+    for batch in batches:
+        batch.embeddings = [[1.0]] * len(batch.inputs)
+
+    asyncio.run(write_all(job, batches))
+
+    assert [row["row_id"] for row in saved_rows(job)] == list(range(50))
+    assert job.tracker.saved == 50
+
+
+def test_run_stops_on_write_error():
+    requested = 0
+
+    async def counting_gen(job, inputs):
+        nonlocal requested
+        requested += 1
+        await asyncio.sleep(0.01)
+        return Result([[1.0] for _ in inputs])
+
+    job = remote_job(200, batch_size=2, max_concurrent_requests=2)
+    with patch("emb3d.client.gen", counting_gen), patch(
+        "emb3d.compute.writer.write_rows_post_lock", side_effect=OSError("disk full")
+    ):
+        with pytest.raises(RuntimeError) as err:
+            asyncio.run(remote.run(job, asyncio.sleep(3600)))
+
+    assert isinstance(err.value.__cause__, OSError)
+
+    # The job stops shortly after the first write fails
+    assert requested < 20
+
+
+def test_run_records_failed_batches():
+    async def failing_gen(job, inputs):
+        if "text 3" in inputs:
+            raise ValueError("bad response")
+        return Result([[1.0] for _ in inputs])
+
+    job = remote_job(10, batch_size=3, max_concurrent_requests=2)
+    with patch("emb3d.client.gen", failing_gen):
+        asyncio.run(remote.run(job, asyncio.sleep(0)))
+
+    rows = {row["row_id"]: row for row in saved_rows(job)}
+    assert sorted(rows) == list(range(10))
+    assert rows[2]["error"] == rows[3]["error"] == "bad response"
+    assert all(rows[row_id]["error"] is None for row_id in (0, 1, 4, 5))
+    assert job.tracker.failed == 2 and job.tracker.success == 8
+
+
+def test_run_uses_cache(tmp_path):
+    with EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=10**6) as cache:
+        cache.put_many("hf/model", ["text 1"], [[-1.0, -1.0]])
+        job = remote_job(4, batch_size=10, embedding_cache=cache)
+        with patch("emb3d.client.gen", fake_gen):
+            asyncio.run(remote.run(job, asyncio.sleep(0)))
+        assert cache.get_many("hf/model", ["text 2"]) == [[6.0, 0.0]]
+
+    rows = {row["row_id"]: row for row in saved_rows(job)}
+    assert rows[1]["embedding"] == [-1.0, -1.0]
+    assert rows[0]["embedding"] == [6.0, 0.0]
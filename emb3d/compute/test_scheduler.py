@@ -0,0 +1,48 @@
+import asyncio
+
+from emb3d.compute.scheduler import AdaptiveConcurrency, BatchQueue
+from emb3d.types import Batch
+
+
+def test_concurrency_follows_littles_law():
+    async def check():
+        scheduler = AdaptiveConcurrency(max_limit=1000, requests_per_minute=600)
+        # 10 requests/sec x 1s latency x 1.5 headroom
+        assert scheduler.limit == 15
+        for _ in range(50):
+            scheduler.observe(0.1)
+        scheduler.resize(600)
+        assert scheduler.limit == 2
+        scheduler.resize(6_000_000)
+        assert scheduler.limit == 1000
+
+    asyncio.run(check())
+
+
+def test_concurrency_acquire_waits_for_release():
+    async def check():
+        scheduler = AdaptiveConcurrency(max_limit=1, requests_per_minute=60)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release()
+        await asyncio.wait_for(waiter, 1)
+        assert scheduler.in_flight == 1
+
+    asyncio.run(check())
+
+
+def test_batch_queue_bounded_by_bytes():
+    async def check():
+        queue = BatchQueue(max_bytes=10)
+        await queue.put(Batch([0], ["a" * 8]))
+        # Oversized batches are accepted by an empty queue only
+        blocked = asyncio.create_task(queue.put(Batch([1], ["b" * 20])))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+        assert (await queue.get()).row_ids == [0]
+        await asyncio.wait_for(blocked, 1)
+        assert queue.pending_bytes == 20
+
+    asyncio.run(check())
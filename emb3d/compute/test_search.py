@@ -0,0 +1,26 @@
+import numpy as np
+
+from emb3d.compute import search
+
+
+def test_top_k_matches_full_scan():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(1000, 8)).astype(np.float32)
+    queries = rng.normal(size=(3, 8)).astype(np.float32)
+
+    indices, scores = search.top_k(matrix, queries, k=5, chunk_rows=64)
+
+    normalized = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    similarities = queries @ normalized.T / np.linalg.norm(queries, axis=1)[:, None]
+    expected = np.argsort(-similarities, axis=1)[:, :5]
+    assert indices.tolist() == expected.tolist()
+    np.testing.assert_allclose(
+        scores, np.take_along_axis(similarities, expected, axis=1), rtol=1e-5
+    )
+
+
+def test_top_k_fewer_rows_than_k():
+    matrix = np.array([[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]], dtype=np.float32)
+    indices, scores = search.top_k(matrix, np.array([[0.0, 2.0]]), k=10)
+    assert indices.tolist() == [[1, 0, 2]]
+    assert scores.tolist() == [[1.0, 0.0, 0.0]]
@@ -0,0 +1,99 @@
+import json
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from emb3d.compute import serve
+
+
+def fake_embed(inputs):
+    return [[float(len(text))] for text in inputs]
+
+
+def test_micro_batcher_groups_requests():
+    calls = []
+    release = threading.Event()
+
+    def embed(inputs):
+        calls.append(list(inputs))
+        release.wait(1)
+        return fake_embed(inputs)
+
+    batcher = serve.MicroBatcher(embed, max_batch_size=8, max_wait_secs=0.05).start()
+    # A full batch is dispatched right away
+    first = batcher.submit(["a"] * 8)
+    # Queued while the first batch is being computed, so they're batched together
+    rest = [batcher.submit(["b" * n, "c"]) for n in range(1, 4)]
+    release.set()
+
+    assert first.result(1) == [[1.0]] * 8
+    assert [future.result(1) for future in rest] == [
+        [[1.0], [1.0]],
+        [[2.0], [1.0]],
+        [[3.0], [1.0]],
+    ]
+    batcher.close()
+    assert len(calls) == 2
+    assert batcher.stats.batches == 2
+
+
+def test_micro_batcher_caps_batch_size():
+    calls = []
+    release = threading.Event()
+
+    def embed(inputs):
+        calls.append(len(inputs))
+        release.wait(1)
+        return fake_embed(inputs)
+
+    batcher = serve.MicroBatcher(embed, max_batch_size=4, max_wait_secs=0.05).start()
+    first = batcher.submit(["a"])
+    # Split across batches, and held over when they don't fit in the current one
+    large = batcher.submit(["b"] * 10)
+    small = [batcher.submit(["c"] * 3) for _ in range(2)]
+    release.set()
+
+    assert first.result(1) == [[1.0]]
+    assert large.result(1) == [[1.0]] * 10
+    assert [future.result(1) for future in small] == [[[1.0]] * 3] * 2
+    batcher.close()
+    assert max(calls) <= 4
+    assert sum(calls) == 17
+
+
+def test_micro_batcher_propagates_errors():
+    def embed(inputs):
+        raise RuntimeError("backend down")
+
+    batcher = serve.MicroBatcher(embed, max_batch_size=8, max_wait_secs=0).start()
+    error = batcher.submit(["a"]).exception(1)
+    batcher.close()
+    assert str(error) == "backend down"
+
+
+def test_server_roundtrip():
+    batcher = serve.MicroBatcher(fake_embed, max_batch_size=4, max_wait_secs=0.01)
+    server = serve.make_server("127.0.0.1", 0, batcher.start())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    def embed(texts):
+        request = urllib.request.Request(
+            f"{url}/embed", data=json.dumps({"inputs": texts}).encode()
+        )
+        with urllib.request.urlopen(request) as resp:
+            return json.load(resp)["embeddings"]
+
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(embed, [["x" * n] for n in range(16)]))
+        with urllib.request.urlopen(f"{url}/stats") as resp:
+            stats = json.load(resp)
+    finally:
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+    assert results == [[[float(n)]] for n in range(16)]
+    assert stats["requests"] == 16
+    assert stats["p99_ms"] >= stats["p50_ms"] > 0
@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import hdbscan
+import numpy as np
+import pytest
+
+from emb3d.compute import visualize
+
+
+def test_stratified_sample_covers_small_clusters():
+    rng = np.random.default_rng(0)
+    X = np.concatenate(
+        [rng.normal(0, 0.1, (990, 4)), rng.normal(50, 0.1, (10, 4))]
+    ).astype(np.float32)
+
+    with patch("emb3d.config.VISUALIZATION_STRATA", 5):
+        sample = visualize.stratified_sample(X, 50, rng)
+
+    assert len(np.unique(sample)) == len(sample)
+    assert 45 <= len(sample) <= 60
+    assert (sample >= 990).any()
+
+
+def test_scalable_reduce():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(600, 64)).astype(np.float32)
+
+    with patch("emb3d.config.VISUALIZATION_CHUNK_ROWS", 128):
+        X_reduced, projection = visualize.scalable_reduce(X, sample_size=200, threads=1)
+
+    assert X_reduced.shape == (600, 2)
+    assert np.isfinite(X_reduced).all()
+    assert projection.transform(X[:10]).shape == (10, 2)
+
+
+def test_cluster_labels_match_hdbscan():
+    rng = np.random.default_rng(0)
+    X = np.concatenate([rng.normal(c, 0.2, (100, 2)) for c in (0, 5, 10)])
+
+    for min_cluster_size in (5, 20):
+        single_linkage = visualize.single_linkage_tree(X, min_cluster_size)
+        expected = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size).fit(X).labels_
+        np.testing.assert_array_equal(
+            visualize.cluster_labels(single_linkage, min_cluster_size), expected
+        )
+
+
+def test_cluster_labels_unsupported_hdbscan():
+    with patch.dict("sys.modules", {"hdbscan._hdbscan_tree": None}):
+        with pytest.raises(ImportError, match="Clustering isn't supported"):
+            visualize.cluster_labels(np.zeros((1, 4)), 5)
+
+
+def test_point_colors():
+    colors = visualize.point_colors(np.array([-1, 0, 12]))
+    assert colors.tolist() == [0, 1, 3]
+    assert visualize.point_colors(None, np.array([False, True])).tolist() == [1, 2]
+    assert visualize.point_colors(None) is None
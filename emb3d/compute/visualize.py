@@ -1,56 +1,163 @@
+import importlib.metadata
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Tuple
 
 import altair as alt
 import hdbscan
 import numpy as np
 import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+from threadpoolctl import threadpool_limits
 from umap import UMAP
 
-from emb3d.io import reader
+from emb3d import config
+from emb3d.io import loader, writer
 
 NUM_TITLES = 20
-READ_CHUNK_SIZE = 500
 
 
-def cluster_hdbscan(X: pd.DataFrame, min_cluster_size: int) -> hdbscan.HDBSCAN:
-    return hdbscan.HDBSCAN(min_cluster_size=min_cluster_size).fit(X)
+def single_linkage_tree(X: np.ndarray, min_samples: int) -> np.ndarray:
+    """
+    HDBSCAN single linkage tree, as an array. The tree only depends on
+    `min_samples` and is re-cut for a cluster size with `cluster_labels`.
+    """
+    clusterer = hdbscan.HDBSCAN(min_samples=min_samples, gen_min_span_tree=False)
+    return clusterer.fit(X).single_linkage_tree_.to_numpy()
+
+
+def _hdbscan_tree():
+    """
+    hdbscan's private tree functions, imported lazily so that an incompatible
+    hdbscan release only breaks clustering rather than every command.
+    """
+    try:
+        from hdbscan._hdbscan_tree import compute_stability, condense_tree, get_clusters
+    except ImportError as err:
+        version = importlib.metadata.version("hdbscan")
+        raise ImportError(
+            f"Clustering isn't supported with hdbscan {version} ({err}), "
+            "install a tested release with: pip install 'hdbscan<=0.8.44'"
+        ) from err
+    return condense_tree, compute_stability, get_clusters
+
+
+def cluster_labels(single_linkage: np.ndarray, min_cluster_size: int) -> np.ndarray:
+    """Cluster labels (-1 for noise) for a cut of the single linkage tree"""
+    condense_tree, compute_stability, get_clusters = _hdbscan_tree()
+    condensed = condense_tree(single_linkage, min_cluster_size)
+    labels, _, _ = get_clusters(condensed, compute_stability(condensed))
+    return labels
 
 
-# TODO: Very very inefficient, time and heap allocation wise
 def get_data(embedding_file: Path, label_field: Optional[str]):
-    embeddings = []
-    titles = []
+    return loader.load_embeddings(embedding_file, label_field)
 
-    chunk_iter = pd.read_json(embedding_file, lines=True, chunksize=READ_CHUNK_SIZE)
 
-    offset = 0
-    for chunk in chunk_iter:
-        embeddings.extend(chunk["embedding"].tolist())
-        titles.extend(
-            chunk.get(label_field, chunk.get("id", chunk.index + offset)).tolist()
-        )
-        offset += len(chunk)
+def _chunks(num_rows: int) -> Iterator[slice]:
+    for start in range(0, num_rows, config.VISUALIZATION_CHUNK_ROWS):
+        yield slice(start, min(start + config.VISUALIZATION_CHUNK_ROWS, num_rows))
 
-    df_embeddings = pd.DataFrame(embeddings)
 
-    return df_embeddings, titles
+class Projection:
+    """Fitted mapping of embeddings to 2D, optionally preceded by PCA"""
 
+    def __init__(self, reducer: UMAP, pca: Optional[PCA] = None):
+        self.reducer = reducer
+        self.pca = pca
 
-def umap_reduce(X: pd.DataFrame) -> np.ndarray:
-    reducer = UMAP()
-    return reducer.fit_transform(X)  # type: ignore
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """Project new points onto the fitted map, in chunks"""
+        X_reduced = np.empty((len(X), 2), dtype=np.float32)
+        for rows in _chunks(len(X)):
+            chunk = X[rows] if self.pca is None else self.pca.transform(X[rows])
+            X_reduced[rows] = self.reducer.transform(chunk)
+        return X_reduced
 
 
-def generate_chart(X_reduced, titles, hdbscan_model) -> alt.TopLevelMixin:
-    if hdbscan_model:
-        cluster_labels = hdbscan_model.labels_
+def umap_reduce(X: np.ndarray) -> Tuple[np.ndarray, Projection]:
+    reducer = UMAP()
+    return reducer.fit_transform(X), Projection(reducer)  # type: ignore
+
+
+def pca_reduce(
+    X: np.ndarray, sample_size: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, PCA]:
+    """
+    Randomized PCA fit on a sample, applied to all rows in chunks. The result is
+    float32 and small enough to keep in memory.
+    """
+    n_components = min(config.VISUALIZATION_PCA_COMPONENTS, *X.shape)
+    sample = np.sort(rng.choice(len(X), min(len(X), sample_size), replace=False))
+    pca = PCA(n_components, svd_solver="randomized", random_state=0).fit(X[sample])
+    X_pca = np.empty((len(X), n_components), dtype=np.float32)
+    for rows in _chunks(len(X)):
+        X_pca[rows] = pca.transform(X[rows])
+    return X_pca, pca
+
+
+def stratified_sample(
+    X: np.ndarray, sample_size: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Sample row indices proportionally from k-means clusters, so that small
+    clusters are represented in the sample.
+    """
+    n_clusters = min(config.VISUALIZATION_STRATA, len(X))
+    kmeans = MiniBatchKMeans(n_clusters, batch_size=4096, n_init=3, random_state=0)
+    kmeans.fit(X[rng.choice(len(X), min(len(X), 10 * sample_size), replace=False)])
+    strata = np.concatenate([kmeans.predict(X[rows]) for rows in _chunks(len(X))])
+
+    sample = []
+    for stratum in range(n_clusters):
+        members = np.flatnonzero(strata == stratum)
+        count = min(len(members), max(1, round(sample_size * len(members) / len(X))))
+        sample.append(rng.choice(members, count, replace=False))
+    return np.sort(np.concatenate(sample))
+
+
+def scalable_reduce(
+    X: np.ndarray, sample_size: int, threads: Optional[int] = None
+) -> Tuple[np.ndarray, Projection]:
+    """
+    Approximate `umap_reduce` for large inputs: PCA pre-reduction, a UMAP fit on
+    a stratified sample, and a chunked projection of the remaining points.
+    """
+    rng = np.random.default_rng(0)
+    with threadpool_limits(threads):
+        X_pca, pca = pca_reduce(X, sample_size, rng)
+        reducer = UMAP(n_jobs=threads or -1)
+        if len(X) <= sample_size:
+            return reducer.fit_transform(X_pca), Projection(reducer, pca)  # type: ignore
+
+        sample = stratified_sample(X_pca, sample_size, rng)
+        reducer.fit(X_pca[sample])
+        X_reduced = np.empty((len(X), 2), dtype=np.float32)
+        in_sample = np.zeros(len(X), dtype=bool)
+        in_sample[sample] = True
+        X_reduced[sample] = reducer.embedding_
+        rest = np.flatnonzero(~in_sample)
+        for rows in _chunks(len(rest)):
+            X_reduced[rest[rows]] = reducer.transform(X_pca[rest[rows]])
+    return X_reduced, Projection(reducer, pca)
+
+
+def generate_chart(
+    X_reduced, titles, clusters: Optional[np.ndarray], highlight=None
+) -> alt.TopLevelMixin:
+    """
+    Scatter plot of the records, or of the clusters when `clusters` (the cluster
+    label of every record) is given. `highlight` marks records (ex: ones projected
+    onto a base map) with a different color.
+    """
+    is_clustered = clusters is not None
+    if is_clustered:
         df_cluster_titles = pd.DataFrame(
             {
                 "x1": X_reduced[:, 0],
                 "x2": X_reduced[:, 1],
                 "title": titles,
-                "cluster": cluster_labels,
+                "cluster": clusters,
             }
         )
 
@@ -72,6 +179,8 @@ def generate_chart(X_reduced, titles, hdbscan_model) -> alt.TopLevelMixin:
             "x2": X_reduced[:, 1],
             "title": titles,
         }
+        if highlight is not None:
+            data["new"] = highlight
         data = pd.DataFrame(data)
 
     brush = alt.selection_interval()
@@ -82,12 +191,14 @@ def generate_chart(X_reduced, titles, hdbscan_model) -> alt.TopLevelMixin:
         .encode(
             x=alt.X("x1", axis=None, scale=alt.Scale(zero=False)),
             y=alt.Y("x2", axis=None, scale=alt.Scale(zero=False)),
-            tooltip=["cluster_title", "count"] if hdbscan_model else ["title"],
+            tooltip=["cluster_title", "count"] if is_clustered else ["title"],
             color=alt.Color("cluster:N", legend=None)
-            if hdbscan_model
+            if is_clustered
+            else alt.Color("new:N", legend=None)
+            if highlight is not None
             else alt.value("blue"),
             size=alt.Size("count:Q", legend=None, scale=alt.Scale(range=[10, 200]))
-            if hdbscan_model
+            if is_clustered
             else alt.value(20),
         )
         .properties(width=1000)
@@ -99,7 +210,7 @@ def generate_chart(X_reduced, titles, hdbscan_model) -> alt.TopLevelMixin:
         .mark_text(align="left")
         .encode(
             y=alt.Y("row_number:O", axis=None),
-            text="cluster_title:N" if hdbscan_model else "title:N",
+            text="cluster_title:N" if is_clustered else "title:N",
         )
         .transform_window(row_number="row_number()")
         .transform_filter(brush)
@@ -112,3 +223,19 @@ def generate_chart(X_reduced, titles, hdbscan_model) -> alt.TopLevelMixin:
         .resolve_legend(color="independent")
         .configure_view(stroke=None)
     )
+
+
+def point_colors(
+    clusters: Optional[np.ndarray], highlight=None
+) -> Optional[np.ndarray]:
+    """
+    Palette index (see `writer.PALETTE`) of every point for the WebGL renderer:
+    by cluster (unclustered points are grey), or highlighted points in a second color.
+    """
+    num_colors = len(writer.PALETTE) - 1
+    if clusters is not None:
+        clusters = np.asarray(clusters)
+        return np.where(clusters < 0, 0, clusters % num_colors + 1).astype(np.uint8)
+    if highlight is not None:
+        return np.asarray(highlight, dtype=np.uint8) + 1
+    return None
@@ -0,0 +1,86 @@
+"""
+Background writer stage
+
+Workers hand computed batches off to a bounded queue that is drained by a
+dedicated thread, which serializes and writes them. Serialization and file I/O
+stay off the event loop and workers only wait when the disk falls behind.
+
+A write error sets `failed`, so that the job stops sending requests whose
+results can't be saved.
+"""
+import asyncio
+import queue
+import threading
+from typing import Optional
+
+from emb3d import config
+from emb3d.compute.common import fan_out_duplicates, write_rows_post_lock
+from emb3d.types import Batch, EmbedJob
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Single writer thread fed by a bounded queue"""
+
+    def __init__(self, job: EmbedJob, max_pending: int = config.WRITER_QUEUE_SIZE):
+        self.job = job
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="emb3d-writer")
+        self._error: Optional[BaseException] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.failed: Optional[asyncio.Event] = None
+
+    def start(self) -> "BatchWriter":
+        """Start the writer thread, must be called from the job's event loop"""
+        self._loop = asyncio.get_running_loop()
+        # Created here, events are bound to the loop they are created in (py3.9)
+        self.failed = asyncio.Event()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is _STOP:
+                return
+            if self._error is not None:
+                # Keep draining so that producers don't block forever
+                continue
+            try:
+                write_rows_post_lock(self.job, batch)
+            except BaseException as err:  # pylint: disable=broad-except
+                self._error = err
+                self._loop.call_soon_threadsafe(self.failed.set)
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """Error of the first write that failed"""
+        return self._error
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("Writing batch results failed") from self._error
+
+    async def put(self, batch: Batch):
+        """
+        Queue a batch for writing, waits for room when the writer falls behind.
+
+        Duplicates are fanned out here as it updates job counters, which are
+        otherwise only updated from the event loop.
+        """
+        self._check()
+        batch = fan_out_duplicates(self.job, batch)
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._queue.put, batch
+            )
+
+    async def close(self):
+        """Flush pending batches and stop the writer thread"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._queue.put, _STOP)
+        await loop.run_in_executor(None, self._thread.join)
+        self._check()
@@ -18,6 +18,15 @@ SCALE_DOWN_FACTOR = 0.8
 
 VISUALIZATION_CLUSTERING_THRESHOLD = 5000
 VISUALIZATION_DEFAULT_MIN_CLUSTER_SIZE = 10
+# Embeddings larger than this are loaded into a temporary memory-mapped file
+VISUALIZATION_MEMORY_BUDGET_MB = 4096
+# Scalable projection: PCA pre-reduction, UMAP fit on a sample stratified by
+# k-means clusters, remaining points projected with the fitted model
+VISUALIZATION_SCALABLE_THRESHOLD = 200000
+VISUALIZATION_DEFAULT_SAMPLE_SIZE = 50000
+VISUALIZATION_PCA_COMPONENTS = 50
+VISUALIZATION_STRATA = 100
+VISUALIZATION_CHUNK_ROWS = 50000
 
 max_requests_limits = {
     Backend.OPENAI: 10000,
@@ -25,7 +34,88 @@ max_requests_limits = {
     Backend.HUGGINGFACE: 100,
 }
 
+max_tokens_per_minute_limits = {
+    Backend.OPENAI: 1000000,
+    Backend.COHERE: 1000000,  # Not published, conservative estimate
+}
+
 RATE_LIMIT_WAIT_TIME_SECS = 0.5
+# Large embedding batches can take a while to be processed
+OPENAI_TIMEOUT_SECS = 60
+
+# Adaptive (AIMD) rate limiting, rates are in requests per minute. The limit
+# tables above are used as the starting rate.
+RATE_LIMIT_MIN_RPM = 10
+RATE_LIMIT_MAX_MULTIPLIER = 10
+RATE_LIMIT_INCREASE_FRACTION = 0.02
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+RATE_LIMIT_ADJUST_INTERVAL_SECS = 1.0
+
+# Outputs are fsync'd and the resume checkpoint is committed atmost this often
+CHECKPOINT_INTERVAL_SECS = 2.0
+
+EMBEDDING_CACHE_DEFAULT_MAX_MB = 2048
+
+# Batches waiting for the background writer, workers wait when it's full
+WRITER_QUEUE_SIZE = 64
+
+# Remote request scheduling, the concurrency limit is sized as
+# requests/sec x smoothed latency x headroom (Little's law)
+SCHEDULER_INITIAL_LATENCY_SECS = 1.0
+SCHEDULER_LATENCY_SMOOTHING = 0.2
+SCHEDULER_HEADROOM_FACTOR = 1.5
+# Total size of the input texts of batches waiting to be dispatched
+SCHEDULER_QUEUE_MAX_BYTES = 16 * 1024 * 1024
+
+# Batches submitted per local worker process before waiting for results
+LOCAL_WORKER_INFLIGHT_BATCHES = 2
+
+# Rows read ahead and sorted by length to batch similar length inputs locally
+LOCAL_BUCKET_WINDOW = 10000
+
+# Records tokenized together when batching inputs, and the threads used for it
+TOKEN_COUNT_WINDOW = 512
+TOKEN_COUNT_THREADS = 8
+
+# Size of the input byte ranges parsed by each reader process (`--read-workers`)
+INPUT_RANGE_BYTES = 8 * 1024 * 1024
+
+# `emb3d serve` defaults, requests are grouped into batches of atmost
+# SERVE_MAX_BATCH_SIZE inputs or dispatched after SERVE_MAX_WAIT_MS
+SERVE_DEFAULT_PORT = 8080
+SERVE_MAX_BATCH_SIZE = 64
+SERVE_MAX_WAIT_MS = 5
+# Recent requests used for the reported latency percentiles
+SERVE_LATENCY_WINDOW = 10000
+
+# Nearest neighbour search, rows scored per block so the full similarity matrix
+# is never materialized
+SEARCH_DEFAULT_K = 10
+SEARCH_CHUNK_ROWS = 65536
+
+# IVF-Flat index: k-means trained on a sample with atleast INDEX_MIN_POINTS_PER_LIST
+# rows per list, INDEX_DEFAULT_NPROBE nearest lists scanned per query
+INDEX_TRAIN_SAMPLE = 65536
+INDEX_MIN_POINTS_PER_LIST = 16
+INDEX_KMEANS_ITERATIONS = 10
+INDEX_DEFAULT_NPROBE = 16
+# Queries used to report recall and throughput against exact search
+INDEX_EVAL_QUERIES = 100
+
+# Near-duplicate detection, similarities are computed in (tile x tile) blocks
+DEDUPE_DEFAULT_THRESHOLD = 0.95
+DEDUPE_TILE_ROWS = 4096
+
+# Quantized embedding storage, codebooks are trained on a sample of the rows and
+# product quantization splits the vectors into sub-vectors of this many dimensions
+QUANTIZE_TRAIN_SAMPLE = 65536
+QUANTIZE_PQ_SUBVECTOR_DIM = 8
+QUANTIZE_KMEANS_ITERATIONS = 10
+QUANTIZE_CHUNK_ROWS = 16384
+# Rows held out of training to report the reconstruction error and nearest
+# neighbour recall (for atmost this many queries) of the quantized vectors
+QUANTIZE_EVAL_ROWS = 4096
+QUANTIZE_EVAL_QUERIES = 100
 
 max_token_limits = {
     Backend.OPENAI: 8191,
@@ -40,6 +130,13 @@ def max_requests_per_minute(backend: Backend) -> int:
     return int(base_rpm * SCALE_DOWN_FACTOR)
 
 
+@functools.cache
+def max_tokens_per_minute(backend: Backend) -> Optional[int]:
+    """Token quota per minute, `None` for backends that only limit requests"""
+    base_tpm = max_tokens_per_minute_limits.get(backend)
+    return int(base_tpm * SCALE_DOWN_FACTOR) if base_tpm else None
+
+
 def max_tokens(backend: Backend) -> int:
     return max_token_limits.get(backend, 512)
 
@@ -0,0 +1,12 @@
+import pytest
+
+from emb3d import tokenizer
+
+
+@pytest.fixture(autouse=True)
+def token_counters(monkeypatch):
+    """
+    Fresh token counter registry for every test, so that counters registered by
+    a test (ex: by `mock_embed_job`) don't leak into the next ones.
+    """
+    monkeypatch.setattr(tokenizer, "_counters", {})
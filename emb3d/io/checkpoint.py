@@ -0,0 +1,188 @@
+"""
+Job checkpoints
+
+Completed row ids are tracked as a compact list of `[start, end)` ranges and are
+committed next to the output file once the output has been fsync'd, so that an
+interrupted job can be resumed without recomputing rows that were saved.
+"""
+import bisect
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, TextIO, Tuple
+
+from emb3d.io import codec
+from emb3d.io.sidecar import SidecarWriter
+from emb3d.types import Batch
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(out_path: Path) -> Path:
+    """Checkpoint location for an output file"""
+    return out_path.with_suffix(out_path.suffix + ".ckpt")
+
+
+class RowRanges:
+    """Set of row ids stored as sorted, non-overlapping `[start, end)` ranges"""
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]] = ()):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._count = 0
+        for start, end in ranges:
+            self.add_range(start, end)
+
+    def add_range(self, start: int, end: int) -> None:
+        """Add `[start, end)`, merging with any overlapping or adjacent ranges"""
+        lo = bisect.bisect_left(self._ends, start)
+        hi = bisect.bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+            self._count -= sum(
+                e - s for s, e in zip(self._starts[lo:hi], self._ends[lo:hi])
+            )
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+        self._count += end - start
+
+    def add(self, row_ids: Iterable[int]) -> None:
+        """Add row ids, consecutive ids are merged into a single range"""
+        start = end = None
+        for row_id in sorted(row_ids):
+            if end is not None and row_id <= end:
+                end = max(end, row_id + 1)
+                continue
+            if start is not None:
+                self.add_range(start, end)
+            start, end = row_id, row_id + 1
+        if start is not None:
+            self.add_range(start, end)
+
+    def count_below(self, limit: int) -> int:
+        """Number of row ids < limit"""
+        return sum(
+            max(0, min(end, limit) - start)
+            for start, end in zip(self._starts, self._ends)
+            if start < limit
+        )
+
+    def ranges(self) -> List[Tuple[int, int]]:
+        return list(zip(self._starts, self._ends))
+
+    def __contains__(self, row_id: int) -> bool:
+        idx = bisect.bisect_right(self._starts, row_id) - 1
+        return idx >= 0 and row_id < self._ends[idx]
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class Checkpoint:
+    """
+    Periodically fsyncs job outputs and records the completed rows.
+
+    Outputs are synced before the checkpoint is replaced, so a checkpoint never
+    refers to rows that are not durable. A crash loses atmost `interval` seconds
+    of results.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        out_file: TextIO,
+        embedding_sidecar: Optional[SidecarWriter],
+        completed: RowRanges,
+        interval: float,
+    ):
+        self.path = path
+        self.out_file = out_file
+        self.embedding_sidecar = embedding_sidecar
+        # Rows saved by previous runs stay fixed, `completed` is updated by the
+        # writer (possibly from another thread) as the job progresses.
+        self.resumed = completed
+        self.completed = RowRanges(completed.ranges())
+        self.interval = interval
+        self._last_commit = time.monotonic()
+
+    def record(self, batch: Batch) -> None:
+        """Record a saved batch, committing if the interval has elapsed"""
+        if batch.error is None:
+            self.completed.add(batch.row_ids)
+        if time.monotonic() - self._last_commit >= self.interval:
+            self.commit()
+
+    def commit(self) -> None:
+        self.out_file.flush()
+        os.fsync(self.out_file.fileno())
+        if self.embedding_sidecar is not None:
+            self.embedding_sidecar.flush()
+
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "output_bytes": os.fstat(self.out_file.fileno()).st_size,
+            "completed": self.completed.ranges(),
+        }
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_commit = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.commit()
+
+
+def _scan_output(out_path: Path) -> Tuple[RowRanges, int]:
+    """
+    Recover completed rows from an inline (jsonl) output without a checkpoint.
+
+    Returns the completed rows and the size of the valid prefix of the file, a
+    partially written trailing line is not part of the valid prefix.
+    """
+    completed = RowRanges()
+    valid_bytes = 0
+    with out_path.open("rb") as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            try:
+                record = codec.loads(raw_line)
+            except ValueError:
+                break
+            valid_bytes += len(raw_line)
+            # Metadata-only rows (sidecar outputs) can't be trusted without a
+            # checkpoint as the vectors may not have been synced.
+            if record.get("error") is None and record.get("embedding") is not None:
+                completed.add_range(record["row_id"], record["row_id"] + 1)
+    return completed, valid_bytes
+
+
+def resume(out_path: Path) -> RowRanges:
+    """
+    Completed rows of a previous run writing to `out_path`.
+
+    Output written after the last checkpoint is truncated so that it can be
+    recomputed and appended again.
+    """
+    ckpt_path = checkpoint_path(out_path)
+    if ckpt_path.exists():
+        with ckpt_path.open() as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {ckpt_path}")
+        completed = RowRanges(state["completed"])
+        valid_bytes = state["output_bytes"]
+    else:
+        completed, valid_bytes = _scan_output(out_path)
+
+    with out_path.open("r+b") as f:
+        f.truncate(min(valid_bytes, os.fstat(f.fileno()).st_size))
+    return completed
@@ -0,0 +1,121 @@
+"""
+JSON codecs
+
+Input parsing and output serialization go through the fastest JSON library that
+is installed: orjson, then simdjson (parsing only), falling back to the standard
+library. numpy arrays and scalars are serialized directly, without converting
+them to python lists first.
+"""
+import json
+from typing import Any, Dict, Iterable, Union
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:  # pragma: no cover
+    simdjson = None
+
+
+def _default(obj: Any) -> Any:
+    """
+    numpy values the encoder can't serialize natively, for orjson these are
+    non-contiguous arrays and unsupported dtypes (ex: float16).
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibCodec:
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(default=_default)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return self._encoder.encode(obj)
+
+    def dumps_lines(self, rows: Iterable[Any]) -> str:
+        """Serialize rows as newline terminated JSON lines, in a single string"""
+        encode = self._encoder.encode
+        return "".join(encode(row) + "\n" for row in rows)
+
+
+class SimdjsonCodec(StdlibCodec):
+    """simdjson parsing, it doesn't serialize"""
+
+    name = "simdjson"
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return simdjson.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return orjson.dumps(
+            obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+
+    def dumps_lines(self, rows: Iterable[Any]) -> str:
+        """Serialize rows as newline terminated JSON lines, in a single string"""
+        dump = orjson.dumps
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        return b"".join(
+            dump(row, default=_default, option=option) for row in rows
+        ).decode()
+
+
+def available_codecs() -> Dict[str, Any]:
+    """Installed codecs, fastest first"""
+    codecs: Dict[str, Any] = {}
+    if orjson is not None:
+        codecs[OrjsonCodec.name] = OrjsonCodec()
+    if simdjson is not None:
+        codecs[SimdjsonCodec.name] = SimdjsonCodec()
+    codecs[StdlibCodec.name] = StdlibCodec()
+    return codecs
+
+
+_codec = next(iter(available_codecs().values()))
+
+
+def use(name: str) -> None:
+    """Switch to an installed codec by name"""
+    global _codec
+    codecs = available_codecs()
+    if name not in codecs:
+        raise ValueError(f"JSON codec {name} is not installed, have: {list(codecs)}")
+    _codec = codecs[name]
+
+
+def current() -> str:
+    return _codec.name
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    return _codec.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    return _codec.dumps(obj)
+
+
+def dumps_lines(rows: Iterable[Any]) -> str:
+    """Serialize rows as newline terminated JSON lines, in a single string"""
+    return _codec.dumps_lines(rows)
@@ -0,0 +1,223 @@
+"""
+Embedding matrix loader
+
+Loads the embeddings of a job output into a preallocated float32 matrix in two
+streaming passes: the first counts the rows, the second parses them straight
+into the matrix. Rows that failed (or have no embedding) are skipped. When the
+matrix exceeds the memory budget it is backed by a temporary memory-mapped file
+instead of the heap. The shards of a sharded output (see `emb3d.io.shards`) are
+parsed in parallel.
+"""
+import itertools
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from emb3d import config
+from emb3d.io import reader, shards, sidecar
+
+# Labels are only used for tooltips and titles
+LABEL_MAX_CHARS = 100
+COPY_CHUNK_ROWS = 4096
+
+
+def _count_lines(path: Path) -> int:
+    num_lines = 0
+    last = b"\n"
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            num_lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return num_lines + (last != b"\n")
+
+
+def _allocate(num_rows: int, dim: int, memory_budget: int) -> np.ndarray:
+    if num_rows * dim * 4 <= memory_budget:
+        return np.empty((num_rows, dim), dtype=np.float32)
+    # The file is unlinked once closed, the mapping keeps it alive
+    with tempfile.TemporaryFile() as f:
+        return np.memmap(f, dtype=np.float32, mode="w+", shape=(num_rows, dim))
+
+
+def _label(record: dict, label_field: Optional[str], line_num: int) -> str:
+    label = record.get(label_field, record.get("id", record.get("row_id", line_num)))
+    return str(label)[:LABEL_MAX_CHARS]
+
+
+def _first_dim(path: Path) -> Optional[int]:
+    with path.open() as f:
+        for record in reader.jsonl(f):
+            if record.get("error") is None and record.get("embedding") is not None:
+                return len(record["embedding"])
+    return None
+
+
+def _load_jsonl(
+    path: Path, label_field: Optional[str], memory_budget: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    dim = _first_dim(path)
+    if dim is None:
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=object)
+    max_rows = _count_lines(path)
+    matrix = _allocate(max_rows, dim, memory_budget)
+    labels = np.empty(max_rows, dtype=object)
+    num_rows = 0
+    with path.open() as f:
+        for line_num, record in enumerate(reader.jsonl(f)):
+            embedding = record.get("embedding")
+            if record.get("error") is not None or embedding is None:
+                continue
+            if len(embedding) != dim:
+                raise ValueError(
+                    f"Row {line_num} has {len(embedding)} dimensions, expected {dim}"
+                )
+            matrix[num_rows] = embedding
+            labels[num_rows] = _label(record, label_field, line_num)
+            num_rows += 1
+    return matrix[:num_rows], labels[:num_rows]
+
+
+def _load_sidecar(
+    path: Path, sidecar_file: Path, label_field: Optional[str], memory_budget: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Row metadata from the output file, vectors from the sidecar"""
+    vectors = sidecar.load(sidecar_file)
+    max_rows = _count_lines(path)
+    row_ids = np.empty(max_rows, dtype=np.int64)
+    labels = np.empty(max_rows, dtype=object)
+    num_rows = 0
+    with path.open() as f:
+        for line_num, record in enumerate(reader.jsonl(f)):
+            if record.get("error") is not None:
+                continue
+            row_ids[num_rows] = record["row_id"]
+            labels[num_rows] = _label(record, label_field, line_num)
+            num_rows += 1
+
+    matrix = _allocate(num_rows, vectors.shape[1], memory_budget)
+    for start in range(0, num_rows, COPY_CHUNK_ROWS):
+        end = min(start + COPY_CHUNK_ROWS, num_rows)
+        matrix[start:end] = vectors[row_ids[start:end]]
+    return matrix, labels[:num_rows]
+
+
+def _load_shards(
+    manifest_file: Path, label_field: Optional[str], memory_budget: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Shards are parsed in parallel processes and copied into the matrix in order"""
+    shard_files = shards.shard_files(manifest_file)
+    max_rows = shards.read_manifest(manifest_file)["rows"]
+    matrix: Optional[np.ndarray] = None
+    labels = np.empty(max_rows, dtype=object)
+    num_rows = 0
+    workers = max(1, min(len(shard_files), os.cpu_count() or 1))
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        parts = executor.map(
+            _load_jsonl,
+            shard_files,
+            itertools.repeat(label_field),
+            itertools.repeat(memory_budget),
+        )
+        for shard_file, (part, part_labels) in zip(shard_files, parts):
+            if not len(part):
+                continue
+            if matrix is None:
+                matrix = _allocate(max_rows, part.shape[1], memory_budget)
+            elif part.shape[1] != matrix.shape[1]:
+                raise ValueError(
+                    f"{shard_file} has {part.shape[1]} dimensions, expected {matrix.shape[1]}"
+                )
+            matrix[num_rows : num_rows + len(part)] = part
+            labels[num_rows : num_rows + len(part)] = part_labels
+            num_rows += len(part)
+    if matrix is None:
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=object)
+    return matrix[:num_rows], labels[:num_rows]
+
+
+def _loaded_records(path: Path) -> Iterator[Tuple[int, dict]]:
+    """Line numbers (within their shard) and records of the rows `load_embeddings` returns"""
+    has_sidecar = sidecar.sidecar_path(path).exists()
+    for shard_file in shards.shard_files(path):
+        with shard_file.open() as f:
+            for line_num, record in enumerate(reader.jsonl(f)):
+                if record.get("error") is not None:
+                    continue
+                if not has_sidecar and record.get("embedding") is None:
+                    continue
+                yield line_num, record
+
+
+def load_labels(path: Path, label_field: Optional[str]) -> np.ndarray:
+    """Labels of the rows returned by `load_embeddings`, in the same order"""
+    labels = [
+        _label(record, label_field, line_num)
+        for line_num, record in _loaded_records(path)
+    ]
+    return np.array(labels, dtype=object)
+
+
+def load_row_ids(path: Path) -> np.ndarray:
+    """`row_id`s of the rows returned by `load_embeddings`, in the same order"""
+    return np.fromiter(
+        (record.get("row_id", line_num) for line_num, record in _loaded_records(path)),
+        dtype=np.int64,
+    )
+
+
+def load_embeddings(
+    path: Path,
+    label_field: Optional[str],
+    memory_budget: int = config.VISUALIZATION_MEMORY_BUDGET_MB * 1024 * 1024,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embeddings (float32 `(rows, dim)` matrix) and labels of the successful rows
+    of a job output. Labels come from `label_field`, the `id` field or the row id.
+    """
+    if shards.is_manifest(path):
+        return _load_shards(path, label_field, memory_budget)
+    sidecar_file = sidecar.sidecar_path(path)
+    if sidecar_file.exists():
+        return _load_sidecar(path, sidecar_file, label_field, memory_budget)
+    return _load_jsonl(path, label_field, memory_budget)
+
+
+def iter_embeddings(
+    path: Path, chunk_rows: int = COPY_CHUNK_ROWS
+) -> Iterator[np.ndarray]:
+    """
+    Embeddings of the successful rows, in the order of `load_embeddings`, as
+    float32 chunks of at most `chunk_rows` rows. Memory is bounded by the chunk.
+    """
+    sidecar_file = sidecar.sidecar_path(path)
+    vectors = sidecar.load(sidecar_file) if sidecar_file.exists() else None
+    pending: list = []
+
+    def flush() -> np.ndarray:
+        if vectors is not None:
+            chunk = np.asarray(vectors[pending], dtype=np.float32)
+        else:
+            chunk = np.array(pending, dtype=np.float32)
+        pending.clear()
+        return chunk
+
+    for shard_file in shards.shard_files(path):
+        with shard_file.open() as f:
+            for record in reader.jsonl(f):
+                if record.get("error") is not None:
+                    continue
+                if vectors is not None:
+                    pending.append(record["row_id"])
+                elif record.get("embedding") is not None:
+                    pending.append(record["embedding"])
+                if len(pending) >= chunk_rows:
+                    yield flush()
+    if pending:
+        yield flush()
@@ -0,0 +1,322 @@
+"""
+Quantized embedding storage
+
+A sidecar can store compressed codes instead of float32 vectors:
+
+    float16  half precision, 2x smaller, no codebook
+    int8     per-dimension scalar quantization to 8-bit codes, 4x smaller
+    pq       product quantization, one byte per sub-vector of
+             `QUANTIZE_PQ_SUBVECTOR_DIM` dimensions (32x smaller by default)
+
+The codes are a regular `.npy` matrix indexed by `row_id`, the codebook needed
+to decode them is saved next to it in a `.codebook.npz` file, along with the
+dtype and shape of the codes so that codes and codebooks that don't belong
+together are rejected. Codebooks are trained on a sample of the rows, and
+evaluated on other rows. `QuantizedMatrix` dequantizes rows lazily as they are
+accessed.
+"""
+import os
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from emb3d import config
+
+CODE_MAX = 255
+
+
+def codebook_path(sidecar_file: Path) -> Path:
+    return sidecar_file.with_suffix(".codebook.npz")
+
+
+class Float16Quantizer:
+    scheme = "float16"
+    code_dtype = np.dtype(np.float16)
+
+    @classmethod
+    def fit(cls, sample: np.ndarray) -> "Float16Quantizer":
+        return cls()
+
+    def code_dim(self, dim: int) -> int:
+        return dim
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        return np.asarray(X, dtype=np.float16)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32)
+
+    def arrays(self) -> dict:
+        return {}
+
+
+class ScalarQuantizer:
+    """Codes are the position of each value in the [low, high] range of its dimension"""
+
+    scheme = "int8"
+    code_dtype = np.dtype(np.uint8)
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray):
+        self.low = low
+        self.scale = scale
+        self.dim = len(low)
+
+    @classmethod
+    def fit(cls, sample: np.ndarray) -> "ScalarQuantizer":
+        low = sample.min(axis=0)
+        scale = (sample.max(axis=0) - low) / CODE_MAX
+        return cls(
+            low.astype(np.float32), np.where(scale > 0, scale, 1).astype(np.float32)
+        )
+
+    def code_dim(self, dim: int) -> int:
+        return dim
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(X, dtype=np.float32) - self.low) / self.scale)
+        return np.clip(codes, 0, CODE_MAX).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.low
+
+    def arrays(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+
+def _nearest_centroid(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    distances = (
+        -2 * X @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+    return np.argmin(distances, axis=1)
+
+
+def _kmeans(X: np.ndarray, k: int, iterations: int, rng) -> np.ndarray:
+    """Euclidean k-means centroids, empty clusters are re-seeded"""
+    centroids = X[rng.choice(len(X), k, replace=False)]
+    for _ in range(iterations):
+        labels = _nearest_centroid(X, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        empty = counts == 0
+        sums[empty] = X[rng.choice(len(X), empty.sum(), replace=False)]
+        centroids = sums / np.where(empty, 1, counts)[:, None]
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Vectors are split into sub-vectors, each sub-vector is coded as its nearest
+    centroid out of (atmost) 256 trained for that sub-space.
+    """
+
+    scheme = "pq"
+    code_dtype = np.dtype(np.uint8)
+
+    def __init__(self, codebooks: np.ndarray):
+        # (sub-vectors, centroids, sub-vector dim)
+        self.codebooks = codebooks
+        self.dim = codebooks.shape[0] * codebooks.shape[2]
+
+    @classmethod
+    def fit(
+        cls,
+        sample: np.ndarray,
+        subvector_dim: int = config.QUANTIZE_PQ_SUBVECTOR_DIM,
+        seed: int = 0,
+    ) -> "ProductQuantizer":
+        dim = sample.shape[1]
+        if dim % subvector_dim:
+            raise ValueError(
+                f"Embedding dimension {dim} is not a multiple of the sub-vector dimension {subvector_dim}"
+            )
+        rng = np.random.default_rng(seed)
+        k = min(CODE_MAX + 1, len(sample))
+        subvectors = sample.reshape(len(sample), -1, subvector_dim)
+        codebooks = np.stack(
+            [
+                _kmeans(
+                    np.ascontiguousarray(subvectors[:, idx]),
+                    k,
+                    config.QUANTIZE_KMEANS_ITERATIONS,
+                    rng,
+                )
+                for idx in range(subvectors.shape[1])
+            ]
+        )
+        return cls(codebooks.astype(np.float32))
+
+    def code_dim(self, dim: int) -> int:
+        return len(self.codebooks)
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        subvectors = np.asarray(X, dtype=np.float32).reshape(
+            len(X), len(self.codebooks), -1
+        )
+        codes = np.empty((len(X), len(self.codebooks)), dtype=np.uint8)
+        for idx, centroids in enumerate(self.codebooks):
+            codes[:, idx] = _nearest_centroid(subvectors[:, idx], centroids)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        subvectors = self.codebooks[np.arange(len(self.codebooks)), codes]
+        return subvectors.reshape(len(codes), -1)
+
+    def arrays(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+
+Quantizer = Union[Float16Quantizer, ScalarQuantizer, ProductQuantizer]
+
+QUANTIZERS = {
+    quantizer.scheme: quantizer
+    for quantizer in (Float16Quantizer, ScalarQuantizer, ProductQuantizer)
+}
+
+
+def save_codebook(quantizer: Quantizer, codes_shape: Tuple[int, int], path: Path):
+    with path.open("wb") as f:
+        np.savez(
+            f,
+            scheme=quantizer.scheme,
+            code_dtype=quantizer.code_dtype.str,
+            codes_shape=np.array(codes_shape),
+            **quantizer.arrays(),
+        )
+
+
+def load_codebook(path: Path) -> Tuple[Quantizer, np.dtype, Tuple[int, int]]:
+    """Quantizer of a codebook, and the dtype and shape of the codes it decodes"""
+    metadata = ("scheme", "code_dtype", "codes_shape")
+    with np.load(path) as data:
+        scheme = str(data["scheme"])
+        code_dtype = np.dtype(str(data["code_dtype"]))
+        codes_shape = tuple(int(size) for size in data["codes_shape"])
+        arrays = {name: data[name] for name in data.files if name not in metadata}
+    if scheme not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization scheme {scheme} in {path}")
+    return QUANTIZERS[scheme](**arrays), code_dtype, codes_shape
+
+
+class QuantizedMatrix:
+    """
+    Read-only float32 view of quantized codes, rows are decoded when indexed
+    (ex: `matrix[start:end]`, `matrix[row_ids]`).
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 2
+
+    def __init__(
+        self, codes: np.ndarray, quantizer: Union[ScalarQuantizer, ProductQuantizer]
+    ):
+        self.codes = codes
+        self.quantizer = quantizer
+        self.shape = (len(codes), quantizer.dim)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, key) -> np.ndarray:
+        codes = self.codes[key]
+        if codes.ndim == 1:
+            return self.quantizer.decode(codes[None, :])[0]
+        return self.quantizer.decode(codes)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+def evaluate(
+    quantizer: Quantizer,
+    sample: np.ndarray,
+    k: int = 10,
+    num_queries: int = config.QUANTIZE_EVAL_QUERIES,
+) -> dict:
+    """
+    Relative reconstruction error (squared error over squared norm) and cosine
+    recall@k of the quantized rows against the original ones, within the sample.
+    The sample should be held out of the quantizer's training rows.
+    """
+    # The io layer doesn't import the compute package (and its models) up front
+    from emb3d.compute.search import top_k
+
+    reconstructed = quantizer.decode(quantizer.encode(sample))
+    error = float(
+        np.sum((sample - reconstructed) ** 2) / max(np.sum(sample**2), 1e-12)
+    )
+    k = min(k, len(sample))
+    queries = sample[:num_queries]
+    exact, _ = top_k(sample, queries, k)
+    approx, _ = top_k(reconstructed, queries, k)
+    hits = sum(
+        len(np.intersect1d(expected, found)) for expected, found in zip(exact, approx)
+    )
+    return {"error": error, "recall": hits / max(exact.size, 1)}
+
+
+def _split_rows(num_rows: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Disjoint random row ids to train the quantizer on and to evaluate it on"""
+    rng = np.random.default_rng(seed)
+    eval_size = min(config.QUANTIZE_EVAL_ROWS, num_rows // 5)
+    sample_size = min(num_rows, config.QUANTIZE_TRAIN_SAMPLE + eval_size)
+    rows = rng.choice(num_rows, sample_size, replace=False)
+    return np.sort(rows[eval_size:]), np.sort(rows[:eval_size])
+
+
+def _read_rows(matrix: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Non-zero rows (rows of failed records are zero filled)"""
+    sample = np.asarray(matrix[rows], dtype=np.float32)
+    return sample[np.any(sample != 0, axis=1)]
+
+
+def quantize_sidecar(
+    sidecar_file: Path,
+    scheme: str,
+    subvector_dim: int = config.QUANTIZE_PQ_SUBVECTOR_DIM,
+    seed: int = 0,
+    out_file: Optional[Path] = None,
+) -> dict:
+    """
+    Quantize a float sidecar into `out_file` (and its codebook), the sidecar is
+    replaced when no `out_file` is given. Returns the reconstruction error and
+    recall measured on rows held out of training.
+    """
+    out_file = out_file or sidecar_file
+    matrix = np.load(sidecar_file, mmap_mode="r")
+    # A codebook next to float codes is left over from an interrupted run
+    if matrix.dtype.kind != "f":
+        raise ValueError(f"Sidecar {sidecar_file} is already quantized")
+    train_rows, eval_rows = _split_rows(len(matrix), seed)
+    sample = _read_rows(matrix, train_rows)
+    if not len(sample):
+        raise ValueError(f"Sidecar {sidecar_file} has no embeddings to quantize")
+    held_out = _read_rows(matrix, eval_rows)
+    if scheme == ProductQuantizer.scheme:
+        quantizer: Quantizer = ProductQuantizer.fit(sample, subvector_dim, seed)
+    else:
+        quantizer = QUANTIZERS[scheme].fit(sample)
+
+    tmp_file = out_file.with_name(f"{out_file.name}.tmp")
+    codes_shape = (len(matrix), quantizer.code_dim(matrix.shape[1]))
+    codes = np.lib.format.open_memmap(
+        tmp_file, mode="w+", dtype=quantizer.code_dtype, shape=codes_shape
+    )
+    for start in range(0, len(matrix), config.QUANTIZE_CHUNK_ROWS):
+        end = start + config.QUANTIZE_CHUNK_ROWS
+        codes[start:end] = quantizer.encode(np.asarray(matrix[start:end]))
+    codes.flush()
+    del codes, matrix
+
+    if quantizer.arrays():
+        # Codebook first, `sidecar.load` rejects it until the codes are replaced
+        tmp_codebook = out_file.with_name(f"{out_file.name}.codebook.tmp")
+        save_codebook(quantizer, codes_shape, tmp_codebook)
+        os.replace(tmp_codebook, codebook_path(out_file))
+    else:
+        codebook_path(out_file).unlink(missing_ok=True)
+    os.replace(tmp_file, out_file)
+    # Very small sidecars have no rows to spare for evaluation
+    return evaluate(quantizer, held_out if len(held_out) else sample)
@@ -0,0 +1,160 @@
+"""
+Parallel input reader
+
+Splits an input file into byte ranges that start and end at line boundaries,
+ranges are parsed and tokenized in reader processes. Every parse task also
+counts the lines of its range, and the global line number of the first line of
+a range is assigned once all the ranges before it are parsed, so records keep
+the `row_id` they get when the file is read line by line:
+
+    range     [0, 8M)    [8M, 16M)   [16M, 24M)  ...
+    lines     81234      80991       81502
+    first row 0          81234       162225
+
+Completed and duplicate rows are skipped once their row ids are known, reader
+processes don't need the checkpoint or the dedupe leaders.
+
+This module is imported by the reader processes, it stays clear of the compute
+stack (and the models it loads).
+"""
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from emb3d.io import codec
+from emb3d.io.checkpoint import RowRanges
+
+# Bytes `[start, end)` of a file, starting at the beginning of a line
+ByteRange = Tuple[int, int]
+Record = Tuple[int, str, int]
+# Number of lines, texts and token counts of a range
+ParsedRange = Tuple[int, List[str], List[int]]
+
+
+def byte_ranges(path: Path, range_bytes: int) -> List[ByteRange]:
+    """
+    Split a file into ranges of about `range_bytes` bytes, every range ends at
+    a newline (or the end of the file) so that no line spans two ranges.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + range_bytes, size) - 1)
+            # Completes the line the range would otherwise end in
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _range_data(path: Path, byte_range: ByteRange) -> bytes:
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def range_lines(path: Path, byte_range: ByteRange) -> List[str]:
+    """Stripped lines of a range, the same lines `reader.line` yields for them"""
+    lines = _range_data(path, byte_range).split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return [line.decode().strip() for line in lines]
+
+
+# Reader process state, set once per process by `_init_reader`
+_state: dict = {}
+
+
+def _init_reader(path: Path, column_name: str, counter):
+    _state.update(path=path, column_name=column_name, counter=counter)
+
+
+def _parse(byte_range: ByteRange) -> ParsedRange:
+    """Number of lines of a range, and the texts and token counts of its lines"""
+    lines = range_lines(_state["path"], byte_range)
+    texts = [codec.loads(line)[_state["column_name"]] for line in lines]
+    return len(lines), texts, _state["counter"].count(texts) if texts else []
+
+
+def _parsed_in_order(
+    executor: Executor, parse, ranges: List[ByteRange], window: int
+) -> Iterator[Tuple[int, ParsedRange]]:
+    """
+    `(first row, parsed range)` of every range in file order. Ranges are parsed
+    with `parse` as tasks of `executor`, ranges parsed before an earlier one are
+    held until their first row is known. Atmost `window` ranges are submitted
+    or held at a time.
+    """
+    pending: Dict[Future, int] = {}
+    held: Dict[int, ParsedRange] = {}
+    submitted = first_row = 0
+    for index in range(len(ranges)):
+        while index not in held:
+            while submitted < len(ranges) and len(pending) + len(held) < window:
+                pending[executor.submit(parse, ranges[submitted])] = submitted
+                submitted += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                held[pending.pop(future)] = future.result()
+        parsed = held.pop(index)
+        yield first_row, parsed
+        first_row += parsed[0]
+
+
+def _skipped(
+    row_id: int, resumed: Optional[RowRanges], leaders: Optional[np.ndarray]
+) -> bool:
+    """Same as `EmbedJob.is_completed` or `EmbedJob.is_duplicate`"""
+    if resumed is not None and row_id in resumed:
+        return True
+    if leaders is None:
+        return False
+    leader = int(leaders[row_id])
+    return leader != row_id and (resumed is None or leader not in resumed)
+
+
+def records(
+    path: Path,
+    column_name: str,
+    counter,
+    workers: int,
+    range_bytes: int,
+    resumed: Optional[RowRanges] = None,
+    leaders: Optional[np.ndarray] = None,
+) -> Iterator[Record]:
+    """
+    `(row_id, text, token_count)` of the rows of a JSONL file in file order,
+    parsed and tokenized (with `counter`) in `workers` processes. Rows in
+    `resumed` and rows whose leader (see `DedupeIndex`) is another row are
+    skipped. Atmost `2 * workers` ranges are parsed or held at a time.
+    """
+    ranges = byte_ranges(path, range_bytes)
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_reader,
+        initargs=(path, column_name, counter),
+    ) as executor:
+        for first_row, (_, texts, token_counts) in _parsed_in_order(
+            executor, _parse, ranges, 2 * workers
+        ):
+            for row_id, text, token_count in zip(
+                itertools.count(first_row), texts, token_counts
+            ):
+                if not _skipped(row_id, resumed, leaders):
+                    yield row_id, text, token_count
@@ -1,9 +1,10 @@
 """
 Readers
 """
-import json
 from typing import Iterator, TextIO
 
+from emb3d.io import codec
+
 
 def line(f_io: TextIO) -> Iterator[str]:
     for line in f_io:
@@ -12,4 +13,4 @@ def line(f_io: TextIO) -> Iterator[str]:
 
 def jsonl(f_io: TextIO) -> Iterator[dict]:
     for nxt_line in line(f_io):
-        yield json.loads(nxt_line)
+        yield codec.loads(nxt_line)
@@ -0,0 +1,203 @@
+"""
+Sharded outputs
+
+Rows are rolled into fixed size JSONL shards (by row count or bytes) next to a
+manifest that lists every shard with its row count, row id range, size and
+sha256 checksum, so downstream jobs can split the output by shard and verify
+what they read:
+
+    embeddings.manifest.json
+    embeddings-00000.jsonl
+    embeddings-00001.jsonl
+    ...
+
+The manifest is rewritten whenever a shard is completed, it only lists shards
+that are complete (and the last one once the writer is closed). Its `complete`
+flag is only set when the writer is closed without an error, outputs of jobs
+that failed or were interrupted stay marked as partial.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def manifest_path(out_path: Path) -> Path:
+    return out_path.with_name(out_path.stem + MANIFEST_SUFFIX)
+
+
+def is_manifest(path: Path) -> bool:
+    return path.name.endswith(MANIFEST_SUFFIX)
+
+
+def shard_path(out_path: Path, idx: int) -> Path:
+    return out_path.with_name(f"{out_path.stem}-{idx:05d}{out_path.suffix}")
+
+
+def parse_shard_size(value: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    `(max rows, max bytes)` of a shard size: a row count (ex: `100000`) or a size
+    in bytes with a unit (ex: `512MB`, `1GB`).
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)(B?)\s*", value.upper())
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(
+            f"Invalid shard size {value}, expected a row count (ex: 100000) or a size (ex: 512MB)"
+        )
+    size, unit, is_bytes = match.groups()
+    if not unit and not is_bytes:
+        return int(size), None
+    return None, int(size) * _SIZE_UNITS[unit]
+
+
+class ShardedWriter:
+    """
+    Output file that rolls rows into shards, assumes a single writer. Rows are
+    written with `write_rows`, a batch is split across shards if it doesn't fit.
+    """
+
+    def __init__(
+        self,
+        out_path: Path,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.out_path = out_path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.shards: List[dict] = []
+        self._f = None
+        self._open_shard()
+
+    @property
+    def name(self) -> str:
+        return str(manifest_path(self.out_path))
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def _open_shard(self):
+        path = shard_path(self.out_path, len(self.shards))
+        self._f = path.open("wb")
+        self._rows = 0
+        self._bytes = 0
+        self._row_id_min: Optional[int] = None
+        self._row_id_max: Optional[int] = None
+        self._digest = hashlib.sha256()
+
+    def _finish_shard(self):
+        self._f.close()
+        self.shards.append(
+            {
+                "path": shard_path(self.out_path, len(self.shards)).name,
+                "rows": self._rows,
+                "bytes": self._bytes,
+                "row_id_min": self._row_id_min,
+                "row_id_max": self._row_id_max,
+                "sha256": self._digest.hexdigest(),
+            }
+        )
+
+    def _room(self) -> Tuple[float, float]:
+        rows = self.max_rows - self._rows if self.max_rows else float("inf")
+        size = self.max_bytes - self._bytes if self.max_bytes else float("inf")
+        return rows, size
+
+    def _write(self, row_ids: Sequence[int], data: bytes):
+        self._f.write(data)
+        self._digest.update(data)
+        self._rows += len(row_ids)
+        self._bytes += len(data)
+        low, high = min(row_ids), max(row_ids)
+        if self._row_id_min is None or low < self._row_id_min:
+            self._row_id_min = low
+        if self._row_id_max is None or high > self._row_id_max:
+            self._row_id_max = high
+
+    def write_rows(self, row_ids: Sequence[int], text: str):
+        """Write rows, `text` has one (newline terminated) line per row id"""
+        if not row_ids:
+            return
+        data = text.encode()
+        rows_left, bytes_left = self._room()
+        if len(row_ids) <= rows_left and len(data) <= bytes_left:
+            self._write(row_ids, data)
+            return
+        for row_id, line in zip(row_ids, data.splitlines(keepends=True)):
+            rows_left, bytes_left = self._room()
+            if self._rows and (rows_left < 1 or len(line) > bytes_left):
+                self.roll()
+            self._write([row_id], line)
+
+    def roll(self):
+        """Complete the current shard and start the next one"""
+        self._finish_shard()
+        self._write_manifest(complete=False)
+        self._open_shard()
+
+    def _write_manifest(self, complete: bool):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "complete": complete,
+            "rows": sum(shard["rows"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        path = manifest_path(self.out_path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self, complete: bool = True):
+        """Complete the last shard, `complete` marks the whole output as complete"""
+        if self._f.closed:
+            return
+        self._finish_shard()
+        if self.shards[-1]["rows"] == 0 and len(self.shards) > 1:
+            # Nothing was written after the last roll
+            os.remove(self.out_path.with_name(self.shards.pop()["path"]))
+        self._write_manifest(complete=complete)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(complete=exc_type is None)
+
+
+def read_manifest(path: Path) -> dict:
+    manifest = json.loads(path.read_text())
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}")
+    return manifest
+
+
+def shard_files(path: Path) -> List[Path]:
+    """Shards listed by a manifest, or the file itself for unsharded outputs"""
+    if not is_manifest(path):
+        return [path]
+    return [path.with_name(shard["path"]) for shard in read_manifest(path)["shards"]]
+
+
+def verify(path: Path) -> List[Path]:
+    """Shards of a manifest whose checksum doesn't match"""
+    corrupt = []
+    for shard in read_manifest(path)["shards"]:
+        shard_file = path.with_name(shard["path"])
+        digest = hashlib.sha256()
+        with shard_file.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != shard["sha256"]:
+            corrupt.append(shard_file)
+    return corrupt
@@ -0,0 +1,172 @@
+"""
+Memory-mappable embedding sidecar files
+
+Embeddings are stored as a row-major `.npy` matrix indexed by `row_id` next to
+a small JSONL metadata file, so downstream readers can `np.load` the matrix
+with `mmap_mode="r"` instead of parsing decimal floats.
+"""
+import io
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from emb3d.io import codec, quantize, reader, shards
+
+# `.npy` v1.0 headers for 2D arrays are padded to a fixed 128 bytes, which lets us
+# reserve the header up front and rewrite it once the final shape is known.
+NPY_HEADER_SIZE = 128
+
+
+def sidecar_path(out_path: Path) -> Path:
+    """Sidecar location for a metadata (or jsonl) output file"""
+    return out_path.with_suffix(".npy")
+
+
+def _npy_header(shape: Tuple[int, int], dtype: np.dtype) -> bytes:
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buf,
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": shape,
+        },
+    )
+    header = buf.getvalue()
+    assert len(header) == NPY_HEADER_SIZE, f"Unexpected npy header size {len(header)}"
+    return header
+
+
+def _runs(row_ids: Sequence[int]) -> Iterator[Tuple[int, int]]:
+    """Split row ids into (start index, length) runs of consecutive ids"""
+    start = 0
+    for idx in range(1, len(row_ids) + 1):
+        if idx == len(row_ids) or row_ids[idx] != row_ids[idx - 1] + 1:
+            yield start, idx - start
+            start = idx
+
+
+class SidecarWriter:
+    """
+    Writes embeddings into a row-indexed `.npy` file.
+
+    Rows can be written in any order, rows that are never written (failures) are
+    zero filled. The header is rewritten on `flush` and finalized on `close`.
+    With `append`, an existing sidecar is reopened and rows can be overwritten.
+    """
+
+    def __init__(self, path: Path, dtype: str = "float32", append: bool = False):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self.num_rows = 0
+        if append and path.exists():
+            self._f = path.open("r+b")
+            np.lib.format.read_magic(self._f)
+            shape, _, file_dtype = np.lib.format.read_array_header_1_0(self._f)
+            if file_dtype != self.dtype:
+                self._f.close()
+                raise ValueError(
+                    f"Sidecar {path} stores {file_dtype}, can't append {self.dtype}"
+                )
+            self.num_rows, dim = shape
+            self.dim = dim or None
+        else:
+            self._f = path.open("wb")
+            self._f.write(_npy_header((0, 0), self.dtype))
+
+    @property
+    def row_bytes(self) -> int:
+        assert self.dim is not None
+        return self.dim * self.dtype.itemsize
+
+    def write(self, row_ids: List[int], embeddings) -> None:
+        """Write embeddings for the given row ids"""
+        data = np.asarray(embeddings, dtype=self.dtype)
+        if data.ndim != 2 or data.shape[0] != len(row_ids):
+            raise ValueError(f"Expected {len(row_ids)} embeddings, got {data.shape}")
+        if self.dim is None:
+            self.dim = data.shape[1]
+        elif data.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension changed from {self.dim} to {data.shape[1]}"
+            )
+
+        for start, length in _runs(row_ids):
+            self._f.seek(NPY_HEADER_SIZE + row_ids[start] * self.row_bytes)
+            self._f.write(data[start : start + length].tobytes())
+        self.num_rows = max(self.num_rows, max(row_ids) + 1)
+
+    def reserve(self, num_rows: int) -> None:
+        """Make sure the matrix has atleast `num_rows` rows (ex: trailing failures)"""
+        self.num_rows = max(self.num_rows, num_rows)
+
+    def _write_header(self) -> None:
+        dim = self.dim or 0
+        self._f.seek(0)
+        self._f.write(_npy_header((self.num_rows, dim), self.dtype))
+        self._f.truncate(NPY_HEADER_SIZE + self.num_rows * dim * self.dtype.itemsize)
+
+    def flush(self) -> None:
+        """Write the current header and sync the file to disk"""
+        self._write_header()
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self._write_header()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load(path: Path) -> Union[np.ndarray, quantize.QuantizedMatrix]:
+    """
+    Memory map a sidecar file, no data is read until it is accessed. Quantized
+    sidecars (see `emb3d.io.quantize`) are decoded as rows are accessed.
+    """
+    codes = np.load(path, mmap_mode="r")
+    codebook_file = quantize.codebook_path(path)
+    if not codebook_file.exists():
+        if codes.dtype.kind != "f":
+            raise ValueError(f"{path} holds quantized codes but has no codebook")
+        return codes
+    quantizer, code_dtype, codes_shape = quantize.load_codebook(codebook_file)
+    if codes.dtype != code_dtype or codes.shape != codes_shape:
+        raise ValueError(
+            f"{path} ({codes.dtype}, {codes.shape}) doesn't match its codebook "
+            f"{codebook_file} ({code_dtype}, {codes_shape}), re-run `emb3d quantize`."
+        )
+    return quantize.QuantizedMatrix(codes, quantizer)
+
+
+def split_jsonl(jsonl_file: Path, out_file: Path, chunk_rows: int = 4096) -> None:
+    """
+    Move the inline embeddings of a JSONL (or sharded) output to a float32
+    sidecar, next to `out_file` which gets the remaining (metadata) fields of
+    every row.
+    """
+    row_ids: List[int] = []
+    embeddings: list = []
+    with out_file.open("w") as out_f, SidecarWriter(sidecar_path(out_file)) as writer:
+        for shard_file in shards.shard_files(jsonl_file):
+            with shard_file.open() as in_f:
+                for record in reader.jsonl(in_f):
+                    embedding = record.pop("embedding", None)
+                    if embedding is not None:
+                        row_ids.append(record["row_id"])
+                        embeddings.append(embedding)
+                    out_f.write(codec.dumps(record) + "\n")
+                    if len(row_ids) >= chunk_rows:
+                        writer.write(row_ids, embeddings)
+                        row_ids, embeddings = [], []
+        if row_ids:
+            writer.write(row_ids, embeddings)
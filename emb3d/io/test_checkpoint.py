@@ -0,0 +1,56 @@
+from emb3d.io import checkpoint
+from emb3d.types import Batch
+
+
+def test_row_ranges_merge():
+    ranges = checkpoint.RowRanges()
+    ranges.add([5, 6, 7, 1, 2])
+    ranges.add_range(3, 5)
+    ranges.add([10])
+
+    assert ranges.ranges() == [(1, 8), (10, 11)]
+    assert len(ranges) == 8
+    assert 7 in ranges
+    assert 8 not in ranges
+    assert 0 not in ranges
+    assert ranges.count_below(6) == 5
+
+
+def test_checkpoint_resume(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    with out_path.open("w") as out_file:
+        ckpt = checkpoint.Checkpoint(
+            checkpoint.checkpoint_path(out_path),
+            out_file,
+            None,
+            checkpoint.RowRanges(),
+            interval=3600,
+        )
+        out_file.write('{"row_id": 0}\n{"row_id": 1}\n')
+        ckpt.record(Batch(row_ids=[0, 1], inputs=["a", "b"]))
+        out_file.write('{"row_id": 2}\n')
+        ckpt.record(Batch(row_ids=[2], inputs=["c"], error="failed"))
+        ckpt.commit()
+        # Written after the last commit, lost in a crash
+        out_file.write('{"row_id": 3}\n')
+        ckpt.record(Batch(row_ids=[3], inputs=["d"]))
+
+    completed = checkpoint.resume(out_path)
+
+    assert completed.ranges() == [(0, 2)]
+    assert out_path.read_text() == '{"row_id": 0}\n{"row_id": 1}\n{"row_id": 2}\n'
+
+
+def test_resume_without_checkpoint(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    out_path.write_text(
+        '{"row_id": 0, "embedding": [1], "error": null}\n'
+        '{"row_id": 1, "embedding": null, "error": "failed"}\n'
+        '{"row_id": 2, "embedding": [1], "error": null}\n'
+        '{"row_id": 3, "embed'
+    )
+
+    completed = checkpoint.resume(out_path)
+
+    assert completed.ranges() == [(0, 1), (2, 3)]
+    assert out_path.read_text().endswith('"error": null}\n')
@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+import pytest
+
+from emb3d.io import codec
+
+
+@pytest.mark.parametrize("name", list(codec.available_codecs()))
+def test_roundtrip(name):
+    json_codec = codec.available_codecs()[name]
+    rows = [
+        {"row_id": 0, "input": "héllo\n", "embedding": np.array([0.5, -1.25])},
+        {"row_id": 1, "input": "", "embedding": [1.0, 2.0], "error": None},
+        {"row_id": 2, "embedding": np.arange(4, dtype=np.float16)[::2]},
+    ]
+
+    lines = json_codec.dumps_lines(rows).splitlines()
+
+    assert [json_codec.loads(line) for line in lines] == [
+        {"row_id": 0, "input": "héllo\n", "embedding": [0.5, -1.25]},
+        {"row_id": 1, "input": "", "embedding": [1.0, 2.0], "error": None},
+        {"row_id": 2, "embedding": [0.0, 2.0]},
+    ]
+    assert json.loads(json_codec.dumps({"value": np.float32(0.5)})) == {"value": 0.5}
+
+
+def test_use():
+    default = codec.current()
+    try:
+        codec.use("json")
+        assert codec.dumps({"a": 1}) == '{"a": 1}'
+    finally:
+        codec.use(default)
+    with pytest.raises(ValueError):
+        codec.use("missing")
@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+
+from emb3d.io import loader
+from emb3d.io.sidecar import SidecarWriter, sidecar_path
+
+
+def write_rows(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+
+
+def test_load_jsonl_skips_failed_rows(tmp_path):
+    path = tmp_path / "out.jsonl"
+    write_rows(
+        path,
+        [
+            {"row_id": 0, "input": "a", "embedding": [1.0, 2.0], "error": None},
+            {"row_id": 1, "input": "b", "embedding": None, "error": "failed"},
+            {"row_id": 2, "input": "c", "embedding": [3.0, 4.0], "title": "x" * 500},
+        ],
+    )
+
+    matrix, labels = loader.load_embeddings(path, "title")
+
+    assert matrix.dtype == np.float32
+    assert matrix.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+    assert labels.tolist() == ["0", "x" * loader.LABEL_MAX_CHARS]
+
+
+def test_load_over_budget_uses_memmap(tmp_path):
+    path = tmp_path / "out.jsonl"
+    vectors = np.random.default_rng(0).random((50, 8), dtype=np.float32)
+    write_rows(
+        path,
+        [{"row_id": idx, "embedding": v.tolist()} for idx, v in enumerate(vectors)],
+    )
+
+    matrix, labels = loader.load_embeddings(path, None, memory_budget=100)
+
+    assert isinstance(matrix, np.memmap)
+    np.testing.assert_array_equal(matrix, vectors)
+    assert labels.tolist() == [str(idx) for idx in range(50)]
+
+
+def test_load_sidecar(tmp_path):
+    path = tmp_path / "out.jsonl"
+    write_rows(
+        path,
+        [
+            {"row_id": 2, "input": "c", "error": None},
+            {"row_id": 0, "input": "a", "error": "failed"},
+            {"row_id": 1, "input": "b", "error": None},
+        ],
+    )
+    with SidecarWriter(sidecar_path(path)) as writer:
+        writer.write([0, 1, 2], [[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]])
+
+    matrix, labels = loader.load_embeddings(path, "input")
+
+    assert matrix.tolist() == [[2.0, 2.0], [1.0, 1.0]]
+    assert labels.tolist() == ["c", "b"]
+
+
+def test_iter_embeddings_matches_load(tmp_path):
+    path = tmp_path / "out.jsonl"
+    rows = [{"row_id": idx, "embedding": [idx, -idx]} for idx in range(10)]
+    rows[3] = {"row_id": 3, "embedding": None, "error": "failed"}
+    write_rows(path, rows)
+
+    chunks = list(loader.iter_embeddings(path, chunk_rows=4))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 1]
+    matrix, _ = loader.load_embeddings(path, None)
+    np.testing.assert_array_equal(np.concatenate(chunks), matrix)
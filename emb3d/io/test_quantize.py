@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from emb3d.io import loader, quantize, sidecar
+from emb3d.io.test_loader import write_rows
+
+
+def _vectors(rows=500, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(rows, dim)).astype(np.float32)
+
+
+def test_scalar_quantizer_error_is_bounded():
+    X = _vectors()
+    quantizer = quantize.ScalarQuantizer.fit(X)
+    codes = quantizer.encode(X)
+    assert codes.dtype == np.uint8 and codes.shape == X.shape
+    # Atmost half a quantization step per dimension
+    assert np.all(np.abs(quantizer.decode(codes) - X) <= quantizer.scale / 2 + 1e-6)
+
+
+def test_product_quantizer_round_trip():
+    X = _vectors()
+    quantizer = quantize.ProductQuantizer.fit(X, subvector_dim=4)
+    codes = quantizer.encode(X)
+    assert codes.shape == (500, 4)
+    assert quantizer.decode(codes).shape == X.shape
+    report = quantize.evaluate(quantizer, X)
+    assert 0 < report["error"] < 0.5
+
+    with pytest.raises(ValueError):
+        quantize.ProductQuantizer.fit(X, subvector_dim=5)
+
+
+@pytest.mark.parametrize("scheme", ["float16", "int8", "pq"])
+def test_quantized_sidecar_loads_lazily(tmp_path, scheme):
+    path = tmp_path / "out.jsonl"
+    X = _vectors()
+    write_rows(
+        path,
+        [
+            {"row_id": idx, "input": str(idx), "embedding": vector.tolist()}
+            for idx, vector in enumerate(X)
+        ],
+    )
+    out_file = tmp_path / "out.q.jsonl"
+    sidecar.split_jsonl(path, out_file)
+    sidecar_file = sidecar.sidecar_path(out_file)
+
+    report = quantize.quantize_sidecar(sidecar_file, scheme, subvector_dim=2)
+
+    assert report["recall"] > 0.5
+    vectors = sidecar.load(sidecar_file)
+    assert vectors.shape == X.shape
+    matrix, labels = loader.load_embeddings(out_file, "input")
+    assert matrix.dtype == np.float32
+    assert labels.tolist() == [str(idx) for idx in range(len(X))]
+    tolerance = {"float16": 1e-2, "int8": 0.1, "pq": 2.0}[scheme]
+    # Held out rows can fall outside the int8 range fit on the training rows
+    train_rows, _ = quantize._split_rows(len(X), seed=0)
+    np.testing.assert_allclose(matrix[train_rows], X[train_rows], atol=tolerance)
+    if scheme != "float16":
+        # Codes can't be quantized again
+        with pytest.raises(ValueError):
+            quantize.quantize_sidecar(sidecar_file, "int8")
+
+
+def test_sidecar_rejects_mismatched_codebook(tmp_path):
+    sidecar_file = tmp_path / "out.npy"
+    codebook_file = quantize.codebook_path(sidecar_file)
+    X = _vectors()
+    np.save(sidecar_file, X)
+    quantize.quantize_sidecar(sidecar_file, "int8")
+    codes = np.load(sidecar_file)
+
+    # Float codes next to a codebook (ex: interrupted before the codes were replaced)
+    np.save(sidecar_file, X)
+    with pytest.raises(ValueError):
+        sidecar.load(sidecar_file)
+    # which is overwritten when quantizing again
+    quantize.quantize_sidecar(sidecar_file, "int8")
+    assert sidecar.load(sidecar_file).shape == X.shape
+
+    # Codes without their codebook
+    codebook_file.unlink()
+    np.save(sidecar_file, codes)
+    with pytest.raises(ValueError):
+        sidecar.load(sidecar_file)
+
+
+def test_quantize_sidecar_to_new_file(tmp_path):
+    sidecar_file = tmp_path / "out.npy"
+    out_file = tmp_path / "out.pq.npy"
+    X = _vectors()
+    np.save(sidecar_file, X)
+
+    quantize.quantize_sidecar(sidecar_file, "pq", subvector_dim=4, out_file=out_file)
+
+    # The float sidecar is left as is
+    np.testing.assert_array_equal(np.load(sidecar_file), X)
+    assert not quantize.codebook_path(sidecar_file).exists()
+    assert sidecar.load(out_file).shape == X.shape
+
+
+def test_evaluation_rows_are_held_out():
+    train_rows, eval_rows = quantize._split_rows(1000, seed=0)
+    assert len(eval_rows) == 200
+    assert len(np.union1d(train_rows, eval_rows)) == 1000
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from emb3d.io import ranges
+
+
+def test_byte_ranges(tmp_path):
+    path = tmp_path / "in.jsonl"
+    lines = [f'{{"text": "row {i} {"é" * (i % 5)}"}}' for i in range(50)]
+    path.write_text("\n".join(lines))
+
+    byte_ranges = ranges.byte_ranges(path, 64)
+
+    # Ranges are contiguous and end at line boundaries
+    assert byte_ranges[0][0] == 0 and byte_ranges[-1][1] == path.stat().st_size
+    assert all(
+        end == start for (_, end), (start, _) in zip(byte_ranges, byte_ranges[1:])
+    )
+    assert [line for r in byte_ranges for line in ranges.range_lines(path, r)] == lines
+
+
+def test_byte_ranges_split_multibyte_characters(tmp_path):
+    path = tmp_path / "in.jsonl"
+    lines = ['{"text": "ééé"}', '{"text": "日本語"}', '{"text": "🙂🙂"}']
+    path.write_text("\n".join(lines) + "\n")
+
+    # Every byte offset of the file is a range boundary for some range size,
+    # including offsets inside multi-byte characters
+    for range_bytes in range(1, path.stat().st_size + 1):
+        byte_ranges = ranges.byte_ranges(path, range_bytes)
+        assert [
+            line for r in byte_ranges for line in ranges.range_lines(path, r)
+        ] == lines
+
+
+def test_parsed_in_order_with_unordered_completion():
+    third_parsed = threading.Event()
+
+    def parse(byte_range):
+        start, end = byte_range
+        if start == 0:
+            # The first range completes after the third one
+            assert third_parsed.wait(timeout=10)
+        if start == 20:
+            third_parsed.set()
+        return end - start, [str(start)], [1]
+
+    byte_ranges = [(0, 10), (10, 20), (20, 25), (25, 40)]
+    with ThreadPoolExecutor(3) as executor:
+        parsed = list(ranges._parsed_in_order(executor, parse, byte_ranges, 3))
+
+    assert [(first_row, texts) for first_row, (_, texts, _) in parsed] == [
+        (0, ["0"]),
+        (10, ["10"]),
+        (20, ["20"]),
+        (25, ["25"]),
+    ]
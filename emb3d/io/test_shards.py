@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+from emb3d.io import loader, shards
+
+
+def _write(writer, row_ids):
+    writer.write_rows(
+        row_ids,
+        "".join(
+            json.dumps({"row_id": row_id, "embedding": [row_id, 1.0], "error": None})
+            + "\n"
+            for row_id in row_ids
+        ),
+    )
+
+
+def test_parse_shard_size():
+    assert shards.parse_shard_size("1000") == (1000, None)
+    assert shards.parse_shard_size("512MB") == (None, 512 << 20)
+    assert shards.parse_shard_size("2k") == (None, 2048)
+    with pytest.raises(ValueError):
+        shards.parse_shard_size("0")
+
+
+def test_sharded_writer_rolls_by_rows(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    with shards.ShardedWriter(out_path, max_rows=4) as writer:
+        _write(writer, [5, 1, 2])
+        _write(writer, [0, 3, 4, 6, 7])
+        _write(writer, [9, 8])
+
+    manifest_file = shards.manifest_path(out_path)
+    manifest = shards.read_manifest(manifest_file)
+    assert manifest["complete"] and manifest["rows"] == 10
+    assert [shard["rows"] for shard in manifest["shards"]] == [4, 4, 2]
+    assert manifest["shards"][0]["path"] == "out-00000.jsonl"
+    assert (
+        manifest["shards"][0]["row_id_min"],
+        manifest["shards"][0]["row_id_max"],
+    ) == (0, 5)
+    assert shards.verify(manifest_file) == []
+
+    (tmp_path / "out-00001.jsonl").write_text("\n")
+    assert shards.verify(manifest_file) == [tmp_path / "out-00001.jsonl"]
+
+
+def test_sharded_writer_failed_job_is_partial(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    with pytest.raises(KeyboardInterrupt):
+        with shards.ShardedWriter(out_path, max_rows=2) as writer:
+            _write(writer, [0, 1, 2])
+            raise KeyboardInterrupt
+
+    manifest = shards.read_manifest(shards.manifest_path(out_path))
+    # Rows written so far are listed, but the output isn't complete
+    assert not manifest["complete"] and manifest["rows"] == 3
+
+
+def test_sharded_writer_rolls_by_bytes(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    with shards.ShardedWriter(out_path, max_bytes=150) as writer:
+        _write(writer, list(range(10)))
+
+    manifest = shards.read_manifest(shards.manifest_path(out_path))
+    assert sum(shard["rows"] for shard in manifest["shards"]) == 10
+    assert all(shard["bytes"] <= 150 for shard in manifest["shards"])
+    assert len(manifest["shards"]) > 1
+
+
+def test_load_sharded_output(tmp_path):
+    out_path = tmp_path / "out.jsonl"
+    with shards.ShardedWriter(out_path, max_rows=3) as writer:
+        _write(writer, list(range(7)))
+
+    manifest_file = shards.manifest_path(out_path)
+    matrix, labels = loader.load_embeddings(manifest_file, None)
+
+    assert matrix[:, 0].tolist() == list(range(7))
+    assert labels.tolist() == [str(row_id) for row_id in range(7)]
+    assert loader.load_row_ids(manifest_file).tolist() == list(range(7))
+    chunks = list(loader.iter_embeddings(manifest_file, chunk_rows=5))
+    np.testing.assert_array_equal(np.concatenate(chunks), matrix)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from emb3d.io import sidecar
+
+
+def test_sidecar_out_of_order_writes(tmp_path):
+    path = tmp_path / "out.npy"
+    with sidecar.SidecarWriter(path) as writer:
+        writer.write([3, 4], [[3.0, 3.5], [4.0, 4.5]])
+        writer.write([0, 2], [[0.0, 0.5], [2.0, 2.5]])
+        writer.reserve(6)
+
+    matrix = sidecar.load(path)
+    assert isinstance(matrix, np.memmap)
+    assert matrix.shape == (6, 2)
+    assert matrix.dtype == np.float32
+    assert matrix[2].tolist() == [2.0, 2.5]
+    assert matrix[4].tolist() == [4.0, 4.5]
+    # Rows that were never written are zero filled
+    assert matrix[1].tolist() == [0.0, 0.0]
+    assert matrix[5].tolist() == [0.0, 0.0]
+
+
+def test_sidecar_float16(tmp_path):
+    path = tmp_path / "out.npy"
+    with sidecar.SidecarWriter(path, dtype="float16") as writer:
+        writer.write([0], [[0.25, -1.0]])
+
+    matrix = sidecar.load(path)
+    assert matrix.dtype == np.float16
+    assert matrix.tolist() == [[0.25, -1.0]]
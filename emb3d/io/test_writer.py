@@ -0,0 +1,30 @@
+import base64
+import json
+
+import numpy as np
+
+from emb3d.io import writer
+
+
+def test_quantize_coords_keeps_aspect_ratio():
+    coords = np.array([[-1.0, 0.0], [3.0, 1.0], [1.0, 2.0]])
+    quantized, extent = writer.quantize_coords(coords)
+    assert quantized.dtype == np.uint16
+    assert extent == (1.0, 0.5)
+    restored = quantized / 65535 * np.array(extent) * 4 + [-1.0, 0.0]
+    np.testing.assert_allclose(restored, coords, atol=1e-3)
+
+
+def test_scatter2html(tmp_path):
+    out_file = tmp_path / "out.2d.html"
+    coords = np.array([[0.0, 0.0], [1.0, 1.0]], dtype=np.float32)
+    writer.scatter2html(coords, ["a", "</script>"], out_file, colors=[1, 2])
+
+    page = out_file.read_text()
+    payload = page.split('type="application/json">')[1].split("</script>")[0]
+    data = json.loads(payload)
+    assert data["n"] == 2
+    assert data["labels"] == ["a", "</script>"]
+    assert base64.b64decode(data["colors"]) == bytes([1, 2])
+    quantized = np.frombuffer(base64.b64decode(data["coords"]), dtype="<u2")
+    assert quantized.tolist() == [0, 0, 65535, 65535]
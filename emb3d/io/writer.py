@@ -1,9 +1,32 @@
 """
 Writers
 """
+import base64
+import html
 from pathlib import Path
+from typing import Optional, Sequence, Tuple
 
 import altair as alt
+import numpy as np
+
+from emb3d.io import codec
+
+SCATTER_TEMPLATE = Path(__file__).parent / "templates" / "scatter.html"
+
+# Point colors, index 0 is for unclustered points
+PALETTE = [
+    "#bbbbbb",
+    "#4c78a8",
+    "#f58518",
+    "#54a24b",
+    "#e45756",
+    "#72b7b2",
+    "#eeca3b",
+    "#b279a2",
+    "#ff9da6",
+    "#9d755d",
+    "#79706e",
+]
 
 
 def chart2html(chart: alt.TopLevelMixin, out_fname: Path):
@@ -12,3 +35,49 @@ def chart2html(chart: alt.TopLevelMixin, out_fname: Path):
     """
     with alt.data_transformers.enable("default"):
         chart.save(out_fname)
+
+
+def quantize_coords(coords: np.ndarray) -> Tuple[np.ndarray, Tuple[float, float]]:
+    """
+    2D coordinates as uint16 pairs and the extent they are scaled to. Both axes
+    share a scale (the larger span) so the aspect ratio is preserved.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        return np.empty((0, 2), dtype=np.uint16), (1.0, 1.0)
+    lo = coords.min(axis=0)
+    spans = coords.max(axis=0) - lo
+    span = float(spans.max()) or 1.0
+    extent = spans / span
+    scaled = (coords - lo) / span / np.where(extent > 0, extent, 1)
+    quantized = np.rint(scaled * np.iinfo(np.uint16).max).astype("<u2")
+    return quantized, (float(extent[0]) or 1.0, float(extent[1]) or 1.0)
+
+
+def scatter2html(
+    coords: np.ndarray,
+    labels: Sequence[str],
+    out_fname: Path,
+    colors: Optional[np.ndarray] = None,
+    title: str = "emb3d",
+):
+    """
+    Write a WebGL scatter plot of 2D coordinates to an html file. Coordinates are
+    embedded as a base64 blob of uint16 pairs, `colors` are indices into `PALETTE`.
+    """
+    quantized, extent = quantize_coords(coords)
+    data = {
+        "n": len(quantized),
+        "extent": extent,
+        "coords": base64.b64encode(quantized.tobytes()).decode(),
+        "colors": None
+        if colors is None
+        else base64.b64encode(np.asarray(colors, dtype=np.uint8).tobytes()).decode(),
+        "palette": PALETTE,
+        "labels": [str(label) for label in labels],
+    }
+    # Labels can't close the script tag they are embedded in
+    payload = codec.dumps(data).replace("</", "<\\/")
+    page = SCATTER_TEMPLATE.read_text()
+    page = page.replace("__TITLE__", html.escape(title)).replace("__DATA__", payload)
+    Path(out_fname).write_text(page)
@@ -3,22 +3,41 @@ emb3d CLI
 """
 import os
 import random
+import shutil
 import string
 import sys
 import webbrowser
+from contextlib import nullcontext
 from enum import Enum
-from io import StringIO
 from pathlib import Path
-from typing import Optional, TextIO
+from typing import List, Optional, TextIO, Union
 
+import numpy as np
 import typer
 from rich.prompt import Prompt
 from typing_extensions import Annotated
 
-from emb3d import compute, config, textui
-from emb3d.compute import visualize
-from emb3d.io import reader, writer
-from emb3d.types import Backend, EmbedJob, ExecutionConfig
+from emb3d import cache, compute, config, textui
+from emb3d.compute import ann, artifacts, neardup, search, serve, visualize
+from emb3d.compute.dedupe import DedupeIndex
+from emb3d.io import (
+    checkpoint,
+    codec,
+    loader,
+    quantize,
+    reader,
+    shards,
+    sidecar,
+    writer,
+)
+from emb3d.types import (
+    Backend,
+    EmbeddingDtype,
+    EmbedJob,
+    ExecutionConfig,
+    LocalEngine,
+    OutputFormat,
+)
 
 app = typer.Typer(add_completion=False)
 
@@ -27,9 +46,8 @@ app = typer.Typer(add_completion=False)
 
 def _input_file_or_stdin(input_file: Optional[Path], stdin_input: bool) -> TextIO:
     if stdin_input:
-        # NOTE: This isn't memory efficient, stdin is primarily for convenience
-        # Long jobs are better off using input_file flag
-        return StringIO(sys.stdin.read())
+        # stdin can't be rewound, jobs reading from it are always streamed
+        return sys.stdin
     if input_file is None:
         input_file = Path(Prompt.ask("Enter the input file path"))
         if not input_file or not input_file.exists():
@@ -39,13 +57,37 @@ def _input_file_or_stdin(input_file: Optional[Path], stdin_input: bool) -> TextI
     return input_file.open()
 
 
+def _resumed_rows(out_file: Optional[Path], resume: bool) -> checkpoint.RowRanges:
+    if not resume:
+        return checkpoint.RowRanges()
+    if out_file is None:
+        raise typer.BadParameter(
+            "--resume requires the --output-file of the job being resumed."
+        )
+    if not out_file.exists():
+        typer.echo(f"File {out_file} does not exist, starting a new job...")
+        return checkpoint.RowRanges()
+    try:
+        return checkpoint.resume(out_file)
+    except ValueError as err:
+        raise typer.BadParameter(
+            f"{err}. Delete {checkpoint.checkpoint_path(out_file)} to resume from the output file alone, or drop --resume to start over."
+        ) from err
+
+
 def _output_file(
-    out_file: Optional[Path], input_file: Optional[Path], stdin_input: bool
+    out_file: Optional[Path],
+    input_file: Optional[Path],
+    stdin_input: bool,
+    resume: bool = False,
 ) -> TextIO:
     if out_file is not None:
-        # TODO: Handle job termination/resume
         if out_file.exists():
-            raise typer.BadParameter(f"File {out_file} already exists, aborting...")
+            if resume:
+                return out_file.open("a")
+            raise typer.BadParameter(
+                f"File {out_file} already exists, aborting... (use --resume to continue a previous job)"
+            )
         return out_file.open("w")
     elif stdin_input:
         return sys.stdout
@@ -72,7 +114,10 @@ def _pick_model(model_id: Optional[str]) -> str:
 
 
 def _execution_config(
-    api_key: Optional[str], model_id: str, remote: bool
+    api_key: Optional[str],
+    model_id: str,
+    remote: bool,
+    local_config: Optional[ExecutionConfig] = None,
 ) -> ExecutionConfig:
     backend = EmbedJob.backend_from_model(model_id)
     remote_only_backends = (Backend.OPENAI, Backend.COHERE)
@@ -80,7 +125,7 @@ def _execution_config(
         remote = True
 
     if not remote:
-        return ExecutionConfig.local()
+        return local_config or ExecutionConfig.local()
 
     default_env_variables = {
         Backend.OPENAI: "OPENAI_API_KEY",
@@ -108,6 +153,72 @@ def _execution_config(
     return ExecutionConfig.remote(api_key=api_key)
 
 
+_FLOAT_DTYPES = (EmbeddingDtype.FLOAT32, EmbeddingDtype.FLOAT16)
+
+
+def _embedding_sidecar(
+    output_format: OutputFormat,
+    output_file_io: TextIO,
+    dtype: EmbeddingDtype,
+    resume: bool = False,
+) -> Optional[sidecar.SidecarWriter]:
+    if output_format == OutputFormat.JSONL:
+        return None
+    if output_file_io is sys.stdout:
+        raise typer.BadParameter(
+            f"--output-format {output_format.value} requires an --output-file."
+        )
+    sidecar_file = sidecar.sidecar_path(Path(output_file_io.name))
+    if sidecar_file.exists() and not resume:
+        raise typer.BadParameter(f"File {sidecar_file} already exists, aborting...")
+    if resume and quantize.codebook_path(sidecar_file).exists():
+        raise typer.BadParameter(
+            f"{sidecar_file} is quantized and can't be resumed, aborting..."
+        )
+    # Quantized sidecars are written in float32 and quantized once the job is done
+    writer_dtype = dtype.value if dtype in _FLOAT_DTYPES else "float32"
+    try:
+        return sidecar.SidecarWriter(sidecar_file, dtype=writer_dtype, append=resume)
+    except ValueError as err:
+        raise typer.BadParameter(str(err))
+
+
+def _sharded_output(
+    out_file: Optional[Path], shard_size: str, output_format: OutputFormat, resume: bool
+) -> shards.ShardedWriter:
+    if out_file is None:
+        raise typer.BadParameter("--shard-size requires an --output-file.")
+    if resume or output_format != OutputFormat.JSONL:
+        raise typer.BadParameter(
+            "--shard-size can't be used with --resume or --output-format npy."
+        )
+    try:
+        max_rows, max_bytes = shards.parse_shard_size(shard_size)
+    except ValueError as err:
+        raise typer.BadParameter(str(err))
+    manifest_file = shards.manifest_path(out_file)
+    if manifest_file.exists():
+        raise typer.BadParameter(f"File {manifest_file} already exists, aborting...")
+    return shards.ShardedWriter(out_file, max_rows, max_bytes)
+
+
+def _checkpoint(
+    output_file_io: Union[TextIO, shards.ShardedWriter],
+    embedding_sidecar: Optional[sidecar.SidecarWriter],
+    completed: checkpoint.RowRanges,
+) -> Optional[checkpoint.Checkpoint]:
+    # Sharded outputs can't be resumed, they aren't checkpointed
+    if output_file_io is sys.stdout or isinstance(output_file_io, shards.ShardedWriter):
+        return None
+    return checkpoint.Checkpoint(
+        checkpoint.checkpoint_path(Path(output_file_io.name)),
+        output_file_io,
+        embedding_sidecar,
+        completed,
+        interval=config.CHECKPOINT_INTERVAL_SECS,
+    )
+
+
 @app.command("config", help="Get or set a configuration value.")
 def cmd_config(
     key: str = typer.Argument(
@@ -172,30 +283,494 @@ def cmd_compute(
         1000,
         help="(Remote Execution) Maximum number of concurrent requests for the embedding task. Default is 1000.",
     ),
+    output_format: Annotated[
+        OutputFormat,
+        typer.Option(
+            case_sensitive=False,
+            help="`jsonl` writes embeddings inline. `npy` writes them to a memory-mappable .npy sidecar indexed by row_id, the output file only holds row metadata.",
+        ),
+    ] = OutputFormat.JSONL,
+    dtype: Annotated[
+        EmbeddingDtype,
+        typer.Option(
+            case_sensitive=False,
+            help="Precision of the embeddings stored in the .npy sidecar.",
+        ),
+    ] = EmbeddingDtype.FLOAT32,
+    resume: bool = typer.Option(
+        False,
+        help="Resume an interrupted job writing to --output-file. Only rows that are missing or failed in the existing output are computed.",
+    ),
+    use_cache: bool = typer.Option(
+        False,
+        "--cache/--no-cache",
+        help="Reuse embeddings computed by previous jobs for the same model and text, new embeddings are added to the cache.",
+    ),
+    cache_max_mb: int = typer.Option(
+        config.EMBEDDING_CACHE_DEFAULT_MAX_MB,
+        help="Size cap for the embedding cache, least recently used entries are evicted beyond it.",
+    ),
+    dedupe: bool = typer.Option(
+        False,
+        help="Embed each distinct text once and copy its embedding to every row with the same text.",
+    ),
+    stream: bool = typer.Option(
+        False,
+        help="Start right away without counting the input records first, progress is estimated from the input file size. Input from stdin is always streamed.",
+    ),
+    read_workers: int = typer.Option(
+        1,
+        min=1,
+        help="Number of processes parsing and tokenizing the input file. Above 1, the file is split into newline aligned byte ranges that are read in parallel. Ignored for stdin and --stream.",
+    ),
+    workers: int = typer.Option(
+        1,
+        min=1,
+        help="(Local Execution) Number of inference processes. Each process loads the model once and gets an equal share of the CPU threads.",
+    ),
+    bucket_window: int = typer.Option(
+        config.LOCAL_BUCKET_WINDOW,
+        min=0,
+        help="(Local Execution) Number of rows read ahead and sorted by length so that batches hold inputs of similar length, which reduces padding. 0 batches rows in file order.",
+    ),
+    engine: Annotated[
+        LocalEngine,
+        typer.Option(
+            case_sensitive=False,
+            help="(Local Execution) Inference runtime. `onnx` exports the model to ONNX once and runs it with ONNX Runtime (needs the `onnx` and `onnxruntime` packages).",
+        ),
+    ] = LocalEngine.TORCH,
+    quantize_model: bool = typer.Option(
+        False,
+        "--quantize/--no-quantize",
+        help="(Local Execution) Apply dynamic int8 quantization to the ONNX model.",
+    ),
+    shard_size: Optional[str] = typer.Option(
+        None,
+        help="Split the output into shards of this many rows (ex: 100000) or bytes (ex: 512MB), described by a <output file>.manifest.json manifest.",
+    ),
 ):
     stdin_input = input_file is None
+    streaming = stream or stdin_input
+    if streaming and dedupe:
+        raise typer.BadParameter(
+            "--dedupe needs a pre-counted input file and can't be used with --stream or stdin."
+        )
 
     input_file_io = _input_file_or_stdin(input_file, stdin_input)
-    output_file_io = _output_file(output_file, input_file, stdin_input)
+    completed = _resumed_rows(output_file, resume)
+    if shard_size is None:
+        output_file_io = _output_file(output_file, input_file, stdin_input, resume)
+    else:
+        output_file_io = _sharded_output(output_file, shard_size, output_format, resume)
+    model = _pick_model(model)
+    if quantize_model and engine != LocalEngine.ONNX:
+        raise typer.BadParameter("--quantize is only supported with --engine onnx.")
+    execution_mode = _execution_config(
+        api_key,
+        model,
+        remote,
+        ExecutionConfig.local(workers, bucket_window, engine, quantize_model),
+    )
+    embedding_sidecar = _embedding_sidecar(output_format, output_file_io, dtype, resume)
+    job_checkpoint = _checkpoint(output_file_io, embedding_sidecar, completed)
+    embedding_cache = (
+        cache.EmbeddingCache(cache.cache_path(), cache_max_mb * 1024 * 1024)
+        if use_cache
+        else None
+    )
+
+    # The checkpoint is committed on exit, before the outputs are closed
+    with input_file_io, output_file_io, embedding_sidecar or nullcontext():
+        with job_checkpoint or nullcontext(), embedding_cache or nullcontext():
+            dedupe_index = None
+            num_records = 0
+            if dedupe:
+                dedupe_index = DedupeIndex.build(
+                    record[EmbedJob.column_name]
+                    for record in reader.jsonl(input_file_io)
+                )
+                num_records = len(dedupe_index)
+            elif not streaming:
+                num_records = sum(1 for _ in reader.line(input_file_io))
+            if not streaming:
+                # Rewind
+                input_file_io.seek(0)
+            new_job = EmbedJob(
+                job_id=new_job_id(),
+                in_file=input_file_io,
+                model_id=model,
+                out_file=output_file_io,
+                total_records=num_records,
+                batch_size=batch_size,
+                max_concurrent_requests=max_concurrent_requests
+                if streaming
+                else min(max_concurrent_requests, num_records),
+                execution_config=execution_mode,
+                output_format=output_format,
+                embedding_sidecar=embedding_sidecar,
+                checkpoint=job_checkpoint,
+                embedding_cache=embedding_cache,
+                dedupe=dedupe_index,
+                streaming=streaming,
+                input_size_bytes=input_file.stat().st_size if input_file else None,
+                read_workers=read_workers,
+            )
+
+            compute.execute(new_job)
+            if isinstance(output_file_io, shards.ShardedWriter):
+                # Interrupted remote jobs return early without raising
+                output_file_io.close(complete=new_job.tracker.finished)
+
+    if embedding_sidecar is not None and dtype not in _FLOAT_DTYPES:
+        _quantize_sidecar(embedding_sidecar.path, dtype)
+
+
+def _quantize_sidecar(
+    sidecar_file: Path,
+    dtype: EmbeddingDtype,
+    subvector_dim: int = config.QUANTIZE_PQ_SUBVECTOR_DIM,
+    out_file: Optional[Path] = None,
+):
+    out_file = out_file or sidecar_file
+    with textui.SimpleProgressBar(f"Quantizing {sidecar_file} to {dtype.value}"):
+        try:
+            report = quantize.quantize_sidecar(
+                sidecar_file, dtype.value, subvector_dim, out_file=out_file
+            )
+        except ValueError as err:
+            raise typer.BadParameter(str(err))
+    saved_to = "" if out_file == sidecar_file else f" (saved to {out_file})"
+    typer.echo(
+        f"Quantized {sidecar_file} to {dtype.value}{saved_to}: relative reconstruction error {report['error']:.4f}, "
+        f"nearest neighbour recall@10 {report['recall']:.3f} (measured on held out rows)."
+    )
+
+
+@app.command("quantize", help="Compress the embeddings of a computed output.")
+def cmd_quantize(
+    embedding_file: Path = typer.Argument(
+        ...,
+        help="Path to the embedding file.",
+    ),
+    dtype: Annotated[
+        EmbeddingDtype,
+        typer.Option(
+            case_sensitive=False,
+            help="`float16` halves the size, `int8` scalar-quantizes every dimension to a byte, `pq` (product quantization) stores a byte per --subvector-dim dimensions.",
+        ),
+    ] = EmbeddingDtype.INT8,
+    output_file: Optional[Path] = typer.Option(
+        None,
+        "--output-file",
+        "-o",
+        help="Path to the output metadata file, the codes are saved next to it. Defaults to <embedding file>.<dtype>.jsonl.",
+    ),
+    subvector_dim: int = typer.Option(
+        config.QUANTIZE_PQ_SUBVECTOR_DIM,
+        min=1,
+        help="(pq) Dimensions coded by each byte, must divide the embedding dimension.",
+    ),
+    in_place: bool = typer.Option(
+        False,
+        "--in-place",
+        help="(Sidecar outputs) Replace the float sidecar with the codes instead of writing a new output.",
+    ),
+):
+    if dtype == EmbeddingDtype.FLOAT32:
+        raise typer.BadParameter("Choose a compressed --dtype: float16, int8 or pq.")
+    if not embedding_file.is_file():
+        raise typer.BadParameter(f"File {embedding_file} not found, aborting...")
+    sidecar_file = sidecar.sidecar_path(embedding_file)
+    if in_place:
+        if not sidecar_file.exists():
+            raise typer.BadParameter(
+                f"--in-place needs an output with a sidecar, {sidecar_file} not found."
+            )
+        _quantize_sidecar(sidecar_file, dtype, subvector_dim)
+        return
+
+    output_file = output_file or embedding_file.with_suffix(f".{dtype.value}.jsonl")
+    out_sidecar_file = sidecar.sidecar_path(output_file)
+    for path in (output_file, out_sidecar_file):
+        if path.exists():
+            raise typer.BadParameter(f"File {path} already exists, aborting...")
+    if sidecar_file.exists():
+        _quantize_sidecar(sidecar_file, dtype, subvector_dim, out_file=out_sidecar_file)
+        shutil.copyfile(embedding_file, output_file)
+    else:
+        # Inline embeddings are moved to a sidecar next to a metadata only output
+        with textui.SimpleProgressBar(f"Moving embeddings to {out_sidecar_file}"):
+            sidecar.split_jsonl(embedding_file, output_file)
+        _quantize_sidecar(out_sidecar_file, dtype, subvector_dim)
+
+
+@app.command("serve", help="Serve embeddings over a local HTTP endpoint.")
+def cmd_serve(
+    model: Optional[str] = typer.Option(
+        config.AppConfig.instance().default_model,
+        help="Embedding model to use.",
+    ),
+    api_key: Optional[str] = typer.Option(
+        None,
+        help="API key for the service hosting the model. If not provided, it will be prompted or fetched from environment variables.",
+    ),
+    remote: Annotated[
+        bool,
+        typer.Option(
+            "--remote/--local",
+            help="Choose whether to do inference locally or with an API token.",
+        ),
+    ] = True,
+    host: str = typer.Option("127.0.0.1", help="Address to listen on."),
+    port: int = typer.Option(config.SERVE_DEFAULT_PORT, help="Port to listen on."),
+    max_batch_size: int = typer.Option(
+        config.SERVE_MAX_BATCH_SIZE,
+        min=1,
+        help="Maximum number of inputs grouped into a single model call.",
+    ),
+    max_wait_ms: float = typer.Option(
+        config.SERVE_MAX_WAIT_MS,
+        min=0,
+        help="Maximum time a request waits for other requests to batch with.",
+    ),
+    engine: Annotated[
+        LocalEngine,
+        typer.Option(case_sensitive=False, help="(Local Execution) Inference runtime."),
+    ] = LocalEngine.TORCH,
+    quantize_model: bool = typer.Option(
+        False,
+        "--quantize/--no-quantize",
+        help="(Local Execution) Apply dynamic int8 quantization to the ONNX model.",
+    ),
+):
+    model = _pick_model(model)
+    execution_mode = _execution_config(
+        api_key,
+        model,
+        remote,
+        ExecutionConfig.local(engine=engine, quantize=quantize_model),
+    )
+    with textui.SimpleProgressBar(f"Loading {model}"):
+        if execution_mode.is_remote:
+            embed_fn = serve.remote_embed_fn(model, execution_mode.api_key)
+        else:
+            embed_fn = serve.local_embed_fn(model, execution_mode)
+    batcher = serve.MicroBatcher(embed_fn, max_batch_size, max_wait_ms / 1000).start()
+    server = serve.make_server(host, port, batcher)
+    typer.echo(f"Serving {model} on http://{host}:{server.server_port}/embed")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+    stats = batcher.stats.summary()
+    typer.echo(
+        f"Served {stats['requests']} requests, "
+        f"p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms."
+    )
+
+
+@app.command("search", help="Find the records closest to a query.")
+def cmd_search(
+    embedding_file: Path = typer.Argument(
+        ...,
+        help="Path to the embedding file.",
+    ),
+    query: List[str] = typer.Option(
+        ...,
+        "--query",
+        "-q",
+        help="Text to search for, repeat to run several queries at once.",
+    ),
+    k: int = typer.Option(
+        config.SEARCH_DEFAULT_K, "-k", min=1, help="Number of results per query."
+    ),
+    model: Optional[str] = typer.Option(
+        config.AppConfig.instance().default_model,
+        help="Embedding model the file was computed with.",
+    ),
+    api_key: Optional[str] = typer.Option(
+        None,
+        help="API key for the service hosting the model. If not provided, it will be prompted or fetched from environment variables.",
+    ),
+    remote: Annotated[
+        bool,
+        typer.Option(
+            "--remote/--local",
+            help="Choose whether to do inference locally or with an API token.",
+        ),
+    ] = True,
+    label_field: Optional[str] = typer.Option(
+        "input",
+        help="Field shown for the results, defaults to the embedded text.",
+    ),
+    exact: bool = typer.Option(
+        False,
+        help="Scan all the embeddings even if an index (see `emb3d index`) is available.",
+    ),
+    nprobe: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="(Indexed search) Number of lists scanned per query, defaults to the value the index was built with.",
+    ),
+):
+    if not embedding_file.is_file():
+        raise typer.BadParameter(f"File {embedding_file} not found, aborting...")
     model = _pick_model(model)
     execution_mode = _execution_config(api_key, model, remote)
+    index = None if exact else _current_index(embedding_file)
+    with textui.SimpleProgressBar("Reading Data"):
+        if index is None:
+            X, labels = loader.load_embeddings(embedding_file, label_field)
+            dim = X.shape[1]
+        else:
+            labels = loader.load_labels(embedding_file, label_field)
+            dim = index.meta["dim"]
+    with textui.SimpleProgressBar(f"Embedding queries with {model}"):
+        if execution_mode.is_remote:
+            embed_fn = serve.remote_embed_fn(model, execution_mode.api_key)
+        else:
+            embed_fn = serve.local_embed_fn(model, execution_mode)
+        queries = np.asarray(embed_fn(query), dtype=np.float32)
+    if queries.shape[1] != dim:
+        raise typer.BadParameter(
+            f"{model} embeddings have {queries.shape[1]} dimensions, {embedding_file} has {dim}. Pass the --model the file was computed with."
+        )
 
-    with input_file_io, output_file_io:
-        num_records = sum(1 for _ in reader.line(input_file_io))
-        # Rewind
-        input_file_io.seek(0)
-        new_job = EmbedJob(
-            job_id=new_job_id(),
-            in_file=input_file_io,
-            model_id=model,
-            out_file=output_file_io,
-            total_records=num_records,
-            batch_size=batch_size,
-            max_concurrent_requests=min(max_concurrent_requests, num_records),
-            execution_config=execution_mode,
+    if index is None:
+        indices, scores = search.top_k(X, queries, k)
+    else:
+        indices, scores = index.search(queries, k, nprobe)
+    for text, row_indices, row_scores in zip(query, indices, scores):
+        typer.echo(f"\n{text}")
+        for rank, (idx, score) in enumerate(zip(row_indices, row_scores), 1):
+            if idx >= 0:
+                typer.echo(f"{rank:>4}. {score:.4f}  {labels[idx]}")
+
+
+def _current_index(embedding_file: Path) -> Optional[ann.IVFIndex]:
+    """Index of the embedding file, if one was built for its current contents"""
+    path = ann.index_dir(embedding_file)
+    if not path.is_dir():
+        return None
+    try:
+        index = ann.IVFIndex.load(path)
+    except ValueError as err:
+        typer.echo(f"{err} Using exact search.")
+        return None
+    if index.meta["source"] != artifacts.fingerprint(embedding_file):
+        typer.echo(
+            f"{embedding_file} changed since its index was built, using exact search."
+        )
+        return None
+    return index
+
+
+@app.command("index", help="Build an approximate nearest neighbour index.")
+def cmd_index(
+    embedding_file: Path = typer.Argument(
+        ...,
+        help="Path to the embedding file.",
+    ),
+    nlist: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="Number of lists the embeddings are partitioned into, defaults to the square root of the record count.",
+    ),
+    nprobe: int = typer.Option(
+        config.INDEX_DEFAULT_NPROBE,
+        min=1,
+        help="Default number of lists scanned per query, more lists improve recall but slow down queries.",
+    ),
+):
+    if not embedding_file.is_file():
+        raise typer.BadParameter(f"File {embedding_file} not found, aborting...")
+    path = ann.index_dir(embedding_file)
+    with textui.SimpleProgressBar("Building index (using: IVF-Flat)"):
+        index = ann.build(
+            lambda: loader.iter_embeddings(embedding_file, config.SEARCH_CHUNK_ROWS),
+            path,
+            nlist=nlist,
+            nprobe=nprobe,
+            source=artifacts.fingerprint(embedding_file),
         )
+    typer.echo(
+        f"Indexed {len(index)} records in {index.meta['nlist']} lists to {path}."
+    )
+    with textui.SimpleProgressBar("Measuring recall against exact search"):
+        report = ann.evaluate(index)
+    typer.echo(
+        f"Recall@10 {report['recall']:.3f} with nprobe {nprobe}, "
+        f"{report['qps']:.0f} queries/sec (exact search: {report['exact_qps']:.0f} queries/sec)."
+    )
+
+
+@app.command("dedupe", help="Find groups of near duplicate records.")
+def cmd_dedupe(
+    embedding_file: Path = typer.Argument(
+        ...,
+        help="Path to the embedding file.",
+    ),
+    threshold: float = typer.Option(
+        config.DEDUPE_DEFAULT_THRESHOLD,
+        min=0.0,
+        max=1.0,
+        help="Records with a cosine similarity of atleast this are duplicates.",
+    ),
+    output_file: Optional[Path] = typer.Option(
+        None,
+        "--output-file",
+        "-o",
+        help="Path to the output file, one group of `row_id`s per line. Defaults to <embedding file>.dupes.jsonl.",
+    ),
+    threads: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="Number of threads, defaults to all cores.",
+    ),
+    approximate: bool = typer.Option(
+        False,
+        help="Only compare records within the same list of the index built by `emb3d index`. Much faster for large files, duplicates split across lists are missed.",
+    ),
+):
+    if not embedding_file.is_file():
+        raise typer.BadParameter(f"File {embedding_file} not found, aborting...")
+    output_file = output_file or embedding_file.with_suffix(".dupes.jsonl")
 
-        compute.execute(new_job)
+    with textui.SimpleProgressBar("Reading Data"):
+        row_ids = loader.load_row_ids(embedding_file)
+        if approximate:
+            index = _current_index(embedding_file)
+            if index is None:
+                raise typer.BadParameter(
+                    f"--approximate needs an up to date index, run `emb3d index {embedding_file}` first."
+                )
+            X, positions = index.vectors, index.ids
+            blocks = list(zip(index.offsets[:-1], index.offsets[1:]))
+        else:
+            X, _ = loader.load_embeddings(embedding_file, None)
+            positions, blocks = None, None
+
+    with textui.SimpleProgressBar(
+        f"Finding pairs of {len(X)} records with similarity >= {threshold}"
+    ):
+        groups = neardup.duplicate_groups(X, threshold, blocks, threads=threads)
+
+    num_groups = num_duplicates = 0
+    with output_file.open("w") as f:
+        for rows in neardup.iter_groups(groups):
+            if positions is not None:
+                rows = positions[rows]
+            group_row_ids = np.sort(row_ids[rows])
+            f.write(codec.dumps({"row_ids": group_row_ids}) + "\n")
+            num_groups += 1
+            num_duplicates += len(rows) - 1
+    typer.echo(
+        f"Found {num_groups} groups of near duplicates, {num_duplicates} records can be removed. Groups saved to {output_file}."
+    )
 
 
 class ClusterOption(str, Enum):
@@ -204,6 +779,35 @@ class ClusterOption(str, Enum):
     no_cluster = "no-cluster"
 
 
+class RendererOption(str, Enum):
+    altair = "altair"
+    webgl = "webgl"
+
+
+class ProjectionOption(str, Enum):
+    auto = "auto"
+    exact = "exact"
+    scalable = "scalable"
+
+
+def _cached_map(
+    embedding_file: Path, projection: ProjectionOption, sample_size: int
+) -> Optional[artifacts.MapArtifacts]:
+    """Cached map of the embedding file, if it was computed with matching options"""
+    map_artifacts = artifacts.MapArtifacts.latest(embedding_file)
+    if map_artifacts is None:
+        return None
+    cached_projection = map_artifacts.params.get("projection")
+    if projection != ProjectionOption.auto and cached_projection != projection.value:
+        return None
+    if (
+        cached_projection == ProjectionOption.scalable.value
+        and map_artifacts.params.get("sample_size") != sample_size
+    ):
+        return None
+    return map_artifacts
+
+
 @app.command("visualize", help="Visualize generated embeddings.")
 def cmd_visualize(
     embedding_file: Path = typer.Argument(
@@ -221,40 +825,135 @@ def cmd_visualize(
     cluster: Annotated[
         ClusterOption, typer.Option(case_sensitive=False)
     ] = ClusterOption.auto,
+    projection: Annotated[
+        ProjectionOption,
+        typer.Option(
+            case_sensitive=False,
+            help=f"`exact` fits UMAP on all records. `scalable` reduces the records with PCA, fits UMAP on a sample and projects the rest. `auto` picks `scalable` above {config.VISUALIZATION_SCALABLE_THRESHOLD} records.",
+        ),
+    ] = ProjectionOption.auto,
+    sample_size: int = typer.Option(
+        config.VISUALIZATION_DEFAULT_SAMPLE_SIZE,
+        min=1,
+        help="(Scalable projection) Number of records UMAP is fit on.",
+    ),
+    threads: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="(Scalable projection) Number of threads, defaults to all cores.",
+    ),
+    base_map: Optional[Path] = typer.Option(
+        None,
+        help="Embedding file of a previous visualization, records are projected onto its map instead of computing a new one.",
+    ),
+    renderer: Annotated[
+        RendererOption,
+        typer.Option(
+            case_sensitive=False,
+            help="`altair` charts are interactive but slow beyond a few thousand points, records are clustered above that. `webgl` draws every record and handles millions of points.",
+        ),
+    ] = RendererOption.altair,
 ):
-    with textui.SimpleProgressBar("Reading Data"):
-        X, labels = visualize.get_data(embedding_file, label_field)
-
-    n_records, n_dims = X.shape
-    typer.echo(f"Loaded {n_records} records with {n_dims} dimensions.")
-    with textui.SimpleProgressBar(
-        f"Mapping records from {n_dims}-dimensional space to 2D (using: UMAP)."
-    ):
-        X_reduced = visualize.umap_reduce(X)
-
-    needs_clustering = (
-        cluster != ClusterOption.no_cluster
-        and n_records > config.VISUALIZATION_CLUSTERING_THRESHOLD
-    )
+    map_artifacts = None
+    cached = None
+    highlight = None
+    if base_map is None:
+        map_artifacts = _cached_map(embedding_file, projection, sample_size)
+        cached = map_artifacts.load_projection() if map_artifacts else None
+
+    if cached is not None:
+        # Re-render, only the labels are needed
+        with textui.SimpleProgressBar("Reading Labels"):
+            labels = loader.load_labels(embedding_file, label_field)
+        typer.echo(f"Reusing the cached 2D projection of {len(labels)} records.")
+        X_reduced, _ = cached
+    else:
+        with textui.SimpleProgressBar("Reading Data"):
+            X, labels = visualize.get_data(embedding_file, label_field)
+        n_records, n_dims = X.shape
+        typer.echo(f"Loaded {n_records} records with {n_dims} dimensions.")
+
+    if base_map is not None:
+        base_artifacts = artifacts.MapArtifacts.latest(base_map)
+        if base_artifacts is None:
+            raise typer.BadParameter(
+                f"No map found for {base_map}, run `emb3d visualize {base_map}` first."
+            )
+        base_coords, base_projection = base_artifacts.load_projection()
+        with textui.SimpleProgressBar(
+            f"Projecting records onto the map of {base_map}."
+        ):
+            X_new = base_projection.transform(X)
+            base_labels = loader.load_labels(base_map, label_field)
+        X_reduced = np.concatenate([base_coords, X_new])
+        labels = np.concatenate([base_labels, labels])
+        highlight = np.arange(len(X_reduced)) >= len(base_coords)
+    elif cached is None:
+        scalable = projection == ProjectionOption.scalable or (
+            projection == ProjectionOption.auto
+            and n_records > config.VISUALIZATION_SCALABLE_THRESHOLD
+        )
+        if scalable:
+            params = {"projection": "scalable", "sample_size": sample_size}
+            with textui.SimpleProgressBar(
+                f"Mapping records from {n_dims}-dimensional space to 2D (using: PCA + UMAP on {min(sample_size, n_records)} samples)."
+            ):
+                X_reduced, reducer = visualize.scalable_reduce(X, sample_size, threads)
+        else:
+            params = {"projection": "exact"}
+            with textui.SimpleProgressBar(
+                f"Mapping records from {n_dims}-dimensional space to 2D (using: UMAP)."
+            ):
+                X_reduced, reducer = visualize.umap_reduce(X)
+        map_artifacts = artifacts.MapArtifacts.open(embedding_file, params)
+        map_artifacts.save_projection(X_reduced, reducer)
+    n_records = len(X_reduced)
+
+    if renderer == RendererOption.webgl:
+        # Every record is drawn, clusters only color the points
+        needs_clustering = cluster == ClusterOption.cluster
+    else:
+        needs_clustering = (
+            cluster != ClusterOption.no_cluster
+            and n_records > config.VISUALIZATION_CLUSTERING_THRESHOLD
+        )
 
-    if (
-        n_records > config.VISUALIZATION_CLUSTERING_THRESHOLD
-        and cluster != ClusterOption.cluster
-    ):
-        typer.echo(f"Too many records to visualize, clustering data...")
+        if (
+            n_records > config.VISUALIZATION_CLUSTERING_THRESHOLD
+            and cluster != ClusterOption.cluster
+        ):
+            typer.echo(f"Too many records to visualize, clustering data...")
 
     min_cluster_size = min_cluster_size or config.VISUALIZATION_DEFAULT_MIN_CLUSTER_SIZE
-    hdbscan_model = None
+    clusters = None
     if needs_clustering:
         with textui.SimpleProgressBar(
             f"Clustering with min_cluster_size {min_cluster_size} (using: HDSCAN)."
         ):
-            hdbscan_model = visualize.cluster_hdbscan(X_reduced, min_cluster_size)
-
+            # min_samples defaults to the cluster size, as in HDBSCAN
+            single_linkage = (
+                map_artifacts.load_single_linkage(min_cluster_size)
+                if map_artifacts
+                else None
+            )
+            if single_linkage is None:
+                single_linkage = visualize.single_linkage_tree(
+                    X_reduced, min_cluster_size
+                )
+                if map_artifacts is not None:
+                    map_artifacts.save_single_linkage(single_linkage, min_cluster_size)
+            clusters = visualize.cluster_labels(single_linkage, min_cluster_size)
+
+    out_file = embedding_file.with_suffix(".2d.html")
     with textui.SimpleProgressBar("Generating Scatter Plot"):
-        chart = visualize.generate_chart(X_reduced, labels, hdbscan_model)
-        out_file = embedding_file.with_suffix(".2d.html")
-        writer.chart2html(chart, out_file)
+        if renderer == RendererOption.webgl:
+            colors = visualize.point_colors(clusters, highlight)
+            writer.scatter2html(
+                X_reduced, labels, out_file, colors, title=embedding_file.name
+            )
+        else:
+            chart = visualize.generate_chart(X_reduced, labels, clusters, highlight)
+            writer.chart2html(chart, out_file)
 
     typer.echo(f"Visualization saved to {out_file}.")
 
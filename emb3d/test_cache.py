@@ -0,0 +1,47 @@
+import sqlite3
+
+from emb3d.cache import ENTRY_OVERHEAD_BYTES, EmbeddingCache
+
+
+def test_cache_roundtrip(tmp_path):
+    with EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=10**6) as cache:
+        cache.put_many("model", ["hello", "world"], [[1.0, 2.0], [3.0, 4.0]])
+
+        assert cache.get_many("model", ["world", "other", "hello"]) == [
+            [3.0, 4.0],
+            None,
+            [1.0, 2.0],
+        ]
+        # Keys include the model id
+        assert cache.get_many("other-model", ["hello"]) == [None]
+
+
+def test_cache_lru_eviction(tmp_path):
+    entry_bytes = 2 * 4 + ENTRY_OVERHEAD_BYTES
+    with EmbeddingCache(tmp_path / "cache.sqlite", max_bytes=2 * entry_bytes) as cache:
+        cache.put_many("model", ["a"], [[1.0, 1.0]])
+        cache.put_many("model", ["b"], [[2.0, 2.0]])
+        # Touch "a" so that "b" is the least recently used entry
+        cache.get_many("model", ["a"])
+        cache.put_many("model", ["c"], [[3.0, 3.0]])
+
+        assert cache.get_many("model", ["a", "b", "c"]) == [
+            [1.0, 1.0],
+            None,
+            [3.0, 3.0],
+        ]
+        assert cache.size_bytes() == 2 * entry_bytes
+
+
+def test_cache_lookup_does_not_write(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with EmbeddingCache(path, max_bytes=10**6) as cache:
+        cache.put_many("model", ["a"], [[1.0, 1.0]])
+        (inserted,) = sqlite3.connect(path).execute("SELECT last_used FROM embeddings")
+        cache.get_many("model", ["a"])
+        # Marked as used in memory only
+        (looked_up,) = sqlite3.connect(path).execute("SELECT last_used FROM embeddings")
+        assert looked_up == inserted
+
+    (closed,) = sqlite3.connect(path).execute("SELECT last_used FROM embeddings")
+    assert closed > inserted
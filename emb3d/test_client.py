@@ -0,0 +1,59 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+
+from emb3d import client
+from emb3d.client import parse_rate_limit_headers
+from emb3d.test_utils import mock_embed_job
+from emb3d.types import ExecutionConfig, RateLimitInfo, Result
+
+
+def test_parse_rate_limit_headers():
+    headers = {
+        "X-RateLimit-Limit-Requests": "3000",
+        "X-RateLimit-Remaining-Requests": "2999",
+        "X-RateLimit-Reset-Requests": "1m0.5s",
+        "Retry-After": "20ms",
+    }
+
+    assert parse_rate_limit_headers(headers) == RateLimitInfo(
+        limit_requests=3000,
+        remaining_requests=2999,
+        reset_requests_secs=60.5,
+        retry_after_secs=0.02,
+    )
+    assert parse_rate_limit_headers({"content-type": "application/json"}) is None
+    assert parse_rate_limit_headers(None) is None
+
+
+def test_openai_result_has_rate_limits():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["input"] == ["a", "b"]
+        data = [
+            {"index": 1, "embedding": [0.0, 1.0]},
+            {"index": 0, "embedding": [1.0, 0.0]},
+        ]
+        return httpx.Response(
+            200, json={"data": data}, headers={"x-ratelimit-limit-requests": "3000"}
+        )
+
+    job = mock_embed_job(
+        model_id="text-embedding-ada-002",
+        execution_config=ExecutionConfig.remote("key"),
+    )
+    cli = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with patch("emb3d.client.httpx_client", return_value=cli):
+        resp = asyncio.run(client.gen(job, ["a", "b"]))
+
+    assert resp == Result([[1.0, 0.0], [0.0, 1.0]], RateLimitInfo(limit_requests=3000))
+
+
+def test_cohere_client_keeps_headers():
+    cli = client._CohereClient(api_key="key")
+    json_response = {"embeddings": [[1.0]], "meta": {"api_version": {}}}
+    cli._check_response(json_response, {"X-RateLimit-Limit": "100"}, 200)
+
+    headers = json_response["meta"]["response_headers"]
+    assert client.parse_rate_limit_headers(headers) == RateLimitInfo(limit_requests=100)
@@ -0,0 +1,78 @@
+import io
+import json
+import threading
+from unittest.mock import Mock, patch
+
+from emb3d import config, tokenizer
+from emb3d.compute.common import gen_records
+from emb3d.test_utils import mock_embed_job
+from emb3d.types import Backend
+
+
+def test_unavailable_tokenizer_falls_back_to_approx():
+    with patch.object(tokenizer, "TiktokenCounter", side_effect=OSError("offline")):
+        counter = tokenizer.get_counter("text-embedding-unknown", Backend.OPENAI)
+
+    assert isinstance(counter, tokenizer.ApproxCounter)
+    assert counter.count(["abcd", "ab"]) == [2, 1]
+    # Cached per model
+    assert tokenizer.get_counter("text-embedding-unknown", Backend.OPENAI) is counter
+
+
+def test_gen_records_counts_in_windows():
+    num_records = config.TOKEN_COUNT_WINDOW + 10
+    in_file = io.StringIO(
+        "\n".join(json.dumps({"text": "x" * idx}) for idx in range(num_records))
+    )
+    job = mock_embed_job(in_file=in_file, model_id="windowed")
+    counter = Mock(count=Mock(side_effect=lambda texts: [len(t) for t in texts]))
+    tokenizer.register("windowed", counter)
+
+    records = list(gen_records(job))
+
+    assert [token_count for _, _, token_count in records] == list(range(num_records))
+    assert [len(call.args[0]) for call in counter.count.call_args_list] == [
+        config.TOKEN_COUNT_WINDOW,
+        10,
+    ]
+
+
+def test_registry_is_reset_between_tests():
+    # Every test starts with an empty registry (see conftest.py)
+    assert tokenizer._counters == {}
+
+    counter = tokenizer.ApproxCounter()
+    tokenizer.register("registered", counter)
+    with patch.object(tokenizer, "_load") as load:
+        assert tokenizer.get_counter("registered", Backend.HUGGINGFACE) is counter
+    load.assert_not_called()
+
+
+def test_slow_load_does_not_block_other_models():
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load(model_id, backend):
+        if model_id == "slow":
+            loading.set()
+            release.wait(timeout=30)
+        return tokenizer.ApproxCounter()
+
+    def get_counter(model_id):
+        return threading.Thread(
+            target=tokenizer.get_counter, args=(model_id, Backend.HUGGINGFACE)
+        )
+
+    with patch.object(tokenizer, "_load", side_effect=load):
+        slow = get_counter("slow")
+        slow.start()
+        assert loading.wait(timeout=10)
+        fast = get_counter("fast")
+        fast.start()
+        fast.join(timeout=10)
+        # Loaded while "slow" is still loading
+        assert not fast.is_alive() and slow.is_alive()
+        release.set()
+        slow.join()
+
+    assert set(tokenizer._counters) == {"slow", "fast"}
@@ -1,5 +1,6 @@
 import io
 
+from emb3d import tokenizer
 from emb3d.types import EmbedJob, ExecutionConfig
 
 
@@ -16,4 +17,7 @@ def mock_embed_job(**kwargs):
     }
 
     defaults.update(kwargs)
+    # Test models have no tokenizer to download, the registry is reset after
+    # every test (see conftest.py)
+    tokenizer.register(defaults["model_id"], tokenizer.ApproxCounter())
     return EmbedJob(**defaults)
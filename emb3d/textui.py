@@ -21,12 +21,25 @@ class TaskProgressColumn(ProgressColumn):
         super().__init__()
 
     def render(self, task) -> Text:
-        max_width = len(str(task.total))
-        completed_str = str(task.completed).rjust(max_width)
-        total_str = str(task.total).rjust(max_width)
+        if task.total is None:
+            total_str = "?"
+        elif task.fields.get("estimated"):
+            total_str = f"~{task.total:.0f}"
+        else:
+            total_str = f"{task.total:.0f}"
+        completed_str = f"{task.completed:.0f}".rjust(len(total_str))
         return Text(f"{completed_str} / {total_str}")
 
 
+class ThroughputColumn(ProgressColumn):
+    """Records saved per second"""
+
+    def render(self, task) -> Text:
+        if not task.speed:
+            return Text("")
+        return Text(f"{task.speed:,.0f} rows/s", style="progress.data.speed")
+
+
 class ProgressBar(Progress):
     def get_renderables(self):
         yield Rule("Records")
@@ -44,13 +57,16 @@ class ProgressBar(Progress):
             TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
         )
         yield self.make_tasks_table(run_tasks)
-        self.columns = self.get_default_columns()
+        self.columns = (*self.get_default_columns(), ThroughputColumn())
         yield Text("\n")
         yield Rule("Overall")
         yield self.make_tasks_table(overall_tasks)
 
     def update_values(self, tracker: JobTracker):
+        # Unknown totals (streaming stdin) render as an indeterminate bar
+        total = tracker.total if tracker.total or not tracker.total_estimated else None
         for task in self.tasks:
+            self.update(task.id, total=total, estimated=tracker.total_estimated)
             if task.fields.get("task_handle") == "processing":
                 task.completed = tracker.encoding
             if task.fields.get("task_handle") == "failed":
@@ -88,7 +104,7 @@ def _recreate_progress(tracker: JobTracker):
 
 def render_ui_sync(job: EmbedJob, live: Live):
     progress = _recreate_progress(job.tracker)
-    while job.tracker.saved < job.tracker.total:
+    while not job.tracker.finished:
         live.update(render_loop(job.tracker, progress))
         time.sleep(UI_UPDATE_INTERVAL)
     live.update(render_loop(job.tracker, progress))
@@ -97,7 +113,7 @@ def render_ui_sync(job: EmbedJob, live: Live):
 async def render_ui_async(job: EmbedJob, live: Live):
     # TODO: Handle clean termination and keyboard interrupt
     progress = _recreate_progress(job.tracker)
-    while job.tracker.saved < job.tracker.total:
+    while not job.tracker.finished:
         live.update(render_loop(job.tracker, progress))
 
         await asyncio.sleep(UI_UPDATE_INTERVAL)
@@ -122,6 +138,18 @@ def render_loop(tracker: JobTracker, progress: ProgressBar):
                 expand=True,
             )
         )
+    if tracker.requests_per_minute is not None:
+        rate = f"Rate: {tracker.requests_per_minute:.0f} requests/min"
+        if tracker.concurrency_limit is not None:
+            rate += f", {tracker.concurrency_limit} concurrent"
+        table.add_row(Text(rate, style="cyan"))
+    if tracker.cache_hits or tracker.cache_misses:
+        table.add_row(
+            Text(
+                f"Cache: {tracker.cache_hits} hits / {tracker.cache_misses} misses",
+                style="cyan",
+            )
+        )
     table.add_row(
         Panel.fit(
             progress,
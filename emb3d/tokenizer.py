@@ -0,0 +1,97 @@
+"""
+Token counting
+
+A token counter is loaded once per model and counts a batch of texts at a time,
+using the model's own tokenizer where one is available: tiktoken for OpenAI and
+Hugging Face fast tokenizers for Hugging Face models. Both tokenize a batch in
+parallel threads. Models without a usable tokenizer fall back to an approximate
+count. This includes Cohere models: their tokenizers aren't published, and the
+tokenize endpoint would cost an API request per batch.
+"""
+import logging
+import threading
+from typing import Dict, List
+
+import tiktoken
+from tokenizers import Tokenizer
+
+from emb3d import config
+from emb3d.types import Backend
+
+
+class ApproxCounter:
+    """Character based estimate, used when the tokenizer isn't available"""
+
+    def count(self, texts: List[str]) -> List[int]:
+        return [len(text) // 2 for text in texts]
+
+
+class TiktokenCounter:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.encoding = tiktoken.encoding_for_model(model_id)
+
+    def __reduce__(self):
+        # Encodings can't be pickled, reader processes load their own
+        return TiktokenCounter, (self.model_id,)
+
+    def count(self, texts: List[str]) -> List[int]:
+        tokens = self.encoding.encode_batch(
+            texts, num_threads=config.TOKEN_COUNT_THREADS, disallowed_special=()
+        )
+        return [len(ids) for ids in tokens]
+
+
+class HuggingFaceCounter:
+    def __init__(self, model_id: str):
+        # Sentence transformer models are usually referred to without the org
+        repo_id = model_id if "/" in model_id else f"sentence-transformers/{model_id}"
+        self.tokenizer = Tokenizer.from_pretrained(repo_id)
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+
+    def count(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts)]
+
+
+_counters: Dict[str, object] = {}
+# Tokenizers are loaded under a per model lock, loading a tokenizer (which may
+# download it) doesn't block the other models.
+_load_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _load(model_id: str, backend: Backend):
+    try:
+        if backend == Backend.OPENAI:
+            return TiktokenCounter(model_id)
+        if backend == Backend.HUGGINGFACE:
+            return HuggingFaceCounter(model_id)
+    except Exception as err:
+        logging.warning(
+            "Tokenizer for %s is unavailable (%s), token counts are approximate",
+            model_id,
+            err,
+        )
+    return ApproxCounter()
+
+
+def register(model_id: str, counter) -> None:
+    """Use `counter` for the model instead of loading its tokenizer"""
+    with _lock:
+        _counters[model_id] = counter
+
+
+def get_counter(model_id: str, backend: Backend):
+    """Token counter for the model, loaded on first use"""
+    with _lock:
+        if model_id in _counters:
+            return _counters[model_id]
+        load_lock = _load_locks.setdefault(model_id, threading.Lock())
+    with load_lock:
+        with _lock:
+            if model_id in _counters:
+                return _counters[model_id]
+        counter = _load(model_id, backend)
+        with _lock:
+            return _counters.setdefault(model_id, counter)
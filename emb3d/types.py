@@ -6,7 +6,14 @@ from __future__ import annotations
 from collections import deque
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Dict, List, Optional, TextIO, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, TextIO, Union
+
+if TYPE_CHECKING:
+    from emb3d.cache import EmbeddingCache
+    from emb3d.compute.dedupe import DedupeIndex
+    from emb3d.io.checkpoint import Checkpoint
+    from emb3d.io.shards import ShardedWriter
+    from emb3d.io.sidecar import SidecarWriter
 
 
 class Backend(Enum):
@@ -18,11 +25,22 @@ class Backend(Enum):
     LOCAL = "Local Execution"
 
 
+@dataclass
+class RateLimitInfo:
+    """Rate limit state advertised by a backend in its response headers"""
+
+    limit_requests: Optional[int] = None
+    remaining_requests: Optional[int] = None
+    reset_requests_secs: Optional[float] = None
+    retry_after_secs: Optional[float] = None
+
+
 @dataclass
 class Result:
     """Embedding call result wrapper for a batch"""
 
     data: List[List[float]]
+    rate_limit: Optional[RateLimitInfo] = None
 
 
 @dataclass
@@ -37,14 +55,45 @@ class WaitFor:
     """
     Embedding call rate limit response handler.
     Some services like hugging face provide a wait time before retrying.
+
+    `throttled` is unset when the wait isn't caused by rate limiting (ex: a
+    model that is still loading).
     """
 
     seconds: float
     error: Optional[str]
+    rate_limit: Optional[RateLimitInfo] = None
+    throttled: bool = True
 
 
 EmbedResponse = Union[Result, Failure, WaitFor]
 
+
+class OutputFormat(str, Enum):
+    """Embedding output formats"""
+
+    JSONL = "jsonl"
+    NPY = "npy"
+
+
+class EmbeddingDtype(str, Enum):
+    """Storage precision for binary embedding outputs"""
+
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    # 8-bit per dimension scalar quantization
+    INT8 = "int8"
+    # Product quantization, one byte per sub-vector
+    PQ = "pq"
+
+
+class LocalEngine(str, Enum):
+    """Inference runtime for local models"""
+
+    TORCH = "torch"
+    ONNX = "onnx"
+
+
 OpenAIModels = ("text-embedding-ada-002",)
 CohereModels = (
     "embed-english-v2.0",
@@ -65,7 +114,18 @@ class JobTracker:
     failed: int = 0
     saved: int = 0
     total: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    requests_per_minute: Optional[float] = None
+    concurrency_limit: Optional[int] = None
     recent_errors: deque = field(default_factory=lambda: deque(maxlen=5))
+    # Streaming jobs don't count the input upfront, `total` is an estimate (or 0
+    # when unknown) until the whole input has been read.
+    total_estimated: bool = False
+
+    @property
+    def finished(self) -> bool:
+        return not self.total_estimated and self.saved >= self.total
 
 
 @dataclass
@@ -76,10 +136,25 @@ class ExecutionConfig:
 
     mode: ExecutionMode
     api_key: str
+    # Local inference processes, each loads its own copy of the model
+    workers: int = 1
+    # Local rows sorted by length per window before batching, 0 keeps file order
+    bucket_window: int = 0
+    engine: LocalEngine = LocalEngine.TORCH
+    # int8 dynamic quantization, ONNX engine only
+    quantize: bool = False
 
     @classmethod
-    def local(cls) -> ExecutionConfig:
-        return cls(cls.ExecutionMode.LOCAL, "")
+    def local(
+        cls,
+        workers: int = 1,
+        bucket_window: int = 0,
+        engine: LocalEngine = LocalEngine.TORCH,
+        quantize: bool = False,
+    ) -> ExecutionConfig:
+        return cls(
+            cls.ExecutionMode.LOCAL, "", workers, bucket_window, engine, quantize
+        )
 
     @classmethod
     def remote(cls, api_key: str) -> ExecutionConfig:
@@ -98,17 +173,63 @@ class EmbedJob:
 
     job_id: str
     in_file: TextIO
-    out_file: TextIO
+    out_file: Union[TextIO, ShardedWriter]
     model_id: str
     total_records: int
     batch_size: int
     max_concurrent_requests: int
     execution_config: ExecutionConfig
     column_name: str = "text"
+    output_format: OutputFormat = OutputFormat.JSONL
+    embedding_sidecar: Optional[SidecarWriter] = None
+    checkpoint: Optional[Checkpoint] = None
+    embedding_cache: Optional[EmbeddingCache] = None
+    dedupe: Optional[DedupeIndex] = None
+    streaming: bool = False
+    input_size_bytes: Optional[int] = None
+    # Processes parsing byte ranges of the input file, 1 reads it sequentially
+    read_workers: int = 1
     tracker: JobTracker = field(init=False)
 
     def __post_init__(self):
-        self.tracker = JobTracker(job_id=self.job_id, total=self.total_records)
+        self.tracker = JobTracker(
+            job_id=self.job_id,
+            total=self.total_records,
+            total_estimated=self.streaming,
+        )
+        if self.checkpoint is not None:
+            # Rows completed by a previous run count as saved
+            resumed = (
+                len(self.checkpoint.resumed)
+                if self.streaming
+                else self.checkpoint.resumed.count_below(self.total_records)
+            )
+            self.tracker.success = resumed
+            self.tracker.saved = resumed
+
+    def input_progress(self, rows_read: int, bytes_read: int, exhausted: bool):
+        """Input reader callback, refines the estimated total of streaming jobs"""
+        if not self.tracker.total_estimated:
+            return
+        if exhausted:
+            self.total_records = rows_read
+            self.tracker.total = rows_read
+            self.tracker.total_estimated = False
+        elif self.input_size_bytes and bytes_read:
+            self.tracker.total = max(
+                rows_read, round(rows_read * self.input_size_bytes / bytes_read)
+            )
+
+    def is_completed(self, row_id: int) -> bool:
+        """Whether the row was saved by a previous run of this job"""
+        return self.checkpoint is not None and row_id in self.checkpoint.resumed
+
+    def is_duplicate(self, row_id: int) -> bool:
+        """Whether the row's embedding is fanned out from another row"""
+        if self.dedupe is None:
+            return False
+        leader = self.dedupe.leader(row_id)
+        return leader != row_id and not self.is_completed(leader)
 
     def batch_success(self, cnt: int):
         """Success callback"""
@@ -122,6 +243,11 @@ class EmbedJob:
         """Saved callback"""
         self.tracker.saved += cnt
 
+    def batch_cache_lookup(self, hits: int, misses: int):
+        """Cache lookup callback"""
+        self.tracker.cache_hits += hits
+        self.tracker.cache_misses += misses
+
     def batch_error(self, error_msg: str):
         """Error callback"""
         self.tracker.recent_errors.append(error_msg)
@@ -150,10 +276,16 @@ class EmbedJob:
         return {
             "job_id": self.job_id,
             "model_id": self.model_id,
-            "total_records": str(self.total_records),
+            "total_records": "streaming" if self.streaming else str(self.total_records),
             "batch_size": str(self.batch_size),
             "max_concurrent_requests": str(self.max_concurrent_requests),
             "mode": self.execution_config.mode.value,
+            "output_format": self.output_format.value,
+            **(
+                {"unique_records": str(self.dedupe.num_unique)}
+                if self.dedupe is not None
+                else {}
+            ),
         }
 
 
@@ -167,3 +299,4 @@ class Batch:
     inputs: List[str]
     embeddings: Optional[List[List[float]]] = None
     error: Optional[str] = None
+    token_count: int = 0
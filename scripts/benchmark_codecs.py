@@ -0,0 +1,82 @@
+"""
+Compare the installed JSON codecs on embedding output rows.
+
+Serializes rows with float32 numpy embeddings (as written by local jobs) and
+with python lists (as returned by remote backends), then parses them back. Rows
+are generated and processed in chunks so that memory stays bounded.
+
+Usage:
+    python scripts/benchmark_codecs.py --rows 100000 --dim 1536
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from emb3d.io import codec
+
+
+def stdlib_per_row(rows):
+    """Previous output path: json.dumps per row with list embeddings"""
+    return "".join(
+        json.dumps({**row, "embedding": row["embedding"].tolist()}) + "\n"
+        for row in rows
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--chunk-size", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    codecs = codec.available_codecs()
+    timings = {
+        name: {"dump numpy": 0.0, "dump lists": 0.0, "load": 0.0} for name in codecs
+    }
+    baseline = 0.0
+    total_bytes = 0
+
+    for start in range(0, args.rows, args.chunk_size):
+        size = min(args.chunk_size, args.rows - start)
+        embeddings = rng.standard_normal((size, args.dim), dtype=np.float32)
+        rows = [
+            {"row_id": start + idx, "input": f"row {start + idx}", "embedding": vector}
+            for idx, vector in enumerate(embeddings)
+        ]
+        list_rows = [{**row, "embedding": row["embedding"].tolist()} for row in rows]
+
+        began = time.perf_counter()
+        stdlib_per_row(rows)
+        baseline += time.perf_counter() - began
+
+        for name, json_codec in codecs.items():
+            began = time.perf_counter()
+            text = json_codec.dumps_lines(rows)
+            timings[name]["dump numpy"] += time.perf_counter() - began
+
+            began = time.perf_counter()
+            json_codec.dumps_lines(list_rows)
+            timings[name]["dump lists"] += time.perf_counter() - began
+
+            began = time.perf_counter()
+            for line in text.splitlines():
+                json_codec.loads(line)
+            timings[name]["load"] += time.perf_counter() - began
+            if name == "json":
+                total_bytes += len(text)
+
+    print(
+        f"{args.rows:,} rows x {args.dim} dims, ~{total_bytes / 2**30:.2f} GiB (json)"
+    )
+    print(f"{'baseline (json.dumps per row)':<32}{baseline:>8.2f}s")
+    for name, timing in timings.items():
+        for op, secs in timing.items():
+            print(f"{f'{name} {op}':<32}{secs:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
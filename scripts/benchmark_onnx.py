@@ -0,0 +1,82 @@
+"""
+Compare the ONNX Runtime engine against sentence-transformers (PyTorch).
+
+Reports the cosine similarity of the embeddings produced by both engines and
+their throughput on a synthetic corpus of mixed length inputs.
+
+Usage:
+    python scripts/benchmark_onnx.py --model-id all-MiniLM-L6-v2 --quantize
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from emb3d.compute.local import load_model
+from emb3d.types import ExecutionConfig, LocalEngine
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while embeddings are computed".split()
+)
+
+
+def corpus(num_inputs: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(WORDS, k=rng.randint(3, 120))) for _ in range(num_inputs)
+    ]
+
+
+def timed_encode(model, inputs, batch_size):
+    start = time.perf_counter()
+    embeddings = np.concatenate(
+        [
+            np.asarray(model.encode(inputs[idx : idx + batch_size]))
+            for idx in range(0, len(inputs), batch_size)
+        ]
+    )
+    return embeddings, time.perf_counter() - start
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-id", default="all-MiniLM-L6-v2")
+    parser.add_argument("--num-inputs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+
+    inputs = corpus(args.num_inputs)
+    torch_model = load_model(args.model_id, ExecutionConfig.local())
+    onnx_model = load_model(
+        args.model_id,
+        ExecutionConfig.local(engine=LocalEngine.ONNX, quantize=args.quantize),
+    )
+
+    # Warm up both engines before timing
+    torch_model.encode(inputs[: args.batch_size])
+    onnx_model.encode(inputs[: args.batch_size])
+
+    expected, torch_secs = timed_encode(torch_model, inputs, args.batch_size)
+    actual, onnx_secs = timed_encode(onnx_model, inputs, args.batch_size)
+    similarity = cosine(expected, actual)
+
+    engine = "onnx (int8)" if args.quantize else "onnx"
+    print(f"torch: {len(inputs) / torch_secs:,.0f} inputs/s")
+    print(f"{engine}: {len(inputs) / onnx_secs:,.0f} inputs/s")
+    print(f"speedup: {torch_secs / onnx_secs:.2f}x")
+    print(
+        f"cosine similarity vs torch: min {similarity.min():.4f}, "
+        f"mean {similarity.mean():.4f}"
+    )
+
+
+if __name__ == "__main__":
+    main()